@@ -6,7 +6,11 @@ import pandas as pd
 import dalecLoad
 import spectralConv
 import SD_raster_loading
+import sceneIndex
+import sceneCatalog
+import dalecMetrics
 import os
+import concurrent.futures
 import netCDF4
 from matplotlib.dates import DateFormatter
 import matplotlib.dates as mdates
@@ -16,6 +20,7 @@ def getclosest_ij(lats, lons, latpt, lonpt):
     '''
     a function to find the index of the point closest pt
     (in squared distance) to give lat/lon value.
+    for lots of points use sceneIndex.SceneIndex instead (this checks every pixel for every point)
     '''
     # find squared distance of every point on grid
     dist_sq = (lats-latpt)**2 + (lons-lonpt)**2
@@ -25,174 +30,339 @@ def getclosest_ij(lats, lons, latpt, lonpt):
     return np.unravel_index(minindex_flattened, lats.shape)
 
 
+# rhos band names + wavelengths for each file, so that the variable list only gets searched once per file
+_rhos_bands = {}
+
+def get_SD_NC_rhos_bands(NC_file):
+    '''
+    returns the names of the surface reflectance (rhos_*) variables in a NetCDF file and their wavelengths
+    (worked out once for each file and then cached)
+    '''
+    try:
+        path = NC_file.filepath()
+        key = (path, os.stat(path).st_mtime_ns)
+    except (ValueError, OSError):
+        key = None
+    if key is None or key not in _rhos_bands:
+        # only interested in surface reflectance:
+        names = [var for var in NC_file.variables.keys() if 'rhos' in var]
+        bands = (names, np.array([float(var[5:]) for var in names]))
+        if key is None:
+            return bands
+        _rhos_bands[key] = bands
+    return _rhos_bands[key]
+
+def _window_start(ind, size):
+    # first index of a window of length size "centred" on ind (same as the old np.linspace version)
+    return ind - size // 2
+
+def read_SD_NC_windows(NC_file, iy, ix, shape=(3, 3), max_block_pixels=4000000):
+    '''
+    reads the rhos values in windows of shape=(n_x, n_y) pixels around each of the pixels (iy, ix) (can be arrays)
+    returns the band names, wavelengths and a (n_windows, n_bands, n_y, n_x) array
+    - each band is read as one slice covering every window (or one slice per window if that slice would be more than
+    max_block_pixels), instead of a separate read for every pixel
+    - pixels outside the scene and masked pixels are NaN
+    '''
+    with dalecMetrics.stage('extract', windows=len(np.atleast_1d(iy)), bytes_read=0) as record:
+        names, wavelengths, out = _read_SD_NC_windows(NC_file, iy, ix, shape, max_block_pixels, record)
+    return names, wavelengths, out
+
+def _read_SD_NC_windows(NC_file, iy, ix, shape, max_block_pixels, record):
+    names, wavelengths = get_SD_NC_rhos_bands(NC_file)
+    iy, ix = np.atleast_1d(iy), np.atleast_1d(ix)
+    ny, nx = NC_file.variables[names[0]].shape if names else (0, 0)
+    y0, x0 = _window_start(iy, shape[1]), _window_start(ix, shape[0])
+    out = np.full((len(iy), len(names), shape[1], shape[0]), np.nan)
+    if not len(iy):
+        return names, wavelengths, out
+    # bounding box of all windows, clipped to the scene
+    by0, by1 = max(y0.min(), 0), min(y0.max() + shape[1], ny)
+    bx0, bx1 = max(x0.min(), 0), min(x0.max() + shape[0], nx)
+    if by1 <= by0 or bx1 <= bx0:
+        return names, wavelengths, out
+    one_block = (by1 - by0) * (bx1 - bx0) <= max_block_pixels
+    # pixel coords of every window element and whether they're in the scene
+    yy = y0[:, None, None] + np.arange(shape[1])[None, :, None] + np.zeros(shape[0], dtype=int)[None, None, :]
+    xx = x0[:, None, None] + np.arange(shape[0])[None, None, :] + np.zeros(shape[1], dtype=int)[None, :, None]
+    inside = (yy >= 0) & (yy < ny) & (xx >= 0) & (xx < nx)
+    for b, var in enumerate(names):
+        if one_block:
+            block = NC_file.variables[var][by0:by1, bx0:bx1]
+            record['bytes_read'] += block.nbytes
+            block = np.ma.filled(block.astype(np.float64), np.nan)
+            out[:, b][inside] = block[yy[inside] - by0, xx[inside] - bx0]
+        else:
+            for w in range(len(iy)):
+                wy0, wy1 = max(y0[w], 0), min(y0[w] + shape[1], ny)
+                wx0, wx1 = max(x0[w], 0), min(x0[w] + shape[0], nx)
+                if wy1 > wy0 and wx1 > wx0:
+                    block = NC_file.variables[var][wy0:wy1, wx0:wx1]
+                    record['bytes_read'] += block.nbytes
+                    block = np.ma.filled(block.astype(np.float64), np.nan)
+                    out[w, b, wy0 - y0[w]:wy1 - y0[w], wx0 - x0[w]:wx1 - x0[w]] = block
+    return names, wavelengths, out
+
 def get_SD_NC_Spectra(NC_file, lat_pt, lon_pt):
     '''
     function to extract surface reflectance spectra from a superdoves NetCDF file at a given lat_pt, lon_pt coordinate
     
     to load ncdf file do this: netCDF4.Dataset(directory+file)
     '''
-    lat, lon = NC_file.variables['lat'][:], NC_file.variables['lon'][:]
-    iy, ix = getclosest_ij(lat, lon, lat_pt, lon_pt)
+    iy, ix, _ = sceneIndex.get_scene_index(NC_file).query(lat_pt, lon_pt)
     #print(iy, ix)
-    wavelengths = []
-    rhos = []
-    for var in list(NC_file.variables.keys()):
-        # only interested in surface reflectance:
-        if 'rhos' in var:
-            wavelengths.append(float(var[5:]))
-            rhos.append(NC_file.variables[var][iy, ix])
+    _, wavelengths, rhos = read_SD_NC_windows(NC_file, iy, ix, shape=(1, 1))
     
     df = pd.DataFrame(data={'Wavelength':wavelengths,
-                     'Rho_s':rhos})
+                     'Rho_s':rhos[0, :, 0, 0]})
     return df
 
 
+def _window_frame(wavelengths, window, iy, ix, shape):
+    # puts one window from read_SD_NC_windows() into the get_SD_NC_Spectra_grid() format
+    x = _window_start(ix, shape[0]) + np.arange(shape[0])
+    y = _window_start(iy, shape[1]) + np.arange(shape[1])
+    data = {'Wavelength': wavelengths}
+    for a, i in enumerate(x):
+        for b, j in enumerate(y):
+            # might want to think about if I want to include the lat and lon of each pixel too?
+            data['rho_s_' + str(i) + '_' + str(j)] = window[:, b, a]
+    return pd.DataFrame(data=data)
+
 def get_SD_NC_Spectra_grid(NC_file, lat_pt, lon_pt, shape=(3, 3)):
     '''
     function to extract surface reflectance spectra from a superdoves NetCDF file at a given lat_pt, lon_pt coordinate
     gets values from several pixels in a grid (with shape = shape) around the chosen coord
+    pixels outside the scene (or masked) are NaN
+    the nearest pixel is found with a cached spatial index (see sceneIndex), .attrs['inside_scene'] is False if the
+    coord isn't actually in the scene (in which case the window is around the nearest pixel on the edge)
     '''
-    lat, lon = NC_file.variables['lat'][:], NC_file.variables['lon'][:]
-    iy, ix = getclosest_ij(lat, lon, lat_pt, lon_pt)
-
-    # get wavelengths data and create df for this
-    wavelengths = []    
-    for var in list(NC_file.variables.keys()):
-        # only interested in surface reflectance:
-        if 'rhos' in var:
-            wavelengths.append(float(var[5:]))
-            
-    df1 = pd.DataFrame(data={'Wavelength':wavelengths})
-                       
-    # generate x and y coords for grid with shape=(shape[0], shape[1])
-    x = np.linspace(ix - shape[0]//2,
-                    ix + shape[0]//2 - (1 - shape[0]%2),
-                    shape[0],
-                    dtype=int)
-    y = np.linspace(iy - shape[1]//2,
-                    iy + shape[1]//2 - (1 - shape[1]%2),
-                    shape[1],
-                    dtype=int)
-    rhos = []
-    for i in x:
-        for j in y:
-            for var in list(NC_file.variables.keys()):
-                # only interested in surface reflectance:
-                if 'rhos' in var:
-                    rhos.append(NC_file.variables[var][j, i])
-            # might want to think about if I want to include the lat and lon of each pixel too?
-            var_name = 'rho_s_' + str(i) + '_' + str(j)
-            df2 = pd.DataFrame(data={var_name:rhos})
-            df1 = pd.concat([df1, df2], axis=1)
-            rhos = []
-    return df1
+    iy, ix, inside = sceneIndex.get_scene_index(NC_file).query(lat_pt, lon_pt)
+    _, wavelengths, rhos = read_SD_NC_windows(NC_file, iy, ix, shape=shape)
+    df = _window_frame(wavelengths, rhos[0], iy[0], ix[0], shape)
+    df.attrs['inside_scene'] = bool(inside[0])
+    return df
 
-def load_multiple_SDs(SD_directory, coord, pixel_grid_shape=(1, 1), div_by_pi=True, skipSameDay=True):
+def get_SD_NC_Spectra_grids(NC_file, coords, shape=(3, 3)):
+    '''
+    same as get_SD_NC_Spectra_grid() but for a list of (lat, lon) coords, reading each band only once for all of them
+    returns a list of dfs (one per coord)
+    '''
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    iy, ix, inside = sceneIndex.get_scene_index(NC_file).query(coords[:, 0], coords[:, 1])
+    _, wavelengths, rhos = read_SD_NC_windows(NC_file, iy, ix, shape=shape)
+    dfs = []
+    for w in range(len(coords)):
+        dfs.append(_window_frame(wavelengths, rhos[w], iy[w], ix[w], shape))
+        dfs[-1].attrs['inside_scene'] = bool(inside[w])
+    return dfs
+
+def _extract_SD_scene(file, coord, shape):
+    # extracts the grid from one scene - top level function so it can be run in a process pool
+    # the file is closed as soon as we're done with it, so at most one file per worker is ever open
+    with netCDF4.Dataset(file) as f:
+        SD_spect = get_SD_NC_Spectra_grid(f, coord[0], coord[1], shape=shape)
+        return f.isodate, SD_spect
+
+def _extract_SD_scene_safe(args):
+    # same as _extract_SD_scene() but returns any error instead of raising it, so one bad file doesn't stop the rest
+    try:
+        return _extract_SD_scene(*args), None
+    except Exception as e:
+        return None, type(e).__name__ + ': ' + str(e)
+
+def load_multiple_SDs(SD_directory, coord, pixel_grid_shape=(3, 3), div_by_pi=True, skipSameDay=True,
+                      catalog=None, start=None, end=None, n_workers=None):
     '''
     Loads all L2R netcdfs in a given directory. Then extracts a grid of shape=pixel_grid_shape at the given coord
     Returns a pandas DF with Date, Wavelength, and rho_s columns
     Note that the rho_s columns will be formatted as per `SD_NC_loading.get_SD_NC_Spectra_grid()`
     option div_by_pi will change the units to match the DALEC units
     skipSameDay will skip images which are from the same day, using the earliest image.
+    - only scenes whose bounding box covers coord (and between start and end, if given) are opened, these are found
+    with a sceneCatalog.SceneCatalog, so only new / changed files need reading each time: catalog can be one, or the
+    filename of one
+    - by default (catalog=None) this writes a SQLite file at sceneCatalog.default_catalog_path(SD_directory), ie.
+    <dalecCache.DEFAULT_CACHE_DIR>/scene_catalogs/<hash of SD_directory>.sqlite (~/.cache/DALEC_processing unless
+    the DALEC_CACHE_DIR environment variable is set), which is kept between calls - pass catalog=':memory:' to not
+    write anything, at the cost of opening every file in SD_directory on every call
+    - n_workers extracts that many scenes at once with a pool of processes (useful when the files are on a network
+    share). Each worker only has one file open at a time, so n_workers is also the most files that are ever open at
+    once. In this mode a file which fails to load doesn't stop the rest - the error message for each failed file is
+    kept in .attrs['errors'] of the returned df instead
+    - .attrs['errors'] also has every file in SD_directory which the catalog couldn't read (it can't tell whether these
+    cover coord, so they're all reported)
+    (threads would be nicer but the netCDF C library isn't thread safe - it crashes with more than one file being read)
     '''
-    # could use list comprehensions in a few places here if things start getting slow!
-    SD_files = []
-    for file in os.listdir(SD_directory):
-        if file.endswith("L2R.nc"):
-            SD_files.append(os.path.join(SD_directory, file))
-
+    own_catalog = catalog is None or isinstance(catalog, str)
+    if own_catalog:
+        catalog = sceneCatalog.SceneCatalog(sceneCatalog.default_catalog_path(SD_directory)
+                                            if catalog is None else catalog)
+    try:
+        catalog.update(SD_directory)
+        scenes = catalog.query(lat=coord[0], lon=coord[1], start=start, end=end, firstPerDay=skipSameDay,
+                               directory=SD_directory)
+        # files the catalog couldn't read never get as far as being queried, but still need reporting
+        unreadable = catalog.errors(directory=SD_directory)
+    finally:
+        # a catalog passed in is left open for the caller
+        if own_catalog:
+            catalog.close()
+    SD_files = list(scenes['path'])
+
+    jobs = [(file, coord, pixel_grid_shape) for file in SD_files]
+    errors = dict(zip(unreadable['path'], unreadable['error']))
+    with dalecMetrics.stage('load_multiple_SDs', scenes=len(jobs), n_workers=n_workers) as record:
+        if n_workers is None:
+            results = [(_extract_SD_scene(*job), None) for job in jobs]
+        else:
+            dalecMetrics.note('extracting from ' + str(len(jobs)) + ' scenes with ' + str(n_workers) + ' processes ...')
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool:
+                results = list(pool.map(_extract_SD_scene_safe, jobs))
+        record['scenes_failed'] = sum(error is not None for _, error in results)
+        record['scenes_unreadable'] = len(unreadable)
     ncdf_dates = []
-    indexes = []
     SD_spect_list = []
+    for file, (result, error) in zip(SD_files, results):
+        if error is None:
+            ncdf_dates.append(result[0])
+            SD_spect_list.append(result[1])
+        else:
+            dalecMetrics.warn('failed to load ' + str(file) + ' - ' + error, file=str(file))
+            errors[file] = error
 
-    for i in range(len(SD_files)):
-        f = netCDF4.Dataset(SD_files[i])
-        SD_spect = get_SD_NC_Spectra_grid(f, coord[0], coord[1], shape=(3, 3))
-        ncdf_dates.append(f.isodate)
-        indexes.append(i)
-        SD_spect_list.append(SD_spect)
-    
     # currently my code which removes images from the same date relies on the images being sorted in date order ...
-    SD_spect_list_sorted = [x for _, x in sorted(zip(ncdf_dates, SD_spect_list))]
-    sorted_dates = sorted(ncdf_dates)
-    
-    SD_df = None # this is almost definitely uneccesary
-    
+    order = sorted(range(len(ncdf_dates)), key=lambda i: ncdf_dates[i])
+    SD_spect_list_sorted = [SD_spect_list[i] for i in order]
+    sorted_dates = [ncdf_dates[i] for i in order]
+
+    SD_dfs = []
     # perhaps have removing images from same date as an option??
     for i in range(len(SD_spect_list_sorted)):
         SD_spect = SD_spect_list_sorted[i]
         date = sorted_dates[i]
-        if (date[:10] == sorted_dates[i-1][:10]) and skipSameDay:
-            print('...skipping duplicate date entry on ' + str(date[:10]) + 
-                  ' (set skipSameDay=False to disable this)')
+        if i > 0 and (date[:10] == sorted_dates[i-1][:10]) and skipSameDay:
+            dalecMetrics.note('...skipping duplicate date entry on ' + str(date[:10]) +
+                              ' (set skipSameDay=False to disable this)')
         else:
             SD_df_tmp = SD_spect.copy()
             SD_df_tmp['Date'] = pd.to_datetime(date)
             SD_df_tmp['Date'] = SD_df_tmp['Date'].dt.date # just removes the time aspect from the variable
             SD_df_tmp.set_index(['Date', 'Wavelength'], inplace=True)
-            if SD_df is None:
-                SD_df = SD_df_tmp.copy()
-            else:
-                SD_df = pd.concat([SD_df, SD_df_tmp])
+            SD_dfs.append(SD_df_tmp)
 
+    if SD_dfs:
+        SD_df = pd.concat(SD_dfs)
+    else:
+        SD_df = pd.DataFrame(columns=['Date', 'Wavelength']).set_index(['Date', 'Wavelength'])
     if div_by_pi:
         SD_df = SD_df.div(np.pi)
     # don't really need to sort, but in case I change something its good to have:
-    return SD_df.sort_values(['Date', 'Wavelength'])
+    SD_df = SD_df.sort_values(['Date', 'Wavelength'])
+    SD_df.attrs['errors'] = errors
+    return SD_df
+
+def _summarise_DALEC_file(file, spect_wavelengths, RSR_doves, dalec_summary_function, DALEC_col_name, dateOnly,
+                          doves_wavelengths, cache, cache_dir):
+    # load + summarise + band convolution for one file - top level function so it can be run in a process pool
+    dalec_log = dalecLoad.load_DALEC_log(file, cache=cache, cache_dir=cache_dir)
+    mean_spect = dalec_summary_function(dalec_log, spect_wavelengths)
+    DALEC_SD = spectralConv.SD_band_calc(RSR_doves, mean_spect['Rrs_mean'].values,
+                                         RSR_doves['Wavelength (nm)'].values)
+    DALEC_df_tmp = pd.DataFrame(data=DALEC_SD, columns=[DALEC_col_name])
+    DALEC_df_tmp['Date'] = pd.to_datetime(dalec_log[' UTC Date'].iloc[0])
+    if dateOnly:
+        DALEC_df_tmp['Date'] = DALEC_df_tmp['Date'].dt.date # just removes the time aspect from the variable
+    DALEC_df_tmp['Wavelength'] = doves_wavelengths
+    DALEC_df_tmp.set_index(['Date', 'Wavelength'], inplace=True)
+    return DALEC_df_tmp
+
+def _summarise_DALEC_file_safe(args):
+    # same as _summarise_DALEC_file() but returns any error instead of raising it, so one bad file doesn't stop the rest
+    try:
+        return _summarise_DALEC_file(*args), None
+    except Exception as e:
+        return None, type(e).__name__ + ': ' + str(e)
 
 def load_SD_summarise_multiple_DALEC_days(DALEC_directory, RSR_doves_file='non-DALEC-data/RSR-Superdove.csv',
                                           file_names=None, dalec_summary_function=dalecLoad.uniform_grid_spectra_mean,
-                                          DALEC_col_name='DALEC_mean_Rrs', dateOnly=True):
+                                          DALEC_col_name='DALEC_mean_Rrs', dateOnly=True, cache=False, cache_dir=None,
+                                          n_workers=None):
     '''
     Loads multiple DALEC log files and then carries out the specified daily summary operation on these.
     Then resamples to superdoves wavebands and saves the data in a nice dataframe with Date, Wavelength and DALEC_col_name
     dateOnly removes the time aspect from the Date column
+    cache=True uses the on-disk cache of loaded DALEC logs (see dalecCache), so files only get parsed once
+    n_workers spreads the files over a pool of that many processes (dalec_summary_function needs to be a top level
+    function for this). In this mode a file which fails to load doesn't stop the rest - the error message for each
+    failed file is kept in .attrs['errors'] of the returned df instead
     '''
     supported_functions = [dalecLoad.uniform_grid_spectra_mean]
     if dalec_summary_function not in supported_functions:
-        print("I've not tested this summary function yet! It might not (probably won't) work! ")
+        dalecMetrics.warn("I've not tested this summary function yet! It might not (probably won't) work! ")
     
     RSR_doves = pd.read_csv(RSR_doves_file)
     
     if file_names is None: # if None, then load all DALEC transect (.dtf) files in the directory
         DALEC_files = []
-        for file in os.listdir(DALEC_directory):
+        for file in sorted(os.listdir(DALEC_directory)):
             if file.endswith(".dtf"):
                 DALEC_files.append(os.path.join(DALEC_directory, file))
     else:
         DALEC_files = [DALEC_directory + file for file in file_names]
 
-    DALEC_df = None # just initialise as None idk
-    
     # assuming that the spectral wavelength info is the same for each file
     # this is almost definitely always the case... (unless perhaps we used a different DALEC?)
-    spect_wavelengths = dalecLoad.load_DALEC_spect_wavelengths(DALEC_files[0])
+    # taken from the first file with a readable header - with n_workers a bad file is recorded rather than stopping
+    # everything, same as when it fails in a worker
+    errors = {}
+    spect_wavelengths = None
+    for file in DALEC_files:
+        try:
+            spect_wavelengths = dalecLoad.load_DALEC_spect_wavelengths(file)
+            break
+        except Exception as e:
+            if n_workers is None:
+                raise
+            dalecMetrics.warn('failed to load ' + str(file) + ' - ' + type(e).__name__ + ': ' + str(e), file=str(file))
+            errors[file] = type(e).__name__ + ': ' + str(e)
     # would be a bit nicer to not hard code these, but would require also reading a SD file
     # see SD_NC_loading.get_SD_NC_Spectra() for how to do this
-    doves_wavelengths = [444., 492., 533., 566., 612., 666., 707., 866.]
+    doves_wavelengths = spectralConv.DOVES_WAVELENGTHS
     
     # as we know, loading DALEC files isnae that fast...
     # currently some weird stuff will happen if we include log files which are from serial output
     # basically need dalecLoad.load_DALEC_log() to be super robust for this to work! 
-    for file in DALEC_files:
-        print('loading ... ' + str(file))
-        dalec_log = dalecLoad.load_DALEC_log(file)
-        mean_spect = dalec_summary_function(dalec_log, spect_wavelengths)
-        DALEC_SD = spectralConv.SD_band_calc(RSR_doves, mean_spect['Rrs_mean'].values,
-                                             RSR_doves['Wavelength (nm)'].values)
-        DALEC_df_tmp = pd.DataFrame(data=DALEC_SD, columns=[DALEC_col_name])
-        DALEC_df_tmp['Date'] = pd.to_datetime(dalec_log[' UTC Date'].iloc[0])
-        if dateOnly:
-            DALEC_df_tmp['Date'] = DALEC_df_tmp['Date'].dt.date # just removes the time aspect from the variable
-        DALEC_df_tmp['Wavelength'] = doves_wavelengths
-        DALEC_df_tmp.set_index(['Date', 'Wavelength'], inplace=True)
-        if DALEC_df is None:
-            DALEC_df = DALEC_df_tmp.copy()
+    jobs = [(file, spect_wavelengths, RSR_doves, dalec_summary_function, DALEC_col_name, dateOnly,
+             doves_wavelengths, cache, cache_dir) for file in DALEC_files if file not in errors]
+    with dalecMetrics.stage('load_SD_summarise_multiple_DALEC_days', files=len(jobs), n_workers=n_workers) as record:
+        if n_workers is None:
+            DALEC_dfs = []
+            for job in jobs:
+                dalecMetrics.note('loading ... ' + str(job[0]))
+                DALEC_dfs.append(_summarise_DALEC_file(*job))
         else:
-            DALEC_df = pd.concat([DALEC_df, DALEC_df_tmp])
-            
+            dalecMetrics.note('loading ' + str(len(jobs)) + ' files with ' + str(n_workers) + ' processes ...')
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool:
+                # map keeps the results in the same order as the files
+                results = list(pool.map(_summarise_DALEC_file_safe, jobs))
+            DALEC_dfs = []
+            for file, (DALEC_df_tmp, error) in zip([job[0] for job in jobs], results):
+                if error is None:
+                    DALEC_dfs.append(DALEC_df_tmp)
+                else:
+                    dalecMetrics.warn('failed to load ' + str(file) + ' - ' + error, file=str(file))
+                    errors[file] = error
+        record['files_failed'] = len(errors)
+
+    if DALEC_dfs:
+        DALEC_df = pd.concat(DALEC_dfs)
+    else:
+        DALEC_df = pd.DataFrame(columns=['Date', 'Wavelength', DALEC_col_name]).set_index(['Date', 'Wavelength'])
     # probably smart to sort in case we get some weird stuff happenin' with file order etc.
-    return DALEC_df.sort_values(['Date', 'Wavelength'])
+    DALEC_df = DALEC_df.sort_values(['Date', 'Wavelength'])
+    DALEC_df.attrs['errors'] = errors
+    return DALEC_df
 
 
 def join_DALEC_SD_dfs(DALEC_df, SD_df, dropNA=True):
@@ -203,6 +373,7 @@ def join_DALEC_SD_dfs(DALEC_df, SD_df, dropNA=True):
     dropNA removes dates where there is no date overlap between DALEC and SD data
     in future this might become more complex if I have different summary functions or if I want to match up data which
     isn't from the same day
+    (to match up individual samples with the overpass times, within +- some time window, see timeMatchup)
     '''
     if dropNA:
         superDuperDF = DALEC_df.join(SD_df, on=['Date', 'Wavelength']).dropna()
@@ -212,14 +383,19 @@ def join_DALEC_SD_dfs(DALEC_df, SD_df, dropNA=True):
     return superDuperDF
 
 
+def _as_superDuperDF(df):
+    # lets the plotting / algorithm functions be given a matchupStore.MatchupStore (with just one site) instead of a df
+    return df.superDuperDF() if hasattr(df, 'superDuperDF') else df
+
 def multiDaySpectraPlot(superDuperDF, DALEC_param='DALEC_mean_Rrs', SD_col_slice=slice(1, None, 1),
                         figsize=None, SD_label='SD_Spectra', ylim=None, grid=True, show_plot=True):
     '''
     takes a DF, superDuperDF, with columns 'Date', 'Wavelength', DALEC_param, and SD data which is selected using SD_col_slice
-    superDuperDF can be created with join_DALEC_SD_dfs()
+    superDuperDF can be created with join_DALEC_SD_dfs() (or be a matchupStore.MatchupStore)
     
     generates a series of Rrs vs wavelength plots for each date in the DF 
     '''
+    superDuperDF = _as_superDuperDF(superDuperDF)
     # if I want more flexibility then I could try using some **kwargs?
     # would need to decide which plot call these would be for... - both?
 
@@ -279,17 +455,15 @@ def Plot_matchUp_SD_DALEC(DALEC_log, spect_wavelengths, RSR_doves, NC_file, lat_
     if ax is None:
         ax = plt.gca()
     # do plotting
-    print('warning: this is gonna be super duper slow for lots of samples :)')
-    for sample in DALEC_log.index.get_level_values('Sample #').unique():
-        dalec_SD = spectralConv.SD_Rrs(RSR_doves,
-                                       DALEC_log.loc[sample],
-                                       spect_wavelengths)
-        ax.plot(dalec_SD['Wavelength'],
-                 dalec_SD['Rrs'],
-                 marker='o',
-                 alpha=0.2,
-                 color='blue',
-                 label='DALEC')
+    # band Rrs for every sample in one go, one line per sample
+    dalec_SD = spectralConv.SD_Rrs_batch(RSR_doves, DALEC_log, spect_wavelengths)
+    wavelengths = dalec_SD.index.get_level_values('Wavelength').unique().values
+    ax.plot(wavelengths,
+             dalec_SD['Rrs'].values.reshape(-1, len(wavelengths)).T,
+             marker='o',
+             alpha=0.2,
+             color='blue',
+             label='DALEC')
 
     for col in list(SD_spect.columns.values)[1:]:
         ax.plot(SD_spect['Wavelength'],
@@ -322,7 +496,9 @@ def plot_multiDay_SD_DALEC_matchup(superDuperDF, DALEC_param='DALEC_mean_Rrs', S
                                    x_y_line=True, show_plot=True):
     '''
     generates Rrs-insitu vs Rrs-SD plots for all SD wavebands with a given DF with Date, Wavelength columns 
+    (or a matchupStore.MatchupStore)
     '''
+    superDuperDF = _as_superDuperDF(superDuperDF)
     fig, ax = plt.subplots(2, 4, figsize=figsize)
 
     ax = ax.flatten()
@@ -387,7 +563,9 @@ def NDPCI(Rrs_707, Rrs_612, alpha=46.478, beta=5.1864):
 def NDPCI_from_DF(df, col_name='DALEC_mean_Rrs', alpha=46.478, beta=5.1864):
     '''
     convenience function to extract Rrs_707 and Rrs_612 from a superduperdf kinda df and use this to call NDPCI()
+    df can also be a matchupStore.MatchupStore
     '''
+    df = _as_superDuperDF(df)
     Rrs_612 = df.loc[(df.index.get_level_values(0)[:],612.0), :][col_name].values
     Rrs_707 = df.loc[(df.index.get_level_values(0)[:],707.0), :][col_name].values
     return NDPCI(Rrs_707, Rrs_612, alpha=alpha, beta=beta)
@@ -399,7 +577,9 @@ def plot_algorithm_from_DF(df, algorithm=NDPCI_from_DF, col_names=None, show_leg
     '''
     applies the chosen algorithm to the selected columns of the DF and plots the results
     if no column names are specified, then all columns will be processed and plotted
+    df can also be a matchupStore.MatchupStore
     '''
+    df = _as_superDuperDF(df)
     if col_names is None:
         col_names = list(df.columns.values)
     results = [algorithm(df, col_name=col, **kwargs) for col in col_names]
@@ -1,10 +1,86 @@
+import os
+import functools
+import hashlib
 import numpy as np
 import rasterio
-import rasterio.sample 
+import rasterio.enums
+import rasterio.transform
+import rasterio.windows
 from rasterio.plot import reshape_as_raster, reshape_as_image
 from pyproj import Transformer
 import pandas as pd
 import matplotlib.pyplot as plt
+import dalecCache
+import dalecMetrics
+
+# superdoves band centres (nm) of the surface reflectance tif bands
+SDSR_WAVELENGTHS = [443, 490, 531, 565, 610, 665, 705, 865]
+
+@functools.lru_cache(maxsize=32)
+def get_transformer(crs_coords='WGS 84', crs_SD='epsg:32630'):
+    '''
+    pyproj Transformer from crs_coords to crs_SD, only made once for each pair of CRSs (making one takes a few ms,
+    which adds up when extracting lots of points)
+    '''
+    return Transformer.from_crs(crs_coords, crs_SD)
+
+def coords_to_pixels(dataset, xx, yy, crs_SD='epsg:32630', crs_coords='WGS 84'):
+    '''
+    row and col (arrays) of the pixels of an open rasterio dataset at coords xx, yy (in crs_coords)
+    '''
+    xxT, yyT = get_transformer(crs_coords, crs_SD).transform(np.atleast_1d(xx), np.atleast_1d(yy))
+    # rowcol() rather than dataset.index() so that every coord is done at once
+    rows, cols = rasterio.transform.rowcol(dataset.transform, np.atleast_1d(xxT), np.atleast_1d(yyT))
+    return np.atleast_1d(rows).astype(int), np.atleast_1d(cols).astype(int)
+
+def _window_groups(row0, col0, tile_size):
+    # windows are grouped by the tile_size x tile_size tile their top left corner is in, so that windows close to each
+    # other (eg. along a transect) are read together while ones far apart don't make the read cover everything in between
+    tiles = np.column_stack([row0 // tile_size, col0 // tile_size])
+    _, group = np.unique(tiles, axis=0, return_inverse=True)
+    group = group.ravel()
+    order = np.argsort(group, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(group[order])) + 1)
+
+def read_SDSR_windows(dataset, rows, cols, shape=(3, 3), tile_size=64):
+    '''
+    reads windows of shape=(n_rows, n_cols) pixels around each (row, col) pixel of an open rasterio dataset
+    returns a (n_windows, n_bands, n_rows, n_cols) array, scaled the same way as getSpectraFromSDSR()
+    - only the pixels around the windows are read (not the whole raster): windows near each other (whose corners are in
+    the same tile_size x tile_size tile) are merged into one read covering all of them, so overlapping windows are only
+    read once
+    - pixels outside the raster (or nodata) are NaN
+    '''
+    rows, cols = np.atleast_1d(rows).astype(int), np.atleast_1d(cols).astype(int)
+    with dalecMetrics.stage('extract', windows=len(rows), bytes_read=0) as record:
+        return _read_SDSR_windows(dataset, rows, cols, shape, tile_size, record)
+
+def _read_SDSR_windows(dataset, rows, cols, shape, tile_size, record):
+    row0, col0 = rows - shape[0]//2, cols - shape[1]//2
+    out = np.full((len(rows), dataset.count, shape[0], shape[1]), np.nan)
+    # pixel offsets within a window
+    dr = np.arange(shape[0])[:, None] + np.zeros(shape[1], dtype=int)
+    dc = np.arange(shape[1])[None, :] + np.zeros((shape[0], 1), dtype=int)
+    for group in (_window_groups(row0, col0, tile_size) if len(rows) else []):
+        # clipped to the raster, nothing to read if there's no overlap
+        r0, r1 = max(row0[group].min(), 0), min(row0[group].max() + shape[0], dataset.height)
+        c0, c1 = max(col0[group].min(), 0), min(col0[group].max() + shape[1], dataset.width)
+        if r1 <= r0 or c1 <= c0:
+            continue
+        block = dataset.read(window=rasterio.windows.Window(c0, r0, c1 - c0, r1 - r0))
+        record['bytes_read'] += block.nbytes
+        block = block.astype(np.float64)
+        if dataset.nodata is not None:
+            block[block == dataset.nodata] = np.nan
+        block /= 2**16
+        rr = row0[group, None, None] + dr
+        cc = col0[group, None, None] + dc
+        inside = (rr >= r0) & (rr < r1) & (cc >= c0) & (cc < c1)
+        # (n_inside, n_bands) -> put back in each window
+        windows = out[group].transpose(0, 2, 3, 1)
+        windows[inside] = block[:, rr[inside] - r0, cc[inside] - c0].T
+        out[group] = windows.transpose(0, 3, 1, 2)
+    return out
 
 def getSpectraFromSDSR(rasterFile, xx, yy, crs_SD='epsg:32630', crs_coords= 'WGS 84'):
     '''
@@ -14,70 +90,132 @@ def getSpectraFromSDSR(rasterFile, xx, yy, crs_SD='epsg:32630', crs_coords= 'WGS
     - default: take input coords in WGS 84 format (N, W: eg. 56.147209, -3.923337) and then index the tif using epsg:32630
     but this can be changed where needed (eg. if looking at data outside UK then epsg:32630 might not be appropriate)
     CRS must be specified in the pyproj string format 
+    - coords outside the raster (or on nodata pixels) give NaN
     '''
-    transformer = Transformer.from_crs(crs_coords, crs_SD)
-    xxT, yyT = transformer.transform(xx, yy)
     with rasterio.open(rasterFile) as dataset:
-        try:
-            spect = rasterio.sample.sample_gen(dataset, zip(xxT, yyT))
-        except TypeError:
-            spect = rasterio.sample.sample_gen(dataset, zip([xxT], [yyT]))
+        rows, cols = coords_to_pixels(dataset, xx, yy, crs_SD=crs_SD, crs_coords=crs_coords)
+        data = read_SDSR_windows(dataset, rows, cols, shape=(1, 1))[:, :, 0, 0].T
         wavelengths = pd.DataFrame(data={'Band Name':dataset.descriptions,
-                                         'Wavelength':[443, 490, 531, 565, 610, 665, 705, 865]})
-        data = np.array(list(spect)).T/(2**16)
+                                         'Wavelength':SDSR_WAVELENGTHS})
     df = pd.DataFrame(data=data)
     df = wavelengths.join(df)
     return df
 
+def _window_frame(descriptions, window):
+    # puts one window from read_SDSR_windows() into the getSpectraFromSDSR_grid() format
+    # (columns go down each column of pixels in turn)
+    wavelengths = pd.DataFrame(data={'Band Name':descriptions,
+                                     'Wavelength':SDSR_WAVELENGTHS})
+    df = pd.DataFrame(data=window.transpose(0, 2, 1).reshape(window.shape[0], -1))
+    return wavelengths.join(df)
+
 def getSpectraFromSDSR_grid(rasterFile, x, y, shape=(3, 3), crs_SD='epsg:32630', crs_coords= 'WGS 84'):
     '''
     generates grid with shape = shape around the coord (x, y) of interest (default crs for coord WGS84)
     returns spectra for each coord in pandas df
+    only the pixels in the grid are read from the file, pixels outside the raster (or nodata) are NaN
     '''
-    transformer = Transformer.from_crs(crs_coords, crs_SD)
-    xxT, yyT = transformer.transform(x, y)
-    
+    return getSpectraFromSDSR_grids(rasterFile, [(x, y)], shape=shape, crs_SD=crs_SD, crs_coords=crs_coords)[0]
+
+def getSpectraFromSDSR_grids(rasterFile, coords, shape=(3, 3), crs_SD='epsg:32630', crs_coords= 'WGS 84'):
+    '''
+    same as getSpectraFromSDSR_grid() but for a list of (x, y) coords, opening the file once and reading nearby /
+    overlapping grids together (see read_SDSR_windows())
+    returns a list of dfs (one per coord)
+    '''
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
     with rasterio.open(rasterFile) as dataset:
-        row, col = dataset.index(xxT, yyT)
-        # generate x and y coords for grid with shape=(shape[0], shape[1])
-        rows = np.linspace(row - shape[0]//2,
-                        row + shape[0]//2 - (1 - shape[0]%2),
-                        shape[0],
-                        dtype=int)
-        cols = np.linspace(col - shape[1]//2,
-                        col + shape[1]//2 - (1 - shape[1]%2),
-                        shape[1],
-                        dtype=int)
-      
-        inds = (np.tile(rows, len(cols)), np.repeat(cols, len(rows)))
-        spect = dataset.read()[np.index_exp[:] + inds]
-        wavelengths = pd.DataFrame(data={'Band Name':dataset.descriptions,
-                                         'Wavelength':[443, 490, 531, 565, 610, 665, 705, 865]})
-        
-        data = np.array(list(spect))/(2**16)
-        
-    df = pd.DataFrame(data=data)
-    df = wavelengths.join(df)
-    return df
+        rows, cols = coords_to_pixels(dataset, coords[:, 0], coords[:, 1], crs_SD=crs_SD, crs_coords=crs_coords)
+        windows = read_SDSR_windows(dataset, rows, cols, shape=shape)
+        descriptions = dataset.descriptions
+    return [_window_frame(descriptions, window) for window in windows]
+
+# bands 2, 4 and 6 (blue, green, red), in RGB order (rasterio band numbers start at 1)
+RGB_BANDS = [6, 4, 2]
+# rendered previews, so flicking back to a scene doesn't read it again
+_previews = {}
+MAX_CACHED_PREVIEWS = 64
+
+def _stretch(image, percentiles):
+    # scales each band of a (rows, cols, 3) image to 0->1 between the given percentiles (NaNs are ignored, then set to 0)
+    lo, hi = np.nanpercentile(image.reshape(-1, 3), percentiles, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        image = np.clip((image - lo) / (hi - lo), 0, 1)
+    return np.nan_to_num(image)
 
-def plotSDRaster(rasterFile, ax=None, overDrive=1.0, plotShow=False):
+def getSDRasterPreview(rasterFile, max_size=1024, percentiles=(2, 98), cache=True, cache_dir=None):
+    '''
+    RGB preview of a superdoves raster, as a (rows, cols, 3) float array scaled to 0->1
+    - only the 3 RGB bands are read, at roughly max_size pixels along the longest side: GDAL uses the GeoTIFF overviews
+    if the file has any, otherwise the read is decimated (every n'th pixel) rather than the full image being read
+    - each band is stretched between the given percentiles of the preview (nodata pixels ignored), which copes with
+    clouds / glint a lot better than min -> max
+    - cache keeps the preview in memory (per path, mtime and options), cache_dir also saves it there as a .npy so
+    it's quick to get back in later sessions (eg. dalecCache.DEFAULT_CACHE_DIR)
+    '''
+    st = os.stat(rasterFile)
+    key = (os.path.abspath(rasterFile), st.st_size, st.st_mtime_ns, max_size, tuple(percentiles))
+    if cache and key in _previews:
+        return _previews[key]
+    cache_file = None
+    if cache_dir is not None:
+        name = hashlib.sha1(repr(key).encode()).hexdigest() + '.npy'
+        cache_file = os.path.join(cache_dir, 'previews', name)
+        if os.path.exists(cache_file):
+            image = np.load(cache_file)
+            if cache:
+                _previews[key] = image
+            return image
+
+    with dalecMetrics.stage('preview', file=str(rasterFile)) as record:
+        with rasterio.open(rasterFile) as dataset:
+            scale = max(1.0, max(dataset.height, dataset.width) / max_size)
+            out_shape = (3, max(1, int(round(dataset.height / scale))), max(1, int(round(dataset.width / scale))))
+            data = dataset.read(RGB_BANDS, out_shape=out_shape, resampling=rasterio.enums.Resampling.nearest,
+                                masked=True)
+        record['bytes_read'] = data.data.nbytes
+        image = np.ma.filled(data.astype(np.float64), np.nan).transpose(1, 2, 0)
+        image = _stretch(image, percentiles)
+
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                np.save(f, image)
+        dalecCache._write_atomic(cache_file, write)
+    if cache:
+        if len(_previews) >= MAX_CACHED_PREVIEWS:
+            _previews.clear()
+        _previews[key] = image
+    return image
+
+def plotSDRaster(rasterFile, ax=None, overDrive=1.0, plotShow=False, preview=False, max_size=1024,
+                 percentiles=(2, 98), cache=True, cache_dir=None):
     '''
     quick function to get a plot of the specified superdoves raster file
     overDrive is used to add brightness to the image by multiplying the RGB values (which have been scaled to 0-1) by this value
     overDrive > 1.0 will introduce some clipping to the image displayed
+    preview=True plots a reduced resolution, percentile stretched version instead (see getSDRasterPreview(), which is
+    what max_size, percentiles, cache and cache_dir are for) - a lot quicker for flicking through lots of scenes
+    either way the axes are in full resolution pixel coords
     '''
-    with rasterio.open(rasterFile) as dataset:
-        data = dataset.read()
-    image = reshape_as_image(data)
-    # this slice selects bands 2, 4, and 6 (blue, green, red), then flip to get RGB in correct order
-    image = np.flip(image[:, :, 1:6:2], 2).astype(np.float64)
-    # excellent use of for loop for normalisation (0.0->1.0)
-    for i in range(3):
-        image[:, :, i] = (image[:, :, i] - image[:, :, i].min()) / (image[:, :, i].max() - image[:, :, i].min())
-        
+    if preview:
+        image = getSDRasterPreview(rasterFile, max_size=max_size, percentiles=percentiles, cache=cache,
+                                   cache_dir=cache_dir)
+        with rasterio.open(rasterFile) as dataset:
+            height, width = dataset.height, dataset.width
+    else:
+        with rasterio.open(rasterFile) as dataset:
+            data = dataset.read(RGB_BANDS)
+        height, width = data.shape[1:]
+        image = reshape_as_image(data).astype(np.float64)
+        # normalisation (0.0->1.0)
+        low, high = image.min(axis=(0, 1)), image.max(axis=(0, 1))
+        image = (image - low) / (high - low)
+
     if ax is None:
         ax = plt.gca()
-    ax.imshow(image * overDrive)
+    ax.imshow(image * overDrive, extent=(-0.5, width - 0.5, height - 0.5, -0.5))
     if plotShow:
         plt.show()
         
@@ -86,7 +224,7 @@ def plotSDRasterSpectraGrid(rasterFile, x, y, ax=None, shape=(3, 3), crs_SD='eps
     plots spectra from superdoves raster file for a grid of pixels, shape=shape, at a given x, y point
     (default CRS is WGS84, but can change using crs_coords)
     '''
-    df = getSpectraFromSDSR_grid(rasterFile, x, y, shape=(3, 3), crs_SD='epsg:32630', crs_coords= 'WGS 84')
+    df = getSpectraFromSDSR_grid(rasterFile, x, y, shape=shape, crs_SD=crs_SD, crs_coords=crs_coords)
     
     if ax is None:
         ax = plt.gca()
@@ -0,0 +1,261 @@
+# benchmarks for the loaders, gridders and extractors, run on synthetic data (see synthetic.py) so they work offline
+#   python benchmarks/run_benchmarks.py
+#   python benchmarks/run_benchmarks.py --sizes 100 1000 10000 100000 --repeat 5
+#   python benchmarks/run_benchmarks.py --compare benchmarks/results/<older run>.json
+# results are written to benchmarks/results/<date>_<commit>.json (min + median time of each case, along with the
+# versions / machine), and --compare prints the ratio to an older run so regressions show up
+# every module level cache is cleared before each run of a case, so the times are for a fresh session - the on-disk
+# caches (scene catalogs etc., normally in dalecCache.DEFAULT_CACHE_DIR) are kept in <data dir>/cache and deleted too
+import os
+import shutil
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+import statistics
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+import synthetic
+import dalecLoad
+import spectralConv
+import sceneIndex
+import SD_NC_loading
+import SD_raster_loading
+import dalecCache
+import sceneCatalog
+
+RSR_DOVES_FILE = os.path.join(REPO_DIR, 'non-DALEC-data', 'RSR-Superdove.csv')
+SITE = (56.1472, -3.9237) # lat, lon that every synthetic scene covers
+
+def clear_caches(cache_dir=None):
+    if cache_dir is not None:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    sceneIndex._scene_indexes.clear()
+    SD_NC_loading._rhos_bands.clear()
+    spectralConv._band_operators.clear()
+    dalecLoad._grid_operator.cache_clear()
+    SD_raster_loading.get_transformer.cache_clear()
+    SD_raster_loading._previews.clear()
+
+def time_case(function, repeat, quiet=True, cache_dir=None):
+    # quiet hides the functions' own prints (the WARNING:s get repeated every run otherwise)
+    times = []
+    for _ in range(repeat):
+        clear_caches(cache_dir)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        plt.close('all')
+    return times
+
+def _data_file(data_dir, name, writer, *args, **kwargs):
+    # synthetic files are only made once per data dir (names include everything that changes them)
+    path = os.path.join(data_dir, name)
+    if not os.path.exists(path):
+        print('  making ' + name + ' ...')
+        writer(path + '.tmp', *args, **kwargs)
+        os.replace(path + '.tmp', path)
+    return path
+
+def DALEC_cases(data_dir, sizes, n_logs):
+    '''
+    (name, params, function) for each DALEC loading / gridding / band case
+    '''
+    RSR_doves = pd.read_csv(RSR_DOVES_FILE)
+    cases = []
+    for n in sizes:
+        dtf = _data_file(data_dir, 'synthetic_' + str(n) + '.dtf', synthetic.write_dtf, n)
+        multi = _data_file(data_dir, 'synthetic_' + str(n) + '_' + str(n_logs) + 'logs.dtf', synthetic.write_dtf, n,
+                           n_logs=n_logs)
+        spect_wavelengths = dalecLoad.load_DALEC_spect_wavelengths(dtf)
+        DALEC_log = dalecLoad.load_DALEC_log(dtf)
+        params = {'n_samples': n}
+        cases += [('load_DALEC_log', params, lambda dtf=dtf: dalecLoad.load_DALEC_log(dtf)),
+                  ('multiLogLoad', dict(params, n_logs=n_logs), lambda multi=multi: dalecLoad.multiLogLoad(multi)),
+                  ('uniform_grid_spectra_mean', params,
+                   lambda log=DALEC_log, sw=spect_wavelengths: dalecLoad.uniform_grid_spectra_mean(log, sw)),
+                  ('uniform_grid_spectra_stats', params,
+                   lambda log=DALEC_log, sw=spect_wavelengths: dalecLoad.uniform_grid_spectra_stats(log, sw)),
+                  ('SD_Rrs_batch', params,
+                   lambda log=DALEC_log, sw=spect_wavelengths: spectralConv.SD_Rrs_batch(RSR_doves, log, sw))]
+
+    # single sample functions, only need doing once
+    sample = DALEC_log.loc[DALEC_log.index.get_level_values(0)[0]]
+    x = np.linspace(400, 1000, 601)
+    R = np.interp(x, spect_wavelengths['Lu'], sample.loc['Lu']['Spectral Magnitude'].values)
+    cases += [('uniform_grid_spectra', {}, lambda: dalecLoad.uniform_grid_spectra(sample, spect_wavelengths)),
+              ('uniform_grid_spectra_Rrs', {}, lambda: dalecLoad.uniform_grid_spectra_Rrs(sample, spect_wavelengths)),
+              ('SD_Rrs', {}, lambda: spectralConv.SD_Rrs(RSR_doves, sample, spect_wavelengths)),
+              ('SD_band_calc', {}, lambda: spectralConv.SD_band_calc(RSR_doves, R, x)),
+              ('SD_band_calc', {'n_spectra': 1000}, lambda: spectralConv.SD_band_calc(RSR_doves, np.tile(R, (1000, 1)), x))]
+    return cases
+
+def _coords(n, seed=0, spread=0.002):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([SITE[0] + rng.uniform(-spread, spread, n), SITE[1] + rng.uniform(-spread, spread, n)])
+
+def scene_cases(data_dir, scene_sizes, n_scenes, n_points, cache_dir):
+    '''
+    (name, params, function) for the NetCDF and GeoTIFF extraction cases
+    (the scene catalog goes in cache_dir)
+    '''
+    import netCDF4
+    cases = []
+    coords = _coords(n_points)
+    for size in scene_sizes:
+        # top left corner put so that SITE is in the middle of the scene
+        lat0, lon0 = SITE[0] + size / 2 * 3e-5, SITE[1] - size / 2 * 5e-5
+        nc = _data_file(data_dir, 'synthetic_' + str(size) + '_L2R.nc', synthetic.write_L2R_nc, ny=size, nx=size,
+                        lat0=lat0, lon0=lon0)
+        tif = _data_file(data_dir, 'synthetic_' + str(size) + '_SR.tif', synthetic.write_SR_tif, height=size,
+                         width=size, lat=SITE[0], lon=SITE[1])
+        params = {'scene_size': size}
+
+        def grid(nc=nc):
+            with netCDF4.Dataset(nc) as f:
+                SD_NC_loading.get_SD_NC_Spectra_grid(f, SITE[0], SITE[1])
+
+        def grids(nc=nc):
+            with netCDF4.Dataset(nc) as f:
+                SD_NC_loading.get_SD_NC_Spectra_grids(f, coords)
+
+        cases += [('get_SD_NC_Spectra_grid', params, grid),
+                  ('get_SD_NC_Spectra_grids', dict(params, n_points=n_points), grids),
+                  ('getSpectraFromSDSR', dict(params, n_points=n_points),
+                   lambda tif=tif: SD_raster_loading.getSpectraFromSDSR(tif, coords[:, 0], coords[:, 1])),
+                  ('getSpectraFromSDSR_grid', params,
+                   lambda tif=tif: SD_raster_loading.getSpectraFromSDSR_grid(tif, SITE[0], SITE[1])),
+                  ('getSpectraFromSDSR_grids', dict(params, n_points=n_points),
+                   lambda tif=tif: SD_raster_loading.getSpectraFromSDSR_grids(tif, coords)),
+                  ('plotSDRaster', params, lambda tif=tif: SD_raster_loading.plotSDRaster(tif)),
+                  ('plotSDRaster', dict(params, preview=True),
+                   lambda tif=tif: SD_raster_loading.plotSDRaster(tif, preview=True, cache=False))]
+
+    # a directory of scenes, a couple of them on the same day
+    size = scene_sizes[0]
+    SD_directory = os.path.join(data_dir, 'scenes_' + str(size) + '_' + str(n_scenes))
+    os.makedirs(SD_directory, exist_ok=True)
+    for i in range(n_scenes):
+        isodate = (pd.Timestamp('2022-08-01T10:30:00') + pd.Timedelta(days=i // 2 * 3, minutes=i % 2 * 5)).isoformat()
+        _data_file(SD_directory, 'scene_' + str(i) + '_L2R.nc', synthetic.write_L2R_nc, ny=size, nx=size,
+                   lat0=SITE[0] + size / 2 * 3e-5, lon0=SITE[1] - size / 2 * 5e-5, isodate=isodate + 'Z', seed=i)
+    catalog = sceneCatalog.default_catalog_path(SD_directory, cache_dir=cache_dir)
+    cases += [('load_multiple_SDs', {'scene_size': size, 'n_scenes': n_scenes},
+               lambda: SD_NC_loading.load_multiple_SDs(SD_directory, SITE, catalog=catalog))]
+    return cases
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def _key(result):
+    return result['name'] + ' ' + json.dumps(result['params'], sort_keys=True)
+
+def compare(results, old_file, threshold=1.2):
+    '''
+    prints the new / old min time of every case that's in both runs, returns the keys of the ones which got slower
+    by more than threshold
+    '''
+    with open(old_file) as f:
+        old = {_key(result): result for result in json.load(f)['results']}
+    slower = []
+    print('\n{:70s} {:>10s} {:>10s} {:>7s}'.format('case', 'old (s)', 'new (s)', 'ratio'))
+    for result in results:
+        key = _key(result)
+        if key not in old or 'min' not in result or 'min' not in old[key]:
+            continue
+        ratio = result['min'] / old[key]['min']
+        flag = ' SLOWER' if ratio > threshold else ''
+        print('{:70s} {:10.4f} {:10.4f} {:7.2f}{}'.format(key[:70], old[key]['min'], result['min'], ratio, flag))
+        if flag:
+            slower.append(key)
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmarks on synthetic DALEC / superdoves data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='number of samples in the synthetic .dtf files (~9 kB per sample)')
+    parser.add_argument('--n-logs', type=int, default=4, help='number of logs in the serial multi-log files')
+    parser.add_argument('--scene-sizes', type=int, nargs='+', default=[500, 2000],
+                        help='width = height (pixels) of the synthetic NetCDFs and GeoTIFFs')
+    parser.add_argument('--n-scenes', type=int, default=8, help='number of scenes for load_multiple_SDs')
+    parser.add_argument('--n-points', type=int, default=1000, help='number of coords for the multi-point extractors')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--verbose', action='store_true', help='show what the benchmarked functions print')
+    parser.add_argument('--only', nargs='+', default=None, help='only run cases with these names')
+    parser.add_argument('--data-dir', default=None,
+                        help='where to keep the synthetic data (reused between runs), default is a temp dir')
+    parser.add_argument('--out', default=os.path.join(BENCHMARK_DIR, 'results'))
+    parser.add_argument('--compare', default=None, help='results file from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='cases more than this many times slower than --compare are flagged')
+    args = parser.parse_args(argv)
+
+    temp_dir = None
+    if args.data_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix='dalec_benchmarks_')
+        args.data_dir = temp_dir.name
+    os.makedirs(args.data_dir, exist_ok=True)
+    print('making / finding synthetic data in ' + args.data_dir)
+    # nothing gets left in (or read from) the user's own cache dir
+    cache_dir = os.path.join(args.data_dir, 'cache')
+    os.environ['DALEC_CACHE_DIR'] = cache_dir
+    dalecCache.DEFAULT_CACHE_DIR = cache_dir
+    cases = DALEC_cases(args.data_dir, args.sizes, args.n_logs) \
+        + scene_cases(args.data_dir, args.scene_sizes, args.n_scenes, args.n_points, cache_dir)
+    if args.only is not None:
+        cases = [case for case in cases if case[0] in args.only]
+
+    results = []
+    for name, params, function in cases:
+        result = {'name': name, 'params': params, 'repeat': args.repeat}
+        try:
+            times = time_case(function, args.repeat, quiet=not args.verbose, cache_dir=cache_dir)
+            result.update({'times': times, 'min': min(times), 'median': statistics.median(times)})
+            print('{:30s} {:45s} {:10.4f} s'.format(name, json.dumps(params), result['min']))
+        except Exception as e:
+            result['error'] = type(e).__name__ + ': ' + str(e)
+            print('{:30s} {:45s} FAILED ({})'.format(name, json.dumps(params), result['error']))
+        results.append(result)
+
+    commit = _git_commit()
+    meta = {'commit': commit,
+            'date': pd.Timestamp.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ['out', 'compare', 'data_dir']}}
+    os.makedirs(args.out, exist_ok=True)
+    out_file = os.path.join(args.out, pd.Timestamp.now().strftime('%Y%m%d-%H%M%S') + '_' + commit + '.json')
+    with open(out_file, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+    print('results written to ' + out_file)
+
+    slower = []
+    if args.compare is not None:
+        slower = compare(results, args.compare, threshold=args.threshold)
+    if temp_dir is not None:
+        temp_dir.cleanup()
+    return 1 if slower else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# synthetic data in the same formats as the real files, so the benchmarks can run anywhere (and at any size)
+# - calibrated DALEC logfiles (.dtf): single logs, or serial output with several logs (and config blocks) in one file
+# - acolite style L2R NetCDFs (lat/lon + rhos_* variables, isodate attribute)
+# - superdoves style 8 band surface reflectance GeoTIFFs
+import numpy as np
+import pandas as pd
+
+DTF_HEADER = '''[header]
+Calibrated DALEC Transect File
+DALECproc v6.0
+Device: DALEC
+DALEC serial number: 0005
+Ed spectrometer module: SN099065
+Lu spectrometer module: SN114810
+Lsky spectrometer module: SN099059
+DTF File Creation Date:Wed Jun 22 16:00:24 2022 UTC
+Data Source: synthetic
+Calibration File: synthetic
+Channel Ed units: W/m^2/nm
+Channel Lu units: W/m^2/sr/nm
+Channel Lsky units: W/m^2/sr/nm
+[Spectrometer Wavelengths (nm)]
+Pixel #,          Ed,          Lu,        Lsky
+'''
+PIXELS = np.arange(21, 221)
+META_COLUMNS = ['Sample #', 'UTC Date', 'UTC Time', 'GPS_Fix', 'Lat', 'Lon', 'Solar Azi', 'Solar Elev', 'Relaz',
+                'Heading', 'Pitch', 'Roll', 'Gearpos', 'Voltage', 'Temp', 'Channel', 'Integration Time',
+                'Saturation Flag']
+CONFIG = {'SD_CARD_LOGGING': 'ON', 'SIMULT': 'ON', 'AUTO_START': 'ON', 'AUTO_RELAZ': 'OFF', 'TARGET_RELAZ': '135',
+          'AUTO_INTTIME': 'ON', 'INTTIME_ED': '256', 'INTTIME_LU': '256', 'INTTIME_LSKY': '256',
+          'SPECTRUM_LB': '20000', 'SPECTRUM_UB': '40000'}
+CHANNELS = ['Ed', 'Lu', 'Lsky']
+# rough size of each channel's spectrum (Ed in W/m^2/nm, Lu and Lsky in W/m^2/sr/nm)
+CHANNEL_SCALE = {'Ed': 1.0, 'Lu': 0.005, 'Lsky': 0.05}
+SD_WAVELENGTHS = [444, 492, 533, 566, 612, 666, 707, 866]
+SD_BAND_NAMES = ['coastal_blue', 'blue', 'green_i', 'green', 'yellow', 'red', 'rededge', 'nir']
+
+def spect_wavelengths():
+    '''
+    wavelength mappings like the real DALEC (pixels 21-220, ~372-1040 nm, slightly different for each channel)
+    '''
+    x = PIXELS - 21
+    return pd.DataFrame(data={'Pixel_no': PIXELS,
+                              'Ed': 372.54 + 3.336 * x - 1.2e-4 * x**2,
+                              'Lu': 373.22 + 3.356 * x - 1.2e-4 * x**2,
+                              'Lsky': 373.66 + 3.366 * x - 1.1e-4 * x**2})
+
+def _wavelength_block():
+    wavelengths = spect_wavelengths()
+    return ''.join('{:7d},{:14.2f},{:14.2f},{:14.2f}\n'.format(*row) for row in
+                   zip(wavelengths['Pixel_no'], wavelengths['Ed'], wavelengths['Lu'], wavelengths['Lsky']))
+
+def _rows(rng, first_sample, n_samples, start, lat, lon, saturated_fraction, nan_fraction, interval=2.0):
+    '''
+    data rows (3 per sample, one per channel) as a string, in the .dtf format
+    '''
+    wavelengths = spect_wavelengths()
+    spec_fmt = ','.join(['%.7e'] * len(PIXELS))
+    lines = []
+    for i in range(n_samples):
+        sample = first_sample + i
+        time = start + pd.Timedelta(seconds=interval * sample + rng.uniform(0, 0.5))
+        sample_lat = lat + 1e-5 * sample
+        sample_lon = lon + 1.5e-5 * sample
+        heading = rng.uniform(0, 360)
+        for channel in CHANNELS:
+            x = wavelengths[channel].values
+            # smooth-ish spectrum with a peak in the green, plus some noise
+            spectrum = CHANNEL_SCALE[channel] * (0.3 + np.exp(-((x - 560) / 150)**2)) \
+                * (1 + 0.02 * rng.standard_normal(len(x)))
+            saturated = int(rng.random() < saturated_fraction)
+            if rng.random() < nan_fraction:
+                spectrum[rng.integers(len(x))] = np.nan
+            meta = [str(sample), time.strftime('%d/%m/%Y'), time.strftime('%H:%M:%S.%f')[:-3], 'A',
+                    '{:.7f}'.format(sample_lat), '{:.8f}'.format(sample_lon),
+                    '{:.1f}'.format(180 + rng.uniform(-5, 5)), '{:.1f}'.format(55 + rng.uniform(-2, 2)),
+                    '{:.1f}'.format(135 + rng.uniform(-10, 10)), '{:.1f}'.format(heading), '4.0', '1.0', '-0.3',
+                    '11.5', '21.375', channel, str(int(rng.choice([32, 64, 128, 256]))), str(saturated)]
+            lines.append(','.join(meta) + ',' + (spec_fmt % tuple(spectrum)).replace('nan', 'NaN') + '\n')
+    return ''.join(lines)
+
+def _config_block(log_no, n_samples):
+    lines = ['OUTPUT LOG_{:04d}.TXT DATA TO SCREEN\n'.format(log_no),
+             'FILESIZE (Bytes)={:.2f}\n'.format(9000.0 * n_samples),
+             'In-situ Marine Optics\n',
+             'DALEC (SN:0005)\n',
+             'FIRMWARE: DALEC_V5\n',
+             '---------CONFIGURATION---------\n',
+             'LOGFILE = LOG_{:04d}.TXT\n'.format(log_no)]
+    lines += [key + ' = ' + value + '\n' for key, value in CONFIG.items()]
+    lines += ['-------------------------------\n',
+              'Sample #,UTC Date,UTC Time,GPS_Fix,Lat,Lon,Solar Azi,Solar Elev,Relaz,Heading,Pitch,Roll,Gearpos,'
+              'Voltage,Temp,Channel,Inttime,Spec[0],...,Spec[255]\n']
+    return ''.join(lines)
+
+def write_dtf(path, n_samples, n_logs=1, seed=0, start='2022-06-21 12:10:00', lat=56.0296, lon=-4.0603,
+              saturated_fraction=0.01, nan_fraction=0.01, chunk_size=2000):
+    '''
+    writes a synthetic calibrated DALEC logfile with n_samples samples (3 rows each, ~9 kB per sample)
+    n_logs > 1 gives a serial output style file (see dalecLoad.multiLogLoad()), with the samples split between the logs
+    and a 'DALEC (SN:0005)' / CONFIGURATION block before each one
+    rows are written chunk_size samples at a time so big files don't need to fit in memory
+    '''
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start)
+    with open(path, 'w', newline='\n') as f:
+        f.write(DTF_HEADER)
+        f.write(_wavelength_block())
+        f.write('Sample #, ' + ', '.join(META_COLUMNS[1:]) + ', '
+                + ', '.join('Spec[' + str(pixel) + ']' for pixel in PIXELS) + '\n')
+        bounds = np.linspace(0, n_samples, n_logs + 1).astype(int)
+        for log in range(n_logs):
+            if n_logs > 1:
+                f.write(_config_block(log + 1, bounds[log + 1] - bounds[log]))
+            # sample numbers start from 0 again in each log, like the real thing
+            for first in range(0, bounds[log + 1] - bounds[log], chunk_size):
+                n = min(chunk_size, bounds[log + 1] - bounds[log] - first)
+                f.write(_rows(rng, first, n, start + pd.Timedelta(hours=log), lat, lon, saturated_fraction,
+                              nan_fraction))
+            if n_logs > 1:
+                f.write('END OF FILE\n')
+    return path
+
+def write_L2R_nc(path, ny=1000, nx=1000, lat0=56.16, lon0=-3.95, pixel_size=(3e-5, 5e-5),
+                 isodate='2022-06-20T11:30:00.000Z', seed=0, regular=True, mask_fraction=0.01):
+    '''
+    writes a synthetic acolite L2R NetCDF: 2-D float32 lat/lon (regular, or a bit skewed if not regular), the
+    superdoves rhos_* bands (with mask_fraction of pixels masked) and the isodate attribute
+    lat0, lon0 is the top left pixel
+    '''
+    import netCDF4 # only needed for this
+    rng = np.random.default_rng(seed)
+    yy, xx = np.meshgrid(np.arange(ny), np.arange(nx), indexing='ij')
+    lat = lat0 - yy * pixel_size[0] + (0 if regular else xx * pixel_size[0] / 15)
+    lon = lon0 + xx * pixel_size[1] + (0 if regular else yy * pixel_size[1] / 50)
+    with netCDF4.Dataset(path, 'w') as f:
+        f.createDimension('y', ny)
+        f.createDimension('x', nx)
+        f.createVariable('lat', 'f4', ('y', 'x'))[:] = lat
+        f.createVariable('lon', 'f4', ('y', 'x'))[:] = lon
+        for wavelength in SD_WAVELENGTHS:
+            rhos = (rng.random((ny, nx)) * 0.1).astype(np.float32)
+            variable = f.createVariable('rhos_' + str(wavelength), 'f4', ('y', 'x'), fill_value=np.float32(9.96921e36))
+            variable[:] = np.ma.masked_where(rng.random((ny, nx)) < mask_fraction, rhos)
+        f.isodate = isodate
+        f.sensor = 'PlanetScope_SuperDove'
+    return path
+
+def write_SR_tif(path, height=2000, width=2000, lat=56.1472, lon=-3.9237, pixel_size=3.0, crs='epsg:32630', seed=0,
+                 nodata=0, overviews=False):
+    '''
+    writes a synthetic superdoves surface reflectance GeoTIFF (8 uint16 bands, tiled) centred on lat, lon
+    overviews=True adds internal overviews (like gdaladdo would)
+    '''
+    import rasterio # only needed for this
+    import rasterio.enums
+    from rasterio.transform import from_origin
+    from pyproj import Transformer
+    x, y = Transformer.from_crs('WGS 84', crs).transform(lat, lon)
+    transform = from_origin(x - width * pixel_size / 2, y + height * pixel_size / 2, pixel_size, pixel_size)
+    rng = np.random.default_rng(seed)
+    with rasterio.open(path, 'w', driver='GTiff', height=height, width=width, count=8, dtype='uint16', crs=crs,
+                       transform=transform, nodata=nodata, tiled=True, blockxsize=256, blockysize=256) as f:
+        for band in range(8):
+            f.write((rng.random((height, width)) * 3000 + 1).astype(np.uint16), band + 1)
+        f.descriptions = tuple(SD_BAND_NAMES)
+        if overviews:
+            f.build_overviews([2, 4, 8, 16], rasterio.enums.Resampling.average)
+    return path
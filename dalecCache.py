@@ -0,0 +1,215 @@
+# on-disk cache of parsed (and cleaned) DALEC logs, so we don't have to re-tokenise the same .dtf files every time
+# entries are stored as uncompressed .npz files, so a warm load is basically just reading the arrays back in
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+import dalecMetrics
+
+# bump this if the way things are stored (or what the loaders return) changes, so old entries stop being used
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.environ.get('DALEC_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'DALEC_processing'))
+DEFAULT_MAX_BYTES = 2 * 1024**3 # 2 GB
+
+def file_hash(filepath, blocksize=2**20):
+    '''
+    blake2b hash of the contents of filepath
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def _write_atomic(path, write):
+    # write to a temp file first so that a half written file is never picked up (eg. by another process)
+    tmp = path + '.' + str(os.getpid()) + '.tmp'
+    write(tmp)
+    os.replace(tmp, path)
+
+def _content_hash(filepath, cache_dir):
+    '''
+    gets the content hash of filepath, only re-hashing the file when its size or mtime have changed
+    '''
+    st = os.stat(filepath)
+    abspath = os.path.abspath(filepath)
+    memo_file = os.path.join(cache_dir, 'hashes', hashlib.sha1(abspath.encode()).hexdigest() + '.json')
+    try:
+        with open(memo_file) as f:
+            memo = json.load(f)
+        if memo['size'] == st.st_size and memo['mtime_ns'] == st.st_mtime_ns:
+            return st, memo['hash']
+    except (OSError, ValueError, KeyError):
+        pass
+    content_hash = file_hash(filepath)
+    os.makedirs(os.path.dirname(memo_file), exist_ok=True)
+    memo = {'path': abspath, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': content_hash}
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(memo, f)
+    _write_atomic(memo_file, write)
+    return st, content_hash
+
+def cache_key(filepath, key_options, cache_dir=DEFAULT_CACHE_DIR):
+    '''
+    key for a cache entry: made from the path, size, mtime and content hash of filepath, plus key_options
+    (a json-able dict which should include the loader name and every option that changes what the loader returns)
+    '''
+    st, content_hash = _content_hash(filepath, cache_dir)
+    key = {'version': CACHE_VERSION,
+           'path': os.path.abspath(filepath),
+           'size': st.st_size,
+           'mtime_ns': st.st_mtime_ns,
+           'hash': content_hash,
+           'options': key_options}
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+def _frame_to_arrays(df, prefix):
+    '''
+    flattens a DataFrame into a dict of numpy arrays (and some json-able info on how to put it back together)
+    MultiIndexes are stored as levels + codes so that they don't need to be re-factorised when loading
+    '''
+    arrays = {}
+    info = {'columns': list(df.columns), 'index_names': list(df.index.names), 'attrs': df.attrs}
+    if isinstance(df.index, pd.MultiIndex):
+        info['index'] = 'multi'
+        for i, (level, codes) in enumerate(zip(df.index.levels, df.index.codes)):
+            arrays[prefix + 'level' + str(i)] = _to_array(level)
+            arrays[prefix + 'codes' + str(i)] = np.asarray(codes)
+    else:
+        info['index'] = 'single'
+        arrays[prefix + 'index'] = _to_array(df.index)
+    for i, col in enumerate(df.columns):
+        if df[col].dtype == object:
+            # string columns (channel, time etc.) have lots of repeats in long format, so store them factorised
+            # missing values get code -1
+            codes, uniques = pd.factorize(df[col])
+            arrays[prefix + 'codes_col' + str(i)] = codes
+            arrays[prefix + 'col' + str(i)] = _to_array(uniques)
+        else:
+            arrays[prefix + 'col' + str(i)] = _to_array(df[col])
+    return arrays, info
+
+def _to_array(values):
+    values = np.asarray(values)
+    if values.dtype == object:
+        # strings get stored as fixed width unicode so that we never need to pickle anything
+        values = values.astype(str)
+    return values
+
+def _from_array(values):
+    if values.dtype.kind == 'U':
+        values = values.astype(object)
+    return values
+
+def _frame_from_arrays(arrays, info, prefix):
+    if info['index'] == 'multi':
+        n_levels = len(info['index_names'])
+        index = pd.MultiIndex(levels=[_from_array(arrays[prefix + 'level' + str(i)]) for i in range(n_levels)],
+                              codes=[arrays[prefix + 'codes' + str(i)] for i in range(n_levels)],
+                              names=info['index_names'],
+                              verify_integrity=False)
+    else:
+        index = pd.Index(_from_array(arrays[prefix + 'index']), name=info['index_names'][0])
+    data = {}
+    for i, col in enumerate(info['columns']):
+        values = _from_array(arrays[prefix + 'col' + str(i)])
+        if prefix + 'codes_col' + str(i) in arrays:
+            codes = arrays[prefix + 'codes_col' + str(i)]
+            values = np.append(values, np.nan).astype(object)[codes] # code -1 picks up the nan on the end
+        data[col] = values
+    df = pd.DataFrame(data=data, index=index, columns=info['columns'])
+    df.attrs.update(info['attrs'])
+    return df
+
+def save_entry(path, result):
+    '''
+    saves a DataFrame, or a dict of DataFrames (eg. from dalecLoad.multiLogLoad()), as an uncompressed .npz
+    '''
+    arrays = {}
+    if isinstance(result, dict):
+        info = {'kind': 'dict', 'names': list(result.keys()), 'frames': []}
+        for i, df in enumerate(result.values()):
+            frame_arrays, frame_info = _frame_to_arrays(df, 'f' + str(i) + '_')
+            arrays.update(frame_arrays)
+            info['frames'].append(frame_info)
+    else:
+        frame_arrays, frame_info = _frame_to_arrays(result, 'f0_')
+        arrays.update(frame_arrays)
+        info = {'kind': 'frame', 'frames': [frame_info]}
+    arrays['info'] = np.array(json.dumps(info, default=str))
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+    _write_atomic(path, write)
+
+def load_entry(path):
+    '''
+    loads a cache entry saved with save_entry()
+    '''
+    with np.load(path, allow_pickle=False) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+    info = json.loads(str(arrays['info']))
+    frames = [_frame_from_arrays(arrays, frame_info, 'f' + str(i) + '_') for i, frame_info in enumerate(info['frames'])]
+    if info['kind'] == 'dict':
+        return dict(zip(info['names'], frames))
+    return frames[0]
+
+def evict(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    '''
+    deletes the least recently used cache entries until the cache takes up less than max_bytes
+    '''
+    entries = []
+    for file in os.listdir(cache_dir):
+        if file.endswith('.npz'):
+            path = os.path.join(cache_dir, file)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(entry[1] for entry in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+def clear(cache_dir=DEFAULT_CACHE_DIR):
+    '''
+    removes every entry in the cache
+    '''
+    evict(cache_dir, max_bytes=0)
+
+def load_cached(filepath, loader, key_options, cache_dir=None, max_bytes=None):
+    '''
+    returns loader(filepath), using the on-disk cache where possible
+    - key_options is a json-able dict with the loader name and all options which change the output (see cache_key())
+    - if the file has changed in any way (path, size, mtime or contents) a new entry is made, old ones just get
+    evicted eventually once the cache is bigger than max_bytes (least recently used entries go first)
+    '''
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    if max_bytes is None:
+        max_bytes = DEFAULT_MAX_BYTES
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, cache_key(filepath, key_options, cache_dir) + '.npz')
+    if os.path.exists(path):
+        try:
+            result = load_entry(path)
+            now = time.time()
+            os.utime(path, (now, now)) # mark as recently used
+            return result
+        except (OSError, ValueError, KeyError):
+            dalecMetrics.warn('could not read cache entry ' + path + ' - reloading ' + str(filepath),
+                              file=str(filepath))
+    result = loader(filepath)
+    save_entry(path, result)
+    evict(cache_dir, max_bytes)
+    return result
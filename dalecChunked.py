@@ -0,0 +1,196 @@
+# chunked (out-of-core) processing for DALEC logs which are too big to load in one go (eg. multi-day continuous logs)
+# the logfile is read a block of samples at a time (blocks only ever end between samples) and each block is cleaned,
+# saturation filtered, gridded and band convolved before the next one is read, so peak memory depends on chunk_samples
+# rather than on how long the file is
+# results are reduced into dalecStats accumulators and/or appended to flat binary files in an output directory, which
+# open_chunked_output() gives back as (read only) memmaps
+import os
+import json
+import numpy as np
+import pandas as pd
+import dalecLoad
+import dalecCube
+import dalecStats
+import dalecCache
+import dalecMetrics
+import spectralConv
+import rhoModels
+
+# bump this if the output directory layout changes
+OUTPUT_VERSION = 1
+OUTPUT_META = 'meta.json'
+SPECTRA_OUTPUTS = ['Ed', 'Lu', 'Lsky', 'Rrs']
+
+def _rows_to_cube(rows, columns, spect_wavelengths, dropNA, removeSaturated):
+    # one block of raw data rows -> DalecCube, cleaned the same way as dalecCube.load_DALEC_cube()
+    DALEC_log, _ = dalecLoad._parse_DALEC_rows(b''.join(rows), columns)
+    DALEC_log = dalecLoad._clean_DALEC_log_wide(DALEC_log, dropNA=dropNA, removeSaturated=False)
+    cube = dalecCube.DalecCube.from_wide(DALEC_log, spect_wavelengths)
+    if removeSaturated:
+        with dalecMetrics.stage('saturation_drop', samples_in=len(cube)) as record:
+            cube = cube.select(~cube.saturated)
+            record.update({'samples_out': len(cube), 'samples_dropped': record['samples_in'] - len(cube)})
+    return cube
+
+def iter_DALEC_chunks(filepath, chunk_samples=2000, sep=['DALEC (SN:0005)'], dropNA=True, removeSaturated=True):
+    '''
+    reads a calibrated DALEC logfile (.dtf) chunk_samples samples at a time, yielding (segment, cube) for each block
+    - cube is a dalecCube.DalecCube of the block (cleaned the same way as dalecCube.load_DALEC_cube())
+    - segment is the log number of the block, same as 'Log i' in dalecLoad.multiLogLoad() (0 is before the first sep)
+    blocks end between samples and at every sep line, so no sample is ever split and each block is from one segment
+    only one block of rows is held in memory at a time
+    '''
+    sep = tuple(s.encode() for s in sep)
+    with open(filepath, 'rb') as f:
+        info = dalecLoad._read_DALEC_header(f)
+        columns, spect_wavelengths = info['columns'], info['spect_wavelengths']
+        n_commas = len(columns) - 1
+        rows = []
+        segment = 0
+        n_samples = 0
+        last_sample = None
+        for line in f:
+            # rows are accepted in exactly the same way as dalecLoad.parse_DALEC_dtf()
+            if line[:1].isdigit():
+                if line.count(b',') == n_commas and line.endswith(b'\n'):
+                    sample = line[:line.index(b',')]
+                    if sample != last_sample:
+                        if n_samples == chunk_samples:
+                            yield segment, _rows_to_cube(rows, columns, spect_wavelengths, dropNA, removeSaturated)
+                            rows, n_samples = [], 0
+                        n_samples += 1
+                        last_sample = sample
+                    rows.append(line)
+            elif line.startswith(sep):
+                if rows:
+                    yield segment, _rows_to_cube(rows, columns, spect_wavelengths, dropNA, removeSaturated)
+                    rows, n_samples = [], 0
+                segment += 1
+                last_sample = None
+        if rows:
+            yield segment, _rows_to_cube(rows, columns, spect_wavelengths, dropNA, removeSaturated)
+
+class _OutputWriter:
+    # appends each block's arrays to <out_dir>/<name>.dat, meta.json is only written once everything is done
+    # (so a directory without one is from a run which didn't finish)
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        if os.path.exists(os.path.join(out_dir, OUTPUT_META)):
+            os.remove(os.path.join(out_dir, OUTPUT_META))
+        self.files = {}
+        self.arrays = {}
+
+    def append(self, name, values):
+        values = np.ascontiguousarray(values)
+        if name not in self.files:
+            self.files[name] = open(os.path.join(self.out_dir, name + '.dat'), 'wb')
+            self.arrays[name] = {'dtype': values.dtype.str, 'shape': list(values.shape[1:])}
+        values.tofile(self.files[name])
+
+    def close(self, meta=None):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        if meta is not None:
+            meta = dict(meta, version=OUTPUT_VERSION, arrays=self.arrays)
+            def write(tmp):
+                with open(tmp, 'w') as f:
+                    json.dump(meta, f, indent=1)
+            dalecCache._write_atomic(os.path.join(self.out_dir, OUTPUT_META), write)
+
+def process_DALEC_chunks(filepath, out_dir=None, outputs=['Rrs', 'bands'], RSR_doves=None, stats=None,
+                         chunk_samples=2000, sep=['DALEC (SN:0005)'], dropNA=True, removeSaturated=True,
+                         nsteps=601, min_waveL=400, max_waveL=1000, RHO=0.028, doves_wavelengths=None):
+    '''
+    cleans, grids and band convolves a (big) DALEC logfile a block of chunk_samples samples at a time
+    (see iter_DALEC_chunks()), without ever loading the whole thing
+    - every block is added to stats, a dalecStats.GriddedStats of Ed, Lu, Lsky and Rrs (a new one is made if not given,
+    pass one in to keep adding to it across several files)
+    - RHO can be a number or a rhoModels model (rho for each sample)
+    - RSR_doves (df or filename of the RSR csv) also gives band Rrs for every sample (see spectralConv.SD_Rrs_batch())
+    - out_dir saves per sample results: sample, segment, time, lat and lon plus whichever of outputs
+    ('Ed', 'Lu', 'Lsky', 'Rrs' on the uniform grid as float32, 'bands' for band Rrs) - open them with
+    open_chunked_output()
+    returns a dict with 'stats', 'band_stats' (dalecStats.SpectraAccumulator of band Rrs, or None without RSR_doves),
+    'n_samples', 'n_chunks' and 'out_dir'
+    '''
+    if isinstance(RSR_doves, str):
+        RSR_doves = pd.read_csv(RSR_doves)
+    if doves_wavelengths is None:
+        doves_wavelengths = spectralConv.DOVES_WAVELENGTHS
+    if stats is None:
+        stats = dalecStats.GriddedStats(nsteps=nsteps, min_waveL=min_waveL, max_waveL=max_waveL, RHO=RHO)
+    band_stats = dalecStats.SpectraAccumulator(len(doves_wavelengths)) if RSR_doves is not None else None
+    writer = _OutputWriter(out_dir) if out_dir is not None else None
+    n_samples, n_chunks = 0, 0
+    try:
+        with dalecMetrics.stage('process_DALEC_chunks', file=str(filepath), chunk_samples=chunk_samples) as record:
+            for segment, cube in iter_DALEC_chunks(filepath, chunk_samples=chunk_samples, sep=sep, dropNA=dropNA,
+                                                   removeSaturated=removeSaturated):
+                n_chunks += 1
+                if not len(cube):
+                    continue
+                with dalecMetrics.stage('chunk', samples=len(cube), segment=segment):
+                    gridded = cube.uniform_grid(nsteps=nsteps, min_waveL=min_waveL, max_waveL=max_waveL)
+                    rho = rhoModels.cube_rho(RHO, cube, gridded['Wavelength'])
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        gridded['Rrs'] = (gridded['Lu'] - (rho * gridded['Lsky'])) / gridded['Ed']
+                    stats.add_gridded(gridded, cube)
+                    if RSR_doves is not None:
+                        bands = spectralConv.SD_Rrs_batch(RSR_doves, cube, doves_wavelengths=doves_wavelengths,
+                                                          RHO=RHO, nsteps=nsteps)
+                        band_Rrs = bands['Rrs'].values.reshape(len(cube), len(doves_wavelengths))
+                        band_stats.add(band_Rrs)
+                    if writer is not None:
+                        writer.append('sample', cube.sample.astype(np.int64))
+                        writer.append('segment', np.full(len(cube), segment, dtype=np.int64))
+                        writer.append('time', cube.time.astype('datetime64[ns]'))
+                        writer.append('lat', cube.lat.astype(np.float64))
+                        writer.append('lon', cube.lon.astype(np.float64))
+                        for param in SPECTRA_OUTPUTS:
+                            if param in outputs:
+                                writer.append(param, gridded[param].astype(np.float32))
+                        if 'bands' in outputs and RSR_doves is not None:
+                            writer.append('bands', band_Rrs)
+                n_samples += len(cube)
+            record.update({'samples': n_samples, 'chunks': n_chunks})
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        raise
+    if writer is not None:
+        writer.close({'source': os.path.abspath(filepath),
+                      'n_samples': n_samples,
+                      'wavelength': list(np.linspace(min_waveL, max_waveL, num=nsteps)),
+                      'doves_wavelengths': list(doves_wavelengths),
+                      'settings': {'chunk_samples': chunk_samples, 'sep': list(sep), 'dropNA': dropNA,
+                                   'removeSaturated': removeSaturated, 'nsteps': nsteps, 'min_waveL': min_waveL,
+                                   'max_waveL': max_waveL, 'RHO': rhoModels.describe_rho(RHO)}})
+    return {'stats': stats, 'band_stats': band_stats, 'n_samples': n_samples, 'n_chunks': n_chunks,
+            'out_dir': out_dir}
+
+def open_chunked_output(out_dir):
+    '''
+    opens the results saved by process_DALEC_chunks(out_dir=...) as read only memmaps (nothing is read until it's used)
+    returns a dict with an array for each saved output (first axis is the sample), plus 'Wavelength' (the uniform
+    grid), 'doves_wavelengths' and 'meta'
+    '''
+    meta_file = os.path.join(out_dir, OUTPUT_META)
+    if not os.path.exists(meta_file):
+        raise FileNotFoundError('no ' + OUTPUT_META + ' in ' + out_dir + ' - has process_DALEC_chunks() finished?')
+    with open(meta_file) as f:
+        meta = json.load(f)
+    if meta['version'] != OUTPUT_VERSION:
+        raise ValueError(out_dir + ' was written by a different version of process_DALEC_chunks() - re-run it')
+    out = {'Wavelength': np.array(meta['wavelength']),
+           'doves_wavelengths': np.array(meta['doves_wavelengths']),
+           'meta': meta}
+    for name, array in meta['arrays'].items():
+        shape = tuple([meta['n_samples']] + array['shape'])
+        if meta['n_samples']:
+            out[name] = np.memmap(os.path.join(out_dir, name + '.dat'), dtype=np.dtype(array['dtype']), mode='r',
+                                  shape=shape)
+        else:
+            out[name] = np.zeros(shape, dtype=np.dtype(array['dtype']))
+    return out
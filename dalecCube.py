@@ -0,0 +1,220 @@
+# compact (sample x channel x pixel) storage for DALEC logs
+# the long format DataFrames from dalecLoad.load_DALEC_log() repeat all the metadata for every pixel and use float64
+# (so they get massive for long logs) - this keeps the spectra in one float32 array plus one metadata value per sample
+import numpy as np
+import pandas as pd
+import dalecLoad
+
+# order of the channels along axis 1 of DalecCube.spectra (same as the columns of the spectral wavelength mappings)
+CHANNELS = ['Ed', 'Lu', 'Lsky']
+# metadata which is the same for each channel of a sample
+SAMPLE_META = ['GPS_Fix', 'Lat', 'Lon', 'Solar Azi', 'Solar Elev', 'Relaz', 'Heading', 'Pitch', 'Roll',
+               'Gearpos', 'Voltage']
+# metadata which is different for each channel
+CHANNEL_META = ['Temp', 'Integration Time', 'Saturation Flag']
+
+class DalecCube:
+    '''
+    a DALEC log stored as:
+    - spectra: float32 array with shape (n_samples, 3, n_pixels), channels ordered as in CHANNELS
+    - sample: sample numbers, time: UTC date + time of each sample (datetime64)
+    - meta: dict of per-sample arrays (see SAMPLE_META)
+    - channel_meta: dict of (n_samples, 3) arrays (see CHANNEL_META)
+    - spect_wavelengths: the wavelength mappings from dalecLoad.load_DALEC_spect_wavelengths()
+    use load_DALEC_cube() to load one straight from a .dtf file, or from_long_format() to convert an old-style DataFrame
+    '''
+    def __init__(self, spectra, sample, time, meta, channel_meta, spect_wavelengths):
+        self.spectra = np.ascontiguousarray(spectra, dtype=np.float32)
+        self.sample = np.asarray(sample)
+        self.time = np.asarray(time, dtype='datetime64[ns]')
+        self.meta = meta
+        self.channel_meta = channel_meta
+        self.spect_wavelengths = spect_wavelengths
+
+    def __len__(self):
+        return self.spectra.shape[0]
+
+    def __repr__(self):
+        return ('DalecCube(' + str(len(self)) + ' samples, ' + str(self.spectra.shape[2]) + ' pixels, '
+                + str(self.time.min() if len(self) else None) + ' - ' + str(self.time.max() if len(self) else None) + ')')
+
+    @property
+    def pixel(self):
+        return self.spect_wavelengths['Pixel_no'].values
+
+    @property
+    def wavelengths(self):
+        '''
+        (3, n_pixels) array of the wavelength of each pixel for each channel
+        '''
+        return self.spect_wavelengths[CHANNELS].values.T
+
+    @property
+    def lat(self):
+        return self.meta['Lat']
+
+    @property
+    def lon(self):
+        return self.meta['Lon']
+
+    @property
+    def solar_elev(self):
+        return self.meta['Solar Elev']
+
+    @property
+    def solar_azi(self):
+        return self.meta['Solar Azi']
+
+    @property
+    def relaz(self):
+        return self.meta['Relaz']
+
+    @property
+    def integration_time(self):
+        return self.channel_meta['Integration Time']
+
+    @property
+    def saturated(self):
+        '''
+        True for samples where any channel is saturated
+        '''
+        return (self.channel_meta['Saturation Flag'] == 1).any(axis=1)
+
+    def channel(self, param):
+        '''
+        (n_samples, n_pixels) view of the spectra for one channel ('Ed', 'Lu' or 'Lsky')
+        '''
+        return self.spectra[:, CHANNELS.index(param), :]
+
+    def uniform_grid(self, nsteps=601, min_waveL=400, max_waveL=1000, params=CHANNELS):
+        '''
+        grids every sample onto a uniform wavelength grid (see dalecLoad.uniform_grid_spectra_batch())
+        returns a dict with 'Wavelength' (the grid) and a (n_samples, nsteps) array for each of params
+        '''
+        out = {}
+        for param in params:
+            out['Wavelength'], out[param] = dalecLoad.uniform_grid_spectra_batch(self.channel(param),
+                                                                                 self.spect_wavelengths,
+                                                                                 param=param,
+                                                                                 nsteps=nsteps,
+                                                                                 min_waveL=min_waveL,
+                                                                                 max_waveL=max_waveL)
+        return out
+
+    def select(self, mask):
+        '''
+        returns a new cube with only the samples selected by mask (boolean array or integer indices)
+        '''
+        return DalecCube(self.spectra[mask],
+                         self.sample[mask],
+                         self.time[mask],
+                         {key: values[mask] for key, values in self.meta.items()},
+                         {key: values[mask] for key, values in self.channel_meta.items()},
+                         self.spect_wavelengths)
+
+    @classmethod
+    def from_wide(cls, DALEC_log, spect_wavelengths):
+        '''
+        makes a cube from a wide DALEC log (as returned by dalecLoad.load_DALEC_log(longFormat=False))
+        rows for the same sample need to be next to each other (as they are in the logfile)
+        samples which don't have exactly one row for each channel are dropped
+        '''
+        samples = DALEC_log['Sample #'].values
+        codes = pd.Categorical(DALEC_log[' Channel'].values, categories=CHANNELS).codes
+        # samples are split wherever the sample number changes, so repeated numbers in serial logs are kept apart
+        new_sample = np.ones(len(samples), dtype=bool)
+        new_sample[1:] = samples[1:] != samples[:-1]
+        group = np.cumsum(new_sample) - 1
+        starts = np.flatnonzero(new_sample)
+        counts = np.diff(np.append(starts, len(samples)))
+        if len(samples):
+            channel_bits = np.bitwise_or.reduceat(np.where(codes >= 0, 1 << np.maximum(codes, 0), 8), starts)
+        else:
+            channel_bits = np.zeros(0, dtype=int)
+        complete = (counts == len(CHANNELS)) & (channel_bits == 2**len(CHANNELS) - 1)
+        keep = complete[group]
+        order = np.lexsort((codes[keep], group[keep]))
+        rows = np.flatnonzero(keep)[order]
+        n = complete.sum()
+
+        spec_cols = [col for col in DALEC_log.columns if col.startswith(' Spec[')]
+        spectra = DALEC_log[spec_cols].values[rows].astype(np.float32).reshape(n, len(CHANNELS), len(spec_cols))
+        first = rows[::len(CHANNELS)] # the Ed row of each sample
+        time = (DALEC_log[' UTC Date'].values[first]
+                + pd.to_timedelta(DALEC_log[' UTC Time'].values[first]).values)
+        meta = {key: DALEC_log[' ' + key].values[first] for key in SAMPLE_META}
+        channel_meta = {key: DALEC_log[' ' + key].values[rows].reshape(n, len(CHANNELS)) for key in CHANNEL_META}
+        return cls(spectra, samples[first], time, meta, channel_meta, spect_wavelengths)
+
+    @classmethod
+    def from_long_format(cls, DALEC_log, spect_wavelengths):
+        '''
+        makes a cube from a long format DataFrame (as returned by dalecLoad.load_DALEC_log())
+        samples which don't have every channel and pixel are dropped
+        '''
+        n_pix = len(spect_wavelengths)
+        samples, rows = dalecLoad.long_format_sample_rows(DALEC_log, n_pix, channels=CHANNELS)
+
+        spectra = DALEC_log['Spectral Magnitude'].values[rows]
+        first_channel = rows[:, :, 0]
+        first = first_channel[:, 0]
+        time = (pd.to_datetime(DALEC_log[' UTC Date'].values[first]).values
+                + pd.to_timedelta(DALEC_log[' UTC Time'].values[first]).values)
+        meta = {key: DALEC_log[' ' + key].values[first] for key in SAMPLE_META}
+        channel_meta = {key: DALEC_log[' ' + key].values[first_channel] for key in CHANNEL_META}
+        return cls(spectra, samples, time, meta, channel_meta, spect_wavelengths)
+
+    def to_long_format(self, integerIndex=True):
+        '''
+        converts back to the long format DataFrame used by the rest of dalecLoad (see dalecLoad.load_DALEC_log())
+        note that spectra will have been rounded to float32
+        '''
+        n, n_chan, n_pix = self.spectra.shape
+        # long format has channels in alphabetical order (Ed, Lsky, Lu)
+        chan_order = np.argsort(CHANNELS)
+        channels = np.array(CHANNELS, dtype=object)[chan_order]
+        samples = self.sample if integerIndex else self.sample.astype(str)
+        index = pd.MultiIndex.from_arrays([np.repeat(samples, n_chan * n_pix),
+                                           np.tile(np.repeat(channels, n_pix), n)],
+                                          names=['Sample #', ' Channel'])
+        time = pd.Series(self.time)
+        data = {'spectral_ind': np.tile(self.pixel, n * n_chan),
+                ' UTC Date': np.repeat(time.dt.floor('D').values, n_chan * n_pix),
+                ' UTC Time': np.repeat(time.dt.strftime('%H:%M:%S.%f').str[:-3].values.astype(object), n_chan * n_pix)}
+        for key, values in self.meta.items():
+            data[' ' + key] = np.repeat(values, n_chan * n_pix)
+        for key, values in self.channel_meta.items():
+            data[' ' + key] = np.repeat(values[:, chan_order].ravel(), n_pix)
+        data['Spectral Magnitude'] = self.spectra[:, chan_order, :].astype(np.float64).ravel()
+        # same column order as dalecLoad.load_DALEC_log()
+        columns = ['spectral_ind'] + [col for col in dalecLoad.DALEC_DTF_DTYPES if col in data] + ['Spectral Magnitude']
+        return pd.DataFrame(data=data, index=index, columns=columns)
+
+def load_DALEC_cube(filepath, dropNA=True, removeSaturated=True, cache=False, cache_dir=None, QC_rules=None):
+    '''
+    loads a calibrated DALEC log (.dtf) straight into a DalecCube
+    dropNA and cache work the same as in dalecLoad.load_DALEC_log()
+    removeSaturated drops samples where any channel is saturated
+    QC_rules (eg. dalecQC.DEFAULT_RULES) also drops the samples which fail any of them, the dalecQC.QC_report() is kept
+    in cube.QC_report
+    '''
+    DALEC_log = dalecLoad.load_DALEC_log(filepath, dropNA=dropNA, longFormat=False, cache=cache, cache_dir=cache_dir)
+    cube = DalecCube.from_wide(DALEC_log, dalecLoad.load_DALEC_spect_wavelengths(filepath))
+    if removeSaturated:
+        cube = cube.select(~cube.saturated)
+    if QC_rules is not None:
+        import dalecQC # imported here as dalecQC imports this module
+        cube, report = dalecQC.apply_QC(cube, QC_rules)
+        cube.QC_report = report
+    return cube
+
+def concat_cubes(cubes):
+    '''
+    joins a list of cubes (which should all come from logfiles with the same wavelength mappings) into one
+    '''
+    return DalecCube(np.concatenate([cube.spectra for cube in cubes]),
+                     np.concatenate([cube.sample for cube in cubes]),
+                     np.concatenate([cube.time for cube in cubes]),
+                     {key: np.concatenate([cube.meta[key] for cube in cubes]) for key in cubes[0].meta},
+                     {key: np.concatenate([cube.channel_meta[key] for cube in cubes]) for key in cubes[0].channel_meta},
+                     cubes[0].spect_wavelengths)
@@ -0,0 +1,249 @@
+# following a DALEC logfile while it's still being written (eg. continuous logging on a boat or jetty)
+# only the bytes appended since the last poll get parsed, so the cost of each poll doesn't grow with the file length
+import os
+import time
+import io
+import numpy as np
+import pandas as pd
+import dalecLoad
+import dalecCube
+import spectralConv
+import dalecRaw
+import dalecMetrics
+import rhoModels
+
+class DalecFollower:
+    '''
+    follows a calibrated DALEC logfile (.dtf) as it grows, or a raw one (LOG_*.TXT) if calibration is given
+    (a dalecRaw.DalecCalibration, see dalecRaw.load_DALEC_txt())
+    - poll() reads whatever has been appended since last time and returns a DalecCube of the new samples
+    - half written lines at the end of the file are kept until the rest turns up, and a sample is only published once
+    all of its channels have arrived
+    - configuration blocks and 'DALEC (SN:0005)' separators (sep) can appear at any point: each one starts a new
+    segment (like dalecLoad.multiLogLoad()) and its settings are added to self.config
+    - for every batch of new samples the gridded spectra + Rrs (see dalecCube.DalecCube.uniform_grid()) and,
+    if RSR_doves is given, the band Rrs (see spectralConv.SD_Rrs_batch()) are worked out for just the new samples
+    - callbacks are called with (new_cube, new_products) after every poll which finds new samples
+    - keep_history=False stops everything being kept in memory (for long deployments where only the callbacks are used)
+    '''
+    def __init__(self, filepath, sep=['DALEC (SN:0005)'], dropNA=True, removeSaturated=True,
+                 RSR_doves=None, RHO=0.028, nsteps=601, min_waveL=400, max_waveL=1000,
+                 callbacks=None, keep_history=True, calibration=None, saturation_level=dalecRaw.SATURATION_LEVEL):
+        self.filepath = filepath
+        self.calibration = calibration
+        self.saturation_level = saturation_level
+        self.sep = tuple(s.encode() for s in sep)
+        self.dropNA = dropNA
+        self.removeSaturated = removeSaturated
+        self.RSR_doves = RSR_doves
+        self.RHO = RHO
+        self.nsteps = nsteps
+        self.min_waveL = min_waveL
+        self.max_waveL = max_waveL
+        self.callbacks = [] if callbacks is None else list(callbacks)
+        self.keep_history = keep_history
+        self.reset()
+
+    def reset(self):
+        '''
+        forgets everything, so the next poll starts from the top of the file again
+        '''
+        self.offset = 0 # position in the file up to which everything has been read
+        self.header = None # header info from dalecLoad._read_DALEC_header(), once the whole header has been written
+        self.config = []
+        self.n_segments = 1
+        self._partial = b'' # half written line from the end of the file
+        self._run = [] # rows of the sample currently being written
+        self._run_sample = None
+        self._cubes = []
+        self._segments = []
+        self._products = []
+        self._joined = None
+
+    @property
+    def spect_wavelengths(self):
+        return None if self.header is None else self.header['spect_wavelengths']
+
+    def _read_new_bytes(self):
+        size = os.path.getsize(self.filepath)
+        if size < self.offset:
+            # file has been truncated or replaced, so start again
+            dalecMetrics.warn(self.filepath + ' got smaller - starting again from the top', file=self.filepath)
+            self.reset()
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        return data
+
+    def _read_header(self, data):
+        # the header is only parsed once the 'Sample #' line has been completely written
+        start = data.find(b'Sample #')
+        end = data.find(b'\n', start)
+        if start < 0 or end < 0:
+            return None
+        if self.calibration is not None:
+            # raw files start with the configuration block, so everything gets passed on to be read as normal
+            self.header = {'header': {},
+                           'spect_wavelengths': self.calibration.spect_wavelengths,
+                           'columns': dalecRaw._expand_columns(data[start:end].decode('latin-1'))}
+            return data
+        self.header = dalecLoad._read_DALEC_header(io.BytesIO(data[:end + 1]))
+        return data[end + 1:]
+
+    def _complete_runs(self, lines):
+        '''
+        splits lines into complete samples, returns a list of (segment, rows) with the rows of each complete sample
+        '''
+        n_commas = len(self.header['columns']) - 1
+        n_channels = len(dalecCube.CHANNELS)
+        complete = []
+        for line in lines:
+            if line[:1].isdigit() and line.count(b',') == n_commas:
+                sample_no = int(line[:line.index(b',')])
+                if sample_no != self._run_sample:
+                    # a new sample has started, so anything left of the last one is never going to be complete
+                    self._run = []
+                    self._run_sample = sample_no
+                self._run.append(line)
+                if len(self._run) == n_channels:
+                    complete.append((self.n_segments - 1, self._run))
+                    self._run = []
+                    self._run_sample = None
+            else:
+                self._run = []
+                self._run_sample = None
+                if line.startswith(self.sep):
+                    self.n_segments += 1
+                    self.config.append({})
+                elif b' = ' in line:
+                    key, value = line.decode('latin-1').split(' = ', 1)
+                    if not self.config:
+                        self.config.append({})
+                    self.config[-1][key.strip()] = value.strip()
+        return complete
+
+    def _to_cube(self, runs):
+        data = b''.join(b''.join(rows) for rows in runs)
+        if self.calibration is not None:
+            DALEC_log = dalecRaw.calibrate_DALEC_log(dalecRaw._parse_raw_rows(data, self.header['columns'])[0],
+                                                     self.calibration, saturation_level=self.saturation_level)
+        else:
+            DALEC_log, _ = dalecLoad._parse_DALEC_rows(data, self.header['columns'])
+        if self.dropNA:
+            DALEC_log = DALEC_log.dropna(axis=0)
+        cube = dalecCube.DalecCube.from_wide(DALEC_log, self.header['spect_wavelengths'])
+        if self.removeSaturated:
+            cube = cube.select(~cube.saturated)
+        return cube
+
+    def products(self, cube):
+        '''
+        gridded spectra, Rrs and (if RSR_doves was given) band Rrs for the samples in cube
+        (RHO can be a number or a rhoModels model)
+        '''
+        out = cube.uniform_grid(nsteps=self.nsteps, min_waveL=self.min_waveL, max_waveL=self.max_waveL)
+        rho = rhoModels.cube_rho(self.RHO, cube, out['Wavelength'])
+        out['Rrs'] = (out['Lu'] - (rho * out['Lsky'])) / out['Ed']
+        if self.RSR_doves is not None:
+            out['bands'] = spectralConv.SD_Rrs_batch(self.RSR_doves, cube, RHO=self.RHO, nsteps=self.nsteps)
+        return out
+
+    def poll(self):
+        '''
+        reads anything new in the file, returns a DalecCube of the new (complete) samples
+        (or None if the header hasn't been written yet)
+        '''
+        data = self._partial + self._read_new_bytes()
+        if self.header is None:
+            rest = self._read_header(data)
+            if rest is None:
+                self._partial = data
+                return None
+            data = rest
+        lines = data.splitlines(keepends=True)
+        if lines and not lines[-1].endswith(b'\n'):
+            self._partial = lines.pop()
+        else:
+            self._partial = b''
+        runs = self._complete_runs(lines)
+
+        # each segment is converted separately so that every sample can be tagged with its segment
+        cubes, segments = [], []
+        for segment in sorted(set(run[0] for run in runs)):
+            cube = self._to_cube([rows for seg, rows in runs if seg == segment])
+            cubes.append(cube)
+            segments.append(np.full(len(cube), segment, dtype=np.int64))
+        if cubes:
+            new_cube = dalecCube.concat_cubes(cubes)
+            new_segments = np.concatenate(segments)
+        else:
+            new_cube = self._to_cube([])
+            new_segments = np.zeros(0, dtype=np.int64)
+        if len(new_cube):
+            new_products = self.products(new_cube)
+            if self.keep_history:
+                self._cubes.append(new_cube)
+                self._segments.append(new_segments)
+                self._products.append(new_products)
+                self._joined = None
+            for callback in self.callbacks:
+                callback(new_cube, new_products)
+        return new_cube
+
+    def follow(self, interval=1.0, max_polls=None):
+        '''
+        keeps polling the file every interval seconds (forever, or for max_polls polls)
+        use callbacks to do something with the new samples as they come in
+        '''
+        n_polls = 0
+        while max_polls is None or n_polls < max_polls:
+            self.poll()
+            n_polls += 1
+            if max_polls is None or n_polls < max_polls:
+                time.sleep(interval)
+
+    def _join(self):
+        # everything is only joined together when it's asked for (and then kept until new samples arrive)
+        if self._joined is None and self._cubes:
+            grid = {'Wavelength': self._products[0]['Wavelength']}
+            for key in ['Ed', 'Lu', 'Lsky', 'Rrs']:
+                grid[key] = np.concatenate([products[key] for products in self._products])
+            bands = None
+            if self.RSR_doves is not None:
+                bands = pd.concat([products['bands'] for products in self._products])
+            self._joined = {'cube': dalecCube.concat_cubes(self._cubes),
+                            'segment': np.concatenate(self._segments),
+                            'grid': grid,
+                            'bands': bands}
+            self._cubes, self._segments = [self._joined['cube']], [self._joined['segment']]
+            self._products = [dict(grid, bands=bands)]
+        return self._joined
+
+    @property
+    def cube(self):
+        '''
+        DalecCube of every sample published so far (None if there aren't any yet)
+        '''
+        return self._join()['cube'] if self._cubes else None
+
+    @property
+    def segment(self):
+        '''
+        segment of each sample in self.cube
+        '''
+        return self._join()['segment'] if self._cubes else None
+
+    @property
+    def grid(self):
+        '''
+        dict of the gridded 'Ed', 'Lu', 'Lsky' and 'Rrs' for every sample so far (plus the 'Wavelength' grid)
+        '''
+        return self._join()['grid'] if self._cubes else None
+
+    @property
+    def bands(self):
+        '''
+        band Rrs (see spectralConv.SD_Rrs_batch()) for every sample so far
+        '''
+        return self._join()['bands'] if self._cubes else None
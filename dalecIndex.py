@@ -0,0 +1,214 @@
+# byte offset index for calibrated DALEC logfiles (.dtf), so that one log segment (or a time range of samples) can be
+# loaded from a big serially logged file without parsing all of it
+# the index is built in one scan and saved next to the logfile as <logfile>.idx.npz
+import os
+import json
+import numpy as np
+import pandas as pd
+import dalecLoad
+import dalecCache
+import dalecMetrics
+
+# bump this if what gets stored in the index changes, so old index files get rebuilt
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx.npz'
+
+def index_path(filepath):
+    return filepath + INDEX_SUFFIX
+
+class DalecIndex:
+    '''
+    where everything is in a calibrated DALEC logfile - one entry per block of consecutive data rows for a sample:
+    - sample: sample number, segment: log number (same as 'Log i' in dalecLoad.multiLogLoad(), 0 is before the first sep)
+    - start, end: byte range of the rows in the file, n_rows: number of rows (normally one per channel)
+    - time: UTC Date + UTC Time of the first row (datetime64)
+    - segment_offsets: byte offset of each sep line (segment i starts at segment_offsets[i - 1])
+    - info: dict with the file size/mtime the index was built for, the sep used, the 'Sample #' header columns,
+    the top of file header and the configuration blocks (one per segment, like dalecLoad.parse_DALEC_dtf())
+    '''
+    def __init__(self, sample, segment, start, end, n_rows, time, segment_offsets, info):
+        self.sample = np.asarray(sample, dtype=np.int64)
+        self.segment = np.asarray(segment, dtype=np.int64)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.n_rows = np.asarray(n_rows, dtype=np.int64)
+        self.time = np.asarray(time, dtype='datetime64[ns]')
+        self.segment_offsets = np.asarray(segment_offsets, dtype=np.int64)
+        self.info = info
+
+    def __len__(self):
+        return len(self.sample)
+
+    def __repr__(self):
+        return ('DalecIndex(' + str(len(self)) + ' samples, ' + str(self.n_segments) + ' segments, '
+                + str(self.time.min() if len(self) else None) + ' - ' + str(self.time.max() if len(self) else None) + ')')
+
+    @property
+    def n_segments(self):
+        return len(self.segment_offsets) + 1
+
+    def is_valid_for(self, filepath, sep):
+        st = os.stat(filepath)
+        return (self.info['version'] == INDEX_VERSION
+                and self.info['size'] == st.st_size
+                and self.info['mtime_ns'] == st.st_mtime_ns
+                and self.info['sep'] == list(sep))
+
+    def select_segment(self, log):
+        '''
+        positions (in the index) of the samples in log segment(s) log (int or list of ints)
+        '''
+        return np.flatnonzero(np.isin(self.segment, np.atleast_1d(log)))
+
+    def select_time(self, start=None, end=None):
+        '''
+        positions of the samples with start <= time <= end (anything pd.Timestamp() understands, None for no limit)
+        samples without a time (NaT) are only included when there are no limits
+        '''
+        keep = np.ones(len(self), dtype=bool)
+        if start is not None:
+            keep &= self.time >= pd.Timestamp(start).to_datetime64()
+        if end is not None:
+            keep &= self.time <= pd.Timestamp(end).to_datetime64()
+        return np.flatnonzero(keep)
+
+    def read_rows(self, filepath, positions):
+        '''
+        reads and parses just the rows for the index entries at positions
+        returns a typed wide DataFrame (same as the 'data' from dalecLoad.parse_DALEC_dtf()) and the segment of each row
+        '''
+        positions = np.sort(np.asarray(positions, dtype=np.int64))
+        start, end = self.start[positions], self.end[positions]
+        # entries which follow straight on from each other are read in one go
+        new_block = np.ones(len(positions), dtype=bool)
+        new_block[1:] = start[1:] != end[:-1]
+        block_starts = np.flatnonzero(new_block)
+        block_ends = np.append(block_starts[1:], len(positions)) - 1
+        chunks = []
+        with open(filepath, 'rb') as f:
+            for first, last in zip(block_starts, block_ends):
+                f.seek(start[first])
+                chunks.append(f.read(end[last] - start[first]))
+        DALEC_log, _ = dalecLoad._parse_DALEC_rows(b''.join(chunks), self.info['columns'])
+        return DALEC_log, np.repeat(self.segment[positions], self.n_rows[positions])
+
+    def save(self, path):
+        arrays = {'sample': self.sample,
+                  'segment': self.segment,
+                  'start': self.start,
+                  'end': self.end,
+                  'n_rows': self.n_rows,
+                  'time': self.time.astype(np.int64),
+                  'segment_offsets': self.segment_offsets,
+                  'info': np.array(json.dumps(self.info))}
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                np.savez(f, **arrays)
+        dalecCache._write_atomic(path, write)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+        return cls(arrays['sample'], arrays['segment'], arrays['start'], arrays['end'], arrays['n_rows'],
+                   arrays['time'].astype('datetime64[ns]'), arrays['segment_offsets'], json.loads(str(arrays['info'])))
+
+def build_index(filepath, sep=['DALEC (SN:0005)']):
+    '''
+    scans a calibrated DALEC logfile once and returns a DalecIndex for it
+    rows are accepted in exactly the same way as dalecLoad.parse_DALEC_dtf(), so reading every entry gives the same rows
+    '''
+    st = os.stat(filepath)
+    sep_bytes = tuple(s.encode() for s in sep)
+    sample, segment, start, end, n_rows, date_time = [], [], [], [], [], []
+    segment_offsets = []
+    config = []
+    with open(filepath, 'rb') as f:
+        file_info = dalecLoad._read_DALEC_header(f)
+        offset = f.tell()
+        n_commas = len(file_info['columns']) - 1
+        current = None # sample number of the entry being added to (None if the last line wasn't a data row)
+        for line in f:
+            if line[:1].isdigit() and line.count(b',') == n_commas and line.endswith(b'\n'):
+                sample_no = int(line[:line.index(b',')])
+                if sample_no == current:
+                    end[-1] = offset + len(line)
+                    n_rows[-1] += 1
+                else:
+                    current = sample_no
+                    sample.append(sample_no)
+                    segment.append(len(segment_offsets))
+                    start.append(offset)
+                    end.append(offset + len(line))
+                    n_rows.append(1)
+                    fields = line.split(b',', 3)
+                    date_time.append((fields[1].strip() + b' ' + fields[2].strip()).decode())
+            else:
+                current = None
+                if line.startswith(sep_bytes):
+                    segment_offsets.append(offset)
+                    config.append({})
+                elif b' = ' in line:
+                    key, value = line.decode('latin-1').split(' = ', 1)
+                    if not config:
+                        config.append({})
+                    config[-1][key.strip()] = value.strip()
+            offset += len(line)
+
+    # a row with no (or a broken) date / time is still a data row, like in parse_DALEC_dtf() - it gets NaT here, so
+    # select_time() never picks it and cleaning (dropNA) drops it when everything is loaded
+    time = pd.to_datetime(pd.Series(date_time, dtype=object), format=dalecLoad.DALEC_DATETIME_FORMAT,
+                          errors='coerce').values
+    info = {'version': INDEX_VERSION,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'sep': list(sep),
+            'columns': file_info['columns'],
+            'header': file_info['header'],
+            'config': config}
+    return DalecIndex(sample, segment, start, end, n_rows, time, segment_offsets, info)
+
+def load_index(filepath, sep=['DALEC (SN:0005)'], rebuild=False, save=True):
+    '''
+    returns the DalecIndex for filepath, using the saved <filepath>.idx.npz if it's still valid
+    (ie. the logfile has the same size and mtime, and the same sep was used) otherwise building and saving a new one
+    '''
+    path = index_path(filepath)
+    if not rebuild and os.path.exists(path):
+        try:
+            index = DalecIndex.load(path)
+            if index.is_valid_for(filepath, sep):
+                return index
+        except (OSError, ValueError, KeyError):
+            dalecMetrics.warn('could not read index ' + path + ' - rebuilding it', file=path)
+    index = build_index(filepath, sep=sep)
+    if save:
+        try:
+            index.save(path)
+        except OSError:
+            dalecMetrics.warn("couldn't save index to " + path, file=path)
+    return index
+
+def _load_positions(filepath, index, positions, dropNA, longFormat, integerIndex, removeSaturated):
+    DALEC_log, _ = index.read_rows(filepath, positions)
+    return dalecLoad.clean_DALEC_log(DALEC_log, dropNA=dropNA, longFormat=longFormat, integerIndex=integerIndex,
+                                     removeSaturated=removeSaturated)
+
+def load_DALEC_log_segment(filepath, log, sep=['DALEC (SN:0005)'], dropNA=True, longFormat=True, integerIndex=True,
+                           removeSaturated=True):
+    '''
+    loads only log segment log (int, or list of ints) of a serially logged file, using the index (see load_index())
+    returns the same as one of the tables from dalecLoad.multiLogLoad() - eg. log=7 gives 'Log 7'
+    '''
+    index = load_index(filepath, sep=sep)
+    return _load_positions(filepath, index, index.select_segment(log), dropNA, longFormat, integerIndex, removeSaturated)
+
+def load_DALEC_log_time_range(filepath, start=None, end=None, sep=['DALEC (SN:0005)'], dropNA=True, longFormat=True,
+                              integerIndex=True, removeSaturated=True):
+    '''
+    loads only the samples with start <= UTC time <= end, using the index (see load_index())
+    returns the same format as dalecLoad.load_DALEC_log()
+    '''
+    index = load_index(filepath, sep=sep)
+    return _load_positions(filepath, index, index.select_time(start, end), dropNA, longFormat, integerIndex,
+                           removeSaturated)
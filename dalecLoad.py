@@ -1,104 +1,348 @@
 import pandas as pd
 import numpy as np
+import io
+import os
+import dalecCache
+import dalecMetrics
+import rhoModels
+
+# names of the metadata columns in a calibrated DALEC transect file, and what type they should be loaded as
+# (everything else in the 'Sample #' header is a ' Spec[n]' column, which is loaded as float64)
+DALEC_DTF_DTYPES = {'Sample #': np.int64,
+                    ' UTC Date': str,
+                    ' UTC Time': str,
+                    ' GPS_Fix': str,
+                    ' Lat': np.float64,
+                    ' Lon': np.float64,
+                    ' Solar Azi': np.float64,
+                    ' Solar Elev': np.float64,
+                    ' Relaz': np.float64,
+                    ' Heading': np.float64,
+                    ' Pitch': np.float64,
+                    ' Roll': np.float64,
+                    ' Gearpos': np.float64,
+                    ' Voltage': np.float64,
+                    ' Temp': np.float64,
+                    ' Channel': str,
+                    ' Integration Time': np.int64,
+                    ' Saturation Flag': np.int64,
+                    }
+DALEC_DATE_FORMAT = '%d/%m/%Y'
+DALEC_DATETIME_FORMAT = '%d/%m/%Y %H:%M:%S.%f'
+
+def _read_DALEC_header(f):
+    """
+    reads the top of an open (binary mode) calibrated DALEC logfile, up to and including the 'Sample #' header line
+    returns a dict with the 'key: value' header lines, the spectral wavelength mappings and the column names
+    the file is left positioned at the first line after the 'Sample #' header
+    """
+    header = {}
+    wavelength_rows = []
+    in_wavelengths = False
+    columns = None
+    for line in f:
+        line = line.decode('latin-1').strip()
+        if line.startswith('Sample #'):
+            columns = line.split(',')
+            break
+        if line.startswith('[Spectrometer Wavelengths'):
+            in_wavelengths = True
+        elif in_wavelengths:
+            if not line.startswith('Pixel #'):
+                wavelength_rows.append(line.split(','))
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            header[key.strip()] = value.strip()
+
+    if columns is None:
+        raise ValueError("couldn't find a 'Sample #' header - is this a calibrated DALEC (.dtf) file?")
+    spect_wavelengths = pd.DataFrame(data=np.array(wavelength_rows, dtype=np.float64),
+                                     columns=['Pixel_no', 'Ed', 'Lu', 'Lsky'])
+    spect_wavelengths['Pixel_no'] = spect_wavelengths['Pixel_no'].astype(np.int64)
+    return {'header': header, 'spect_wavelengths': spect_wavelengths, 'columns': columns}
+
+def _parse_DALEC_rows(data, columns):
+    """
+    converts the raw bytes of some DALEC data rows (all with len(columns) fields) into a typed wide DataFrame
+    also returns the UTC Date + UTC Time of each row as a datetime64 array
+    """
+    dtypes = {col: DALEC_DTF_DTYPES.get(col, np.float64) for col in columns}
+    try:
+        DALEC_log = pd.read_csv(io.BytesIO(data),
+                                header=None,
+                                names=columns,
+                                dtype=dtypes,
+                                engine='c',
+                                )
+    except ValueError:
+        # something which isn't a number in a numeric column (eg. ' N/A' in Lat) - read them without a dtype and
+        # coerce, so the bad values become NaN and the row gets dropped by dropNA rather than failing the whole file
+        DALEC_log = pd.read_csv(io.BytesIO(data),
+                                header=None,
+                                names=columns,
+                                dtype={col: dtype for col, dtype in dtypes.items() if dtype is str},
+                                engine='c',
+                                )
+        for col, dtype in dtypes.items():
+            if dtype is not str and not pd.api.types.is_numeric_dtype(DALEC_log[col]):
+                DALEC_log[col] = pd.to_numeric(DALEC_log[col], errors='coerce')
+    # fixed formats are much quicker than letting pandas guess for every row
+    datetime = pd.to_datetime(DALEC_log[' UTC Date'] + ' ' + DALEC_log[' UTC Time'], format=DALEC_DATETIME_FORMAT,
+                              errors='coerce').values
+    DALEC_log[' UTC Date'] = pd.to_datetime(DALEC_log[' UTC Date'], format=DALEC_DATE_FORMAT, errors='coerce')
+    return DALEC_log, datetime
+
+def parse_DALEC_dtf(filepath, sep=['DALEC (SN:0005)']):
+    """
+    single pass parser for calibrated DALEC logfiles (.dtf)
+    - finds the [Spectrometer Wavelengths (nm)] block and the 'Sample #' header itself (no hard coded header line)
+    - skips the DALEC configuration blocks which can appear mid-file, keeping them as dicts
+    - only complete data rows are kept, so there's no need to drop NaN dates or repeated headers afterwards
+    (the 'parse' dalecMetrics record counts what was left out: rows_incomplete, headers_repeated and rows_skipped)
+    returns a dict with:
+    'header' (dict of the 'key: value' lines at the top of the file), 'spect_wavelengths', 'columns',
+    'data' (typed wide DataFrame, one row per sample & channel), 'datetime' (UTC Date + UTC Time of each row),
+    'segment' (log number of each row - this goes up by one every time a line in sep is found) and
+    'config' (list of dicts, one for each configuration block)
+    """
+    sep = tuple(s.encode() for s in sep)
+    with dalecMetrics.stage('parse', file=str(filepath)) as record:
+        with open(filepath, 'rb') as f:
+            record['bytes_read'] = os.fstat(f.fileno()).st_size
+            info = _read_DALEC_header(f)
+            n_commas = len(info['columns']) - 1
+            rows = []
+            n_incomplete = 0
+            n_headers = 0 # repeated 'Sample #' header lines
+            n_skipped = 0 # any other line which isn't data, a sep or a config 'key = value' (blank lines, banners etc.)
+            segment_starts = [] # number of rows read when each new segment starts
+            config = []
+            for line in f:
+                # data rows always start with the sample number
+                if line[:1].isdigit():
+                    # skip anything which is incomplete (eg. a half written final line)
+                    if line.count(b',') == n_commas and line.endswith(b'\n'):
+                        rows.append(line)
+                    else:
+                        n_incomplete += 1
+                elif line.startswith(sep):
+                    segment_starts.append(len(rows))
+                    config.append({})
+                elif b' = ' in line:
+                    key, value = line.decode('latin-1').split(' = ', 1)
+                    if not config:
+                        config.append({})
+                    config[-1][key.strip()] = value.strip()
+                elif line.startswith(b'Sample #'):
+                    n_headers += 1
+                else:
+                    n_skipped += 1
+
+        DALEC_log, datetime = _parse_DALEC_rows(b''.join(rows), info['columns'])
+        record.update({'rows_out': len(DALEC_log), 'rows_incomplete': n_incomplete, 'headers_repeated': n_headers,
+                       'rows_skipped': n_skipped, 'segments': len(segment_starts)})
+    segment = np.zeros(len(rows), dtype=np.int64)
+    for start in segment_starts:
+        segment[start:] += 1
+    info['data'] = DALEC_log
+    info['datetime'] = datetime
+    info['segment'] = segment
+    info['config'] = config
+    return info
 
 def load_DALEC_spect_wavelengths(filepath, header=15):
     """
     Loads spectral wavelength mappings from a calibrated DALEC logfile
+    header is no longer needed (the [Spectrometer Wavelengths (nm)] block is found automatically) but is kept so
+    older code still works
     """
-    spect_wavelengths = pd.read_csv(filepath,
-                                    header=header,
-                                    nrows=200,
-                                    names=['Pixel_no', 'Ed', 'Lu', 'Lsky'],
-                               )
+    with open(filepath, 'rb') as f:
+        spect_wavelengths = _read_DALEC_header(f)['spect_wavelengths']
     return spect_wavelengths # these are just the mappings of wavelength to pixel number
 
-def load_DALEC_log(filepath, header=216, dropNA=True, longFormat=True, integerIndex=True, removeSaturated=True, parse_dates=True):
+def clean_DALEC_log(DALEC_log, dropNA=True, longFormat=True, integerIndex=True, removeSaturated=True):
     """
-    loads DALEC log file (excluding spectral wavelength mappings)
+    does all the tidying up of a (typed, wide) DALEC log from parse_DALEC_dtf()
     optionally returns log file in long format
     option to convert sample no. index to an integer, or to keep as a string (integerIndex)
     """
-    # ideally specify dtype of all rows for efficiency and to prevent bad things - TODO!
-    # need to specify str for lots of columns as these have some rows which contain stuff we need to remove
-    DALEC_log = pd.read_csv(filepath,
-                            header=header,
-                            parse_dates=parse_dates,
-                            dayfirst=True,
-                            infer_datetime_format=True,
-                            dtype={'Sample #': str,
-                                   ' Lat': str, 
-                                   ' Lon': str,
-                                   ' Solar Azi': str,
-                                   ' Solar Elev': str,
-                                   ' Relaz': str,
-                                   ' Heading': str,
-                                   ' Pitch': str,
-                                   ' Roll': str,
-                                   ' Gearpos': str,
-                                   ' Voltage': str,
-                                   ' Temp': str,
-                                   'Channel': str,
-                                   ' Integration Time': str,
-                                   ' Saturation Flag': str,
-                                   ' Spec[21]': str,
-                                   ' Spec[22]': str,
-                                  },
-                            )
-    
-    # any row with invalid UTC date can be removed
-    DALEC_log.drop(DALEC_log[DALEC_log[' UTC Date'].isna()].index, inplace = True)
-    # this removes the duplicated headings
-    DALEC_log.drop(DALEC_log[DALEC_log[' UTC Date'] == 'UTC Date'].index, inplace = True)
-    
-    if dropNA:
-        DALEC_log.dropna(inplace=True, axis=0,)
-        
+    DALEC_log = _clean_DALEC_log_wide(DALEC_log, dropNA=dropNA, removeSaturated=removeSaturated and longFormat)
     if longFormat:
-        # convert to long format
-        # need to test that these variable names always load in this way (leading space on Spec etc.)
-        DALEC_log = pd.wide_to_long(DALEC_log, [' Spec['], i=['Sample #', ' Channel'], j='spectral_ind', suffix='\d+]')
-        DALEC_log.reset_index(level=2, inplace=True) # remove spectral_ind as an index
-        DALEC_log['spectral_ind'] = pd.to_numeric(DALEC_log['spectral_ind'].str[:-1]) # convert spectral_ind to numeric
-        DALEC_log.rename(columns={' Spec[': 'Spectral Magnitude'}, inplace=True)
-        DALEC_log = DALEC_log.astype({'Spectral Magnitude': 'float64'})
+        DALEC_log = DALEC_wide_to_long(DALEC_log, integerIndex=integerIndex)
+    return DALEC_log
+
+def _clean_DALEC_log_wide(DALEC_log, dropNA=True, removeSaturated=True):
+    if dropNA:
+        with dalecMetrics.stage('clean', rows_in=len(DALEC_log)) as record:
+            DALEC_log = DALEC_log.dropna(axis=0)
+            # integer columns which had bad values in (so were read as float, see _parse_DALEC_rows()) go back to ints
+            for col, dtype in DALEC_DTF_DTYPES.items():
+                if dtype is np.int64 and col in DALEC_log.columns and DALEC_log[col].dtype != np.int64:
+                    DALEC_log[col] = DALEC_log[col].astype(np.int64)
+            record.update({'rows_out': len(DALEC_log), 'rows_dropped': record['rows_in'] - len(DALEC_log)})
+    # remove saturated readings (every channel of a sample goes if any of them are saturated)
+    if removeSaturated:
+        with dalecMetrics.stage('saturation_drop', rows_in=len(DALEC_log), samples_dropped=0) as record:
+            saturated = DALEC_log[' Saturation Flag'].values == 1
+            if saturated.any():
+                indSat = np.unique(DALEC_log['Sample #'].values[saturated])
+                DALEC_log = DALEC_log[~DALEC_log['Sample #'].isin(indSat)]
+                record['samples_dropped'] = len(indSat)
+            record.update({'rows_out': len(DALEC_log), 'rows_dropped': record['rows_in'] - len(DALEC_log)})
+    return DALEC_log
+
+def long_format_sample_rows(DALEC_log, n_pix, channels=['Ed', 'Lu', 'Lsky']):
+    """
+    finds where each pixel of each sample is in a long format DALEC log
+    returns the sample numbers and a (n_samples, n_channels, n_pix) array of row positions (sorted by spectral_ind),
+    so eg. DALEC_log['Spectral Magnitude'].values[rows] gives all the spectra as one array
+    samples which don't have every channel and pixel are left out
+    """
+    sample = DALEC_log.index.get_level_values(0).values
+    codes = pd.Categorical(DALEC_log.index.get_level_values(1).values, categories=channels).codes
+    order = np.lexsort((DALEC_log['spectral_ind'].values, codes, sample))
+    uniques, counts = np.unique(sample[order], return_counts=True)
+    complete = (counts == len(channels) * n_pix)
+    # make sure we're not counting rows from other channels
+    in_channels = np.add.reduceat((codes[order] >= 0).astype(int), np.cumsum(counts) - counts) if len(counts) else counts
+    complete &= (in_channels == counts)
+    rows = order[np.repeat(complete, counts)]
+    return uniques[complete], rows.reshape(-1, len(channels), n_pix)
+
+def DALEC_wide_to_long(DALEC_log, integerIndex=True):
+    """
+    converts a wide DALEC log (one row per sample & channel) to long format, indexed by (Sample #, Channel)
+    with one row per pixel - doing this with numpy is much quicker than pd.wide_to_long
+    """
+    spec_cols = [col for col in DALEC_log.columns if col.startswith(' Spec[')]
+    meta_cols = [col for col in DALEC_log.columns if not col.startswith(' Spec[') and col not in ['Sample #', ' Channel']]
+    spectral_ind = np.array([int(col[6:-1]) for col in spec_cols])
+    n_pix = len(spec_cols)
+
+    with dalecMetrics.stage('long_format', rows_in=len(DALEC_log)) as record:
+        duplicated = DALEC_log.duplicated(['Sample #', ' Channel'])
+        if duplicated.any():
+            dalecMetrics.warn('duplicated sample numbers found - this might be a serially logged file, '
+                              + 'in which case try multiLogLoad()', rows_duplicated=int(duplicated.sum()))
+        # stable sort so that each channel's spectrum stays in pixel order
+        DALEC_log = DALEC_log.sort_values(['Sample #', ' Channel'], kind='mergesort')
+
         if integerIndex:
             # change sample no. index to integer
-            print('WARNING: some of my old code wont work with integerIndex=True - delete this line once this is sorted')
-            idx = DALEC_log.index
-            DALEC_log.index = DALEC_log.index.set_levels([idx.levels[0].astype(int), idx.levels[1]])
-        # sort index
-        DALEC_log.sort_index(inplace=True)
-        # change saturation flag to int.
-        DALEC_log[' Saturation Flag'] = DALEC_log[' Saturation Flag'].astype(int)
-        # format column as datetimes
-        DALEC_log[' UTC Date'] = pd.to_datetime(DALEC_log[' UTC Date'], dayfirst=True, infer_datetime_format=True)
-        # remove saturated readings - this hasn't been tested on a df which isn't in long format!
-        if removeSaturated:
-            indSat = DALEC_log[DALEC_log[' Saturation Flag'] == 1].index.get_level_values(0)
-            if list(indSat): # checks if the list is empty
-                DALEC_log.drop(indSat, level=0, axis=0, inplace=True)
+            dalecMetrics.warn('some of my old code wont work with integerIndex=True - delete this line once this is sorted')
+            samples = DALEC_log['Sample #'].values
+        else:
+            samples = DALEC_log['Sample #'].astype(str).values
+        index = pd.MultiIndex.from_arrays([np.repeat(samples, n_pix),
+                                           np.repeat(DALEC_log[' Channel'].values, n_pix)],
+                                          names=['Sample #', ' Channel'])
+        data = {'spectral_ind': np.tile(spectral_ind, len(DALEC_log))}
+        for col in meta_cols:
+            data[col] = np.repeat(DALEC_log[col].values, n_pix)
+        data['Spectral Magnitude'] = DALEC_log[spec_cols].values.astype(np.float64).ravel()
+        record['rows_out'] = len(data['Spectral Magnitude'])
+        if dalecMetrics.enabled():
+            record['samples'] = len(np.unique(samples))
+    return pd.DataFrame(data=data, index=index)
 
+def load_DALEC_log(filepath, header=216, dropNA=True, longFormat=True, integerIndex=True, removeSaturated=True, parse_dates=True,
+                   cache=False, cache_dir=None):
+    """
+    loads DALEC log file (excluding spectral wavelength mappings)
+    optionally returns log file in long format
+    option to convert sample no. index to an integer, or to keep as a string (integerIndex)
+    header and parse_dates are no longer needed (see parse_DALEC_dtf()) but are kept so older code still works
+    cache=True keeps a copy of the cleaned log on disk (see dalecCache), so loading the same file again is much quicker
+    """
+    # the cleaned log is cached in wide format, as long format repeats all the metadata for every pixel
+    # (so would be ~10x bigger on disk)
+    removeSaturated = removeSaturated and longFormat # this hasn't been tested on a df which isn't in long format!
+    loader = lambda fp: _clean_DALEC_log_wide(parse_DALEC_dtf(fp)['data'], dropNA=dropNA, removeSaturated=removeSaturated)
+    with dalecMetrics.stage('load_DALEC_log', file=str(filepath), cache=cache) as record:
+        if cache:
+            key_options = {'loader': 'load_DALEC_log', 'dropNA': dropNA, 'removeSaturated': removeSaturated}
+            DALEC_log = dalecCache.load_cached(filepath, loader, key_options, cache_dir=cache_dir)
+        else:
+            DALEC_log = loader(filepath)
+        if longFormat:
+            DALEC_log = DALEC_wide_to_long(DALEC_log, integerIndex=integerIndex)
+        record['rows_out'] = len(DALEC_log)
     return DALEC_log
 
 from scipy import interpolate
+from scipy import sparse
+import functools
 # there are other interpolation methods too, but I think this is probably fine?
 
+@functools.lru_cache(maxsize=64)
+def _grid_operator(x, nsteps, min_waveL, max_waveL):
+    x = np.asarray(x, dtype=np.float64)
+    wavelength_grid = np.linspace(min_waveL, max_waveL, num=nsteps)
+    # same error as interp1d if we try to go outside the range of the DALEC wavelengths
+    if wavelength_grid[0] < x.min():
+        raise ValueError("A value in x_new is below the interpolation range.")
+    if wavelength_grid[-1] > x.max():
+        raise ValueError("A value in x_new is above the interpolation range.")
+    # linear interpolation between the two pixels either side of each grid wavelength
+    order = np.argsort(x, kind='mergesort')
+    x_sorted = x[order]
+    lo = np.clip(np.searchsorted(x_sorted, wavelength_grid, side='right') - 1, 0, len(x) - 2)
+    t = (wavelength_grid - x_sorted[lo]) / (x_sorted[lo + 1] - x_sorted[lo])
+    rows = np.concatenate([np.arange(nsteps), np.arange(nsteps)])
+    cols = np.concatenate([order[lo], order[lo + 1]])
+    weights = np.concatenate([1 - t, t])
+    operator = sparse.csr_matrix((weights, (rows, cols)), shape=(nsteps, len(x)))
+    operator.eliminate_zeros()
+    return wavelength_grid, operator
+
+def grid_operator(spect_wavelengths, param='Lu', nsteps=200, min_waveL=400, max_waveL=1000):
+    """
+    - returns the uniform wavelength grid and a sparse (nsteps, n_pixels) matrix which linearly interpolates the
+    spectrum for channel param onto it (so gridded = operator @ spectrum, same as uniform_grid_spectra())
+    - these only get built once for each combination of wavelengths, nsteps, min_waveL and max_waveL, after that
+    they're cached
+    """
+    x = tuple(np.asarray(spect_wavelengths[param].values, dtype=np.float64))
+    return _grid_operator(x, int(nsteps), float(min_waveL), float(max_waveL))
+
+def uniform_grid_spectra_batch(spectra, spect_wavelengths, param='Lu', nsteps=200, min_waveL=400, max_waveL=1000):
+    """
+    - grids a whole set of spectra (array with shape (n_samples, n_pixels), all from channel param) in one go
+    - returns the wavelength grid and a (n_samples, nsteps) array of gridded spectra
+    - see dalecCube.DalecCube.uniform_grid() to do this for a whole log
+    """
+    with dalecMetrics.stage('regrid', param=param) as record:
+        wavelength_grid, operator = grid_operator(spect_wavelengths, param=param, nsteps=nsteps,
+                                                  min_waveL=min_waveL, max_waveL=max_waveL)
+        spectra = np.asarray(spectra)
+        gridded = operator @ spectra.reshape(-1, spectra.shape[-1]).T
+        record['spectra'] = gridded.shape[1]
+    return wavelength_grid, np.asarray(gridded.T).reshape(spectra.shape[:-1] + (nsteps,))
+
 def uniform_grid_spectra(DALEC_sample, spect_wavelengths, param='Lu', nsteps=200, min_waveL=400, max_waveL=1000):
     """
     - takes spectrum from a single sample of a DALEC log file and converts to a uniform grid
     - grid is defined by nsteps, min_waveL and max_waveL
     - param gives which variable to grid: can choose between 'Lu', 'Lsky' and 'Ed' 
     """
-    wavelength_grid = np.linspace(min_waveL, max_waveL, num=nsteps)
-    
     y = DALEC_sample.loc[param]['Spectral Magnitude'].values
-    x = spect_wavelengths[param].values
-    interp = interpolate.interp1d(x, y)
+    wavelength_grid, gridded = uniform_grid_spectra_batch(y, spect_wavelengths, param=param, nsteps=nsteps,
+                                                          min_waveL=min_waveL, max_waveL=max_waveL)
     out = np.column_stack((wavelength_grid,
-                         interp(wavelength_grid)))
+                           gridded))
     
     return out
 
+def long_format_rho(DALEC_log, spect_wavelengths, RHO, param='Lsky'):
+    """
+    - rho (from a rhoModels model) for every row of a long format DALEC log, using each row's solar elevation and
+    relative azimuth (and the wavelength of its pixel in channel param, for models which depend on wavelength)
+    - the model only gets evaluated once per sample, not for every row
+    """
+    pixel = np.searchsorted(spect_wavelengths['Pixel_no'].values, DALEC_log['spectral_ind'].values)
+    return rhoModels.run_rho(RHO, DALEC_log[' Solar Elev'].values, DALEC_log[' Relaz'].values,
+                             wavelengths=spect_wavelengths[param].values, pixel=pixel)
+
 # just in case I want to use the old version again!
 
 # def uniform_grid_spectra_mean(DALEC_log, spect_wavelengths, nsteps=601, min_waveL=400, max_waveL=1000):
@@ -143,17 +387,26 @@ def uniform_grid_spectra_mean(DALEC_log, spect_wavelengths, RHO=0.028, nsteps=60
     - takes mean spectrum from an entire DALEC log file and converts to a uniform grid
     - grid is defined by nsteps, min_waveL and max_waveL
     - returns a pandas DF with Lu_mean, Lsky_mean and Ed_mean
+    - RHO can be a number or a rhoModels model (rho for each sample, in which case Rrs_mean uses the mean of rho * Lsky)
     """
     # this is a much more optimal way than previously! - 
-    df = DALEC_log.copy() # not sure if neccesary but perhaps best to be on the safe side?
-    # setting spectral_ind as an index might be useful for other stuff too?
-    df.set_index('spectral_ind', append=True, inplace=True)
-    df = df.groupby(level=[' Channel', 'spectral_ind']).mean(numeric_only=True)
-    Lu_mean = uniform_grid_spectra(df, spect_wavelengths, param='Lu', nsteps=nsteps)
-    Lsky_mean = uniform_grid_spectra(df, spect_wavelengths, param='Lsky', nsteps=nsteps)
-    Ed_mean = uniform_grid_spectra(df, spect_wavelengths, param='Ed', nsteps=nsteps)
-    
-    Rrs_mean = (Lu_mean[:, 1] - (RHO * Lsky_mean[:, 1])) / Ed_mean[:, 1]
+    with dalecMetrics.stage('uniform_grid_spectra_mean', rows_in=len(DALEC_log)):
+        df = DALEC_log.copy() # not sure if neccesary but perhaps best to be on the safe side?
+        if not np.isscalar(RHO):
+            df['rho Lsky'] = long_format_rho(DALEC_log, spect_wavelengths, RHO) * df['Spectral Magnitude'].values
+        # setting spectral_ind as an index might be useful for other stuff too?
+        df.set_index('spectral_ind', append=True, inplace=True)
+        df = df.groupby(level=[' Channel', 'spectral_ind']).mean(numeric_only=True)
+        Lu_mean = uniform_grid_spectra(df, spect_wavelengths, param='Lu', nsteps=nsteps)
+        Lsky_mean = uniform_grid_spectra(df, spect_wavelengths, param='Lsky', nsteps=nsteps)
+        Ed_mean = uniform_grid_spectra(df, spect_wavelengths, param='Ed', nsteps=nsteps)
+        if np.isscalar(RHO):
+            rho_Lsky = RHO * Lsky_mean[:, 1]
+        else:
+            rho_Lsky = uniform_grid_spectra_batch(df.loc['Lsky']['rho Lsky'].values, spect_wavelengths, param='Lsky',
+                                                  nsteps=nsteps)[1]
+    
+    Rrs_mean = (Lu_mean[:, 1] - rho_Lsky) / Ed_mean[:, 1]
     
     df_out = pd.DataFrame(data={'Wavelength': Lu_mean[:, 0],
                                'Lu_mean': Lu_mean[:, 1], 
@@ -186,51 +439,89 @@ def uniform_grid_spectra_mean(DALEC_log, spect_wavelengths, RHO=0.028, nsteps=60
 #                                'Rrs_mean': Rrs_mean})
 #     return df_out
 
+def describe_spectra(spectra, percentiles=[.25, .5, .75]):
+    """
+    summary stats for each wavelength of a (n_samples, n_wavelengths) array, same as pandas describe() does:
+    returns the column names (count, mean, std, min, percentiles..., max) and a (n_wavelengths, n_stats) array
+    """
+    # describe() always includes the median
+    percentiles = sorted(set(percentiles) | {0.5})
+    spectra = np.asarray(spectra, dtype=np.float64)
+    count = np.sum(~np.isnan(spectra), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(spectra, axis=0) / count
+        std = np.where(count > 1, np.sqrt(np.nansum((spectra - mean)**2, axis=0) / (count - 1)), np.nan)
+    if len(spectra):
+        quantiles = np.nanpercentile(spectra, [0] + [100 * p for p in percentiles] + [100], axis=0)
+    else:
+        quantiles = np.full((len(percentiles) + 2, spectra.shape[1]), np.nan)
+    colnames = ['count', 'mean', 'std', 'min'] + ['{:g}%'.format(100 * p) for p in percentiles] + ['max']
+    summary = np.column_stack([count, mean, std, quantiles[0]] + list(quantiles[1:-1]) + [quantiles[-1]])
+    return colnames, summary
+
 def uniform_grid_spectra_stats(DALEC_log, spect_wavelengths, RHO=0.028, nsteps=601, min_waveL=400, max_waveL=1000, 
                                percentiles=[.25, .5, .75],
                                fastGridding=True):
     """
     - finds summary stats from an entire DALEC log file and converts to a uniform grid
     - grid is defined by nsteps, min_waveL and max_waveL
-    - returns a pandas DF with Lu_mean, Lsky_mean and Ed_mean
+    - returns a pandas DF with the wavelength grid and Rrs count, mean, std, min, percentiles and max at each wavelength
+    - fastGridding=False grids Lu, Lsky and Ed for every sample before calculating Rrs (this is the accurate way)
+    - RHO can be a number or a rhoModels model (rho for each sample)
     """
-    df = DALEC_log.copy() # not sure if neccesary but perhaps best to be on the safe side?
-    
-    # drop saturation flag to prevent this being included in the summary
-    df.drop(labels=' Saturation Flag', axis=1, inplace=True)
-    df.set_index('spectral_ind', append=True, inplace=True)
-    
-    if fastGridding:
-        print('WARNING: fastGridding enabled! - this will produce results much faster,'
-              + ' but works by calculating Rrs before Lu, Lsky, and Ed have been interpolated'
-              + ' to the same wavelength grid. Therefore, Rrs calculation may be inaccurate.')
-        # previously needed to drop the Channel level, but now seems like not required... weird
-        Lu = df.loc[:, 'Lu', :]['Spectral Magnitude']#.droplevel(' Channel')
-        Lsky = df.loc[:, 'Lsky', :]['Spectral Magnitude']#.droplevel(' Channel')
-        Ed = df.loc[:, 'Ed', :]['Spectral Magnitude']#.droplevel(' Channel')
-    
-        df_Rrs = (Lu - (RHO * Lsky)) / Ed
-        df_Rrs = df_Rrs.groupby(level=['spectral_ind']).describe(percentiles=percentiles)
-        wavelength_grid = np.linspace(min_waveL, max_waveL, num=nsteps)
-    
-        y = df_Rrs.values
-        x = spect_wavelengths['Lu'].values
+    with dalecMetrics.stage('uniform_grid_spectra_stats', rows_in=len(DALEC_log), fastGridding=fastGridding):
+        if fastGridding:
+            df = DALEC_log.copy() # not sure if neccesary but perhaps best to be on the safe side?
+            # drop saturation flag to prevent this being included in the summary
+            df.drop(labels=' Saturation Flag', axis=1, inplace=True)
+            if not np.isscalar(RHO):
+                df['rho'] = long_format_rho(DALEC_log, spect_wavelengths, RHO)
+            df.set_index('spectral_ind', append=True, inplace=True)
 
-        interp = interpolate.interp1d(x, y, axis=0)
-        Rrs_summary = np.column_stack((wavelength_grid,
-                                   interp(wavelength_grid)))
-        colnames = ['wavelength'] + list(df_Rrs.columns) # get column names
-        df_out = pd.DataFrame(data=Rrs_summary, columns=colnames)
+            dalecMetrics.warn('fastGridding enabled! - this will produce results much faster,'
+                              + ' but works by calculating Rrs before Lu, Lsky, and Ed have been interpolated'
+                              + ' to the same wavelength grid. Therefore, Rrs calculation may be inaccurate.'
+                              + ' Set fastGridding=False for the accurate version.')
+            # previously needed to drop the Channel level, but now seems like not required... weird
+            Lu = df.loc[:, 'Lu', :]['Spectral Magnitude']#.droplevel(' Channel')
+            Lsky = df.loc[:, 'Lsky', :]['Spectral Magnitude']#.droplevel(' Channel')
+            Ed = df.loc[:, 'Ed', :]['Spectral Magnitude']#.droplevel(' Channel')
+    
+            rho = RHO if np.isscalar(RHO) else df.loc[:, 'Lsky', :]['rho']
+            df_Rrs = (Lu - (rho * Lsky)) / Ed
+            df_Rrs = df_Rrs.groupby(level=['spectral_ind']).describe(percentiles=percentiles)
+            wavelength_grid = np.linspace(min_waveL, max_waveL, num=nsteps)
+    
+            y = df_Rrs.values
+            x = spect_wavelengths['Lu'].values
 
-    else:
-        print('WARNING fast gridding disabled. Interpolation of Lu, Lsky and Ed may be VERY SLOW \
-               for datasets with large numbers of samples. Try enabling fastGridding for much faster,\
-               but potentially less accurate results... \n \n \
-               NOTE: "slowGridding" not yet developed. \n \n \
-               RETURNING None')
+            with dalecMetrics.stage('regrid', param='Rrs summary', spectra=y.shape[1]):
+                interp = interpolate.interp1d(x, y, axis=0)
+                Rrs_summary = np.column_stack((wavelength_grid,
+                                           interp(wavelength_grid)))
+            colnames = ['wavelength'] + list(df_Rrs.columns) # get column names
+            df_out = pd.DataFrame(data=Rrs_summary, columns=colnames)
+
+        else:
+            # put every sample's Lu, Lsky and Ed onto the same grid first, then calculate Rrs for each sample
+            # all done as array operations over every sample at once, so this is still pretty quick
+            samples, rows = long_format_sample_rows(DALEC_log, len(spect_wavelengths))
+            spectra = DALEC_log['Spectral Magnitude'].values[rows]
+            gridded = {}
+            for i, param in enumerate(['Ed', 'Lu', 'Lsky']):
+                wavelength_grid, gridded[param] = uniform_grid_spectra_batch(spectra[:, i, :], spect_wavelengths,
+                                                                             param=param, nsteps=nsteps,
+                                                                             min_waveL=min_waveL, max_waveL=max_waveL)
+            first_rows = rows[:, 0, 0]
+            rho = rhoModels.sample_rho(RHO, DALEC_log[' Solar Elev'].values[first_rows],
+                                       DALEC_log[' Relaz'].values[first_rows], wavelengths=wavelength_grid)
+            if np.ndim(rho) == 1:
+                rho = rho[:, None]
+            Rrs = (gridded['Lu'] - (rho * gridded['Lsky'])) / gridded['Ed']
+            colnames, summary = describe_spectra(Rrs, percentiles=percentiles)
+            df_out = pd.DataFrame(data=np.column_stack((wavelength_grid, summary)),
+                                  columns=['wavelength'] + colnames)
 
-        df_out = None
-    
     #df = df.groupby(level=[' Channel', 'spectral_ind']).describe(percentiles=percentiles)
     
 
@@ -259,13 +550,19 @@ def uniform_grid_spectra_stats(DALEC_log, spect_wavelengths, RHO=0.028, nsteps=6
 def uniform_grid_spectra_Rrs(DALEC_sample, spect_wavelengths, RHO=0.028, nsteps=601, min_waveL=400, max_waveL=1000):
     '''
     takes a single sample from a DALEC log and does spectrum gridding followed by basic Rrs calculation
+    RHO can be a number or a rhoModels model (using the sample's solar elevation and relative azimuth)
     '''
-    Lu = uniform_grid_spectra(DALEC_sample, spect_wavelengths, param='Lu', nsteps=nsteps)[:, 1]
-    Lsky = uniform_grid_spectra(DALEC_sample, spect_wavelengths, param='Lsky', nsteps=nsteps)[:, 1]
-    Ed = uniform_grid_spectra(DALEC_sample, spect_wavelengths, param='Ed', nsteps=nsteps)[:, 1]
-    Rrs = (Lu - (RHO * Lsky)) / Ed
-    
-    wavelengths = uniform_grid_spectra(DALEC_sample, spect_wavelengths, param='Lu', nsteps=nsteps)[:, 0]
+    grid = lambda param: uniform_grid_spectra(DALEC_sample, spect_wavelengths, param=param, nsteps=nsteps,
+                                              min_waveL=min_waveL, max_waveL=max_waveL)
+    Lu = grid('Lu')
+    Lsky = grid('Lsky')[:, 1]
+    Ed = grid('Ed')[:, 1]
+    wavelengths, Lu = Lu[:, 0], Lu[:, 1]
+    rho = rhoModels.sample_rho(RHO, DALEC_sample[' Solar Elev'].values[:1], DALEC_sample[' Relaz'].values[:1],
+                               wavelengths=wavelengths)
+    if np.ndim(rho):
+        rho = rho[0]
+    Rrs = (Lu - (rho * Lsky)) / Ed
     
     df_out = pd.DataFrame(data={'Wavelength': wavelengths,
                                'Lu': Lu, 
@@ -280,87 +577,47 @@ def multiLogLoad(filepath,
                  header=216, 
                  dropNA=True,longFormat=True, 
                  integerIndex=True,
-                 removeSaturated=True):
+                 removeSaturated=True,
+                 cache=False, cache_dir=None,
+                 logs=None):
     """
     - loads multiple logs which are all contained in a single logfile (eg. that was generated using serial logging of DALEC
     - depending on how the logfile was generated, adjusting 'sep' might allow for different situations...
-    - should probably think a bit more about this for a continuous logging application
-    """
-    # ideally specify dtype of all rows for efficiency and to prevent bad things - TODO!
-    # need to specify str for lots of columns as these have some rows which contain stuff we need to remove
-    df = pd.read_csv(filepath,
-                     header=header,
-                     parse_dates=True,
-                     dayfirst=True,
-                     infer_datetime_format=True,
-                     dtype={'Sample #': str,
-                                   ' Lat': str, 
-                                   ' Lon': str,
-                                   ' Solar Azi': str,
-                                   ' Solar Elev': str,
-                                   ' Relaz': str,
-                                   ' Heading': str,
-                                   ' Pitch': str,
-                                   ' Roll': str,
-                                   ' Gearpos': str,
-                                   ' Voltage': str,
-                                   ' Temp': str,
-                                   'Channel': str,
-                                   ' Integration Time': str,
-                                   ' Saturation Flag': str,
-                                   ' Spec[21]': str,
-                                   ' Spec[22]': str,
-                                  },
-                     )
-    
-    groups = df['Sample #'].isin(sep).cumsum()
-    names = ['Log ' + str(i) for i in range(len(set(groups)))] 
-    tables = {name: g[1].iloc[1:] for g,name in zip(df.groupby(groups), names)} 
-    # because we've used 'DALEC (SN:0005)' as the way to seperate logfiles, we need to remove the first lines before this
-    # if a different sep is used, then this line may no longer work... so perhaps need to make this more robust!
-    tables.pop('Log 0')
-    
-    for name, table in tables.items():
-        # any row with invalid UTC date can be removed
-        table.drop(table[table[' UTC Date'].isna()].index, inplace = True)
-        # this removes the duplicated headings
-        table.drop(table[table[' UTC Date'] == 'UTC Date'].index, inplace = True)
-        if dropNA:
-            table.dropna(inplace=True, axis=0,)
-        if longFormat:
-            # convert to long format
-            # need to test that these variable names always load in this way (leading space on Spec etc.)
-            table = pd.wide_to_long(table, [' Spec['], i=['Sample #', ' Channel'], j='spectral_ind', suffix='\d+]')
-            table.reset_index(level=2, inplace=True) # remove spectral_ind as an index
-            table['spectral_ind'] = pd.to_numeric(table['spectral_ind'].str[:-1]) # convert spectral_ind to numeric
-            table.rename(columns={' Spec[': 'Spectral Magnitude'}, inplace=True)
-            table = table.astype({'Spectral Magnitude': 'float64'})
-        if integerIndex:
-            # change sample no. index to integer
-            print('WARNING: some of my old code wont work with integerIndex=True - delete this line once this is sorted')
-            idx = table.index
-            table.index = table.index.set_levels([idx.levels[0].astype(int), idx.levels[1]])
-        # sort index
-        table.sort_index(inplace=True)
-        # change saturation flag to int.
-        table[' Saturation Flag'] = table[' Saturation Flag'].astype(int)
-        # format column as datetimes
-        table[' UTC Date'] = pd.to_datetime(table[' UTC Date'], dayfirst=True, infer_datetime_format=True)
-        # remove saturated readings - this hasn't been tested on a df which isn't in long format!
-        if removeSaturated:
-            indSat = table[table[' Saturation Flag'] == 1].index.get_level_values(0)
-            if list(indSat): # checks if the list is empty
-                table.drop(indSat, level=0, axis=0, inplace=True)
-        
-        tables[name] = table
+    - for a continuous logging application (where the file is still being written) see dalecFollow.DalecFollower
+    - header is no longer needed (see parse_DALEC_dtf()) but is kept so older code still works
+    - cache=True keeps a copy of the loaded logs on disk (see dalecCache)
+    - logs (eg. [7]) only loads those logs, using the byte offset index next to the logfile (see dalecIndex) so the
+    rest of the file isn't parsed
+    """
+    removeSaturated = removeSaturated and longFormat
+    with dalecMetrics.stage('multiLogLoad', file=str(filepath), cache=cache) as record:
+        tables = _multiLogLoad(filepath, sep, dropNA, longFormat, integerIndex, removeSaturated, cache, cache_dir, logs)
+        record['logs'] = len(tables)
     return tables
-    
 
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+def _multiLogLoad(filepath, sep, dropNA, longFormat, integerIndex, removeSaturated, cache, cache_dir, logs):
+    if logs is not None:
+        import dalecIndex # imported here as dalecIndex imports this module
+        return {'Log ' + str(i): dalecIndex.load_DALEC_log_segment(filepath, i, sep=sep, dropNA=dropNA,
+                                                                   longFormat=longFormat, integerIndex=integerIndex,
+                                                                   removeSaturated=removeSaturated)
+                for i in logs}
+    def loader(fp):
+        parsed = parse_DALEC_dtf(fp, sep=sep)
+        groups = parsed['segment']
+        # because we've used 'DALEC (SN:0005)' as the way to seperate logfiles, we need to remove the rows before this
+        tables = {}
+        for i in range(1, groups.max() + 1 if len(groups) else 1):
+            tables['Log ' + str(i)] = _clean_DALEC_log_wide(parsed['data'][groups == i],
+                                                            dropNA=dropNA,
+                                                            removeSaturated=removeSaturated)
+        return tables
+
+    if cache:
+        key_options = {'loader': 'multiLogLoad', 'sep': list(sep), 'dropNA': dropNA, 'removeSaturated': removeSaturated}
+        tables = dalecCache.load_cached(filepath, loader, key_options, cache_dir=cache_dir)
+    else:
+        tables = loader(filepath)
+    if longFormat:
+        tables = {name: DALEC_wide_to_long(table, integerIndex=integerIndex) for name, table in tables.items()}
+    return tables
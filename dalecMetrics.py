@@ -0,0 +1,250 @@
+# stage level instrumentation for the loaders / gridders / extractors: wall time, peak memory, bytes read and row /
+# sample counts for each stage (parse, clean, saturation_drop, long_format, regrid, convolve, extract, ...), plus the
+# warnings and progress messages that used to just be printed, so rows which get dropped don't vanish without a trace
+# nothing is recorded unless a sink is switched on (when off a stage costs one check), eg.
+#   with dalecMetrics.recording('run_report.json', memory=True) as report:
+#       DALEC_log = dalecLoad.load_DALEC_log(file)
+#   report.summary()
+# or dalecMetrics.add_sink(dalecMetrics.logging_sink()) to log every stage as it finishes, or add_sink(any function
+# that takes a record dict)
+# stages run in worker processes (eg. load_multiple_SDs(n_workers=...)) aren't recorded, only the parent's
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import contextlib
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+_sinks = []
+_stack = [] # stages currently running (innermost last)
+_quiet = False # True stops warn() / note() printing (they still go to the sinks)
+
+def enabled():
+    '''
+    whether anything is recording - for counts which take a bit of work, only worth doing if something will see them
+    '''
+    return bool(_sinks)
+
+def add_sink(sink):
+    '''
+    sink is called with every record (a dict), see RunReport and logging_sink() for the ready made ones
+    '''
+    _sinks.append(sink)
+    return sink
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+def _emit(record):
+    for sink in list(_sinks):
+        sink(record)
+
+def _current_stage():
+    return _stack[-1].record['stage'] if _stack else None
+
+class Stage:
+    '''
+    times one stage (see stage())
+    '''
+    __slots__ = ('record', '_active', '_start', '_memory_start', '_peak')
+
+    def __init__(self, name, info):
+        self.record = {'stage': name}
+        self.record.update(info)
+        self._active = False
+
+    def __enter__(self):
+        self._active = bool(_sinks)
+        if self._active:
+            self.record['parent'] = _current_stage()
+            self._memory_start = None
+            if tracemalloc.is_tracing():
+                # tracemalloc only has one peak, so the parent keeps track of its own before it gets reset
+                current, peak = tracemalloc.get_traced_memory()
+                if _stack and _stack[-1]._memory_start is not None:
+                    _stack[-1]._peak = max(_stack[-1]._peak, peak)
+                tracemalloc.reset_peak()
+                self._memory_start, self._peak = current, current
+            _stack.append(self)
+            self.record['start'] = time.time()
+            self._start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._active:
+            return False
+        seconds = time.perf_counter() - self._start
+        _stack.remove(self)
+        record = {'type': 'stage'}
+        record.update(self.record)
+        record['seconds'] = seconds
+        if self._memory_start is not None and tracemalloc.is_tracing():
+            peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            record['peak_memory'] = peak - self._memory_start
+            if _stack and _stack[-1]._memory_start is not None:
+                _stack[-1]._peak = max(_stack[-1]._peak, peak)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__ + ': ' + str(exc)
+        _emit(record)
+        return False
+
+def stage(name, **info):
+    '''
+    context manager for one stage of processing, info (eg. file=filepath) goes in the record as it is
+        with dalecMetrics.stage('clean', rows_in=len(df)) as record:
+            df = df.dropna()
+            record['rows_out'] = len(df)
+    record is a plain dict which is always there (even when nothing is recording), so counts can just be set on it
+    the record sent to the sinks also has type='stage', parent (the stage this one is inside of), start (unix time),
+    seconds, peak_memory (bytes above what was allocated at the start, only if tracemalloc is running - see
+    recording()) and error (if the stage raised)
+    '''
+    return Stage(name, info)
+
+def warn(message, **info):
+    '''
+    prints 'WARNING: ' + message (unless quiet) and records it
+    '''
+    if not _quiet:
+        print('WARNING: ' + message)
+    if _sinks:
+        record = {'type': 'warning', 'stage': _current_stage(), 'message': message, 'start': time.time()}
+        record.update(info)
+        _emit(record)
+
+def note(message, **info):
+    '''
+    prints a progress message (unless quiet) and records it
+    '''
+    if not _quiet:
+        print(message)
+    if _sinks:
+        record = {'type': 'info', 'stage': _current_stage(), 'message': message, 'start': time.time()}
+        record.update(info)
+        _emit(record)
+
+def _format_bytes(n):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(n) < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(n, unit) if unit != 'B' else '{} B'.format(int(n))
+        n /= 1024
+
+def format_record(record):
+    '''
+    one line description of a record, eg. 'parse: 0.412 s, peak 85.3 MB, bytes_read=9.0 MB, rows_out=3000, ...'
+    '''
+    if record.get('type') != 'stage':
+        return record.get('type', '') + ': ' + str(record.get('message', ''))
+    parts = [record['stage'] + ': {:.3f} s'.format(record['seconds'])]
+    if record.get('peak_memory') is not None:
+        parts.append('peak ' + _format_bytes(record['peak_memory']))
+    for key, value in record.items():
+        if key in ['type', 'stage', 'parent', 'start', 'seconds', 'peak_memory']:
+            continue
+        parts.append(key + '=' + (_format_bytes(value) if key.startswith('bytes') else str(value)))
+    return ', '.join(parts)
+
+def logging_sink(logger=None, level=logging.INFO):
+    '''
+    sink which logs every record (warnings at logging.WARNING) to logger (default is the 'dalec' logger)
+    '''
+    if logger is None:
+        logger = logging.getLogger('dalec')
+    def sink(record):
+        logger.log(logging.WARNING if record.get('type') == 'warning' else level, format_record(record))
+    return sink
+
+class RunReport:
+    '''
+    sink which keeps every record, for looking at afterwards (stages(), summary(), messages()) or saving as a JSON run
+    report (to_json())
+    '''
+    def __init__(self):
+        self.records = []
+        self.started = time.time()
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def stages(self):
+        '''
+        df with a row per stage record, in the order they finished
+        '''
+        return pd.DataFrame([record for record in self.records if record.get('type') == 'stage'])
+
+    def messages(self):
+        '''
+        df of the warnings and progress messages
+        '''
+        return pd.DataFrame([record for record in self.records if record.get('type') != 'stage'],
+                            columns=['type', 'stage', 'message', 'start'])
+
+    def summary(self):
+        '''
+        one row per stage name: number of calls, total seconds, max peak_memory and the totals of the counts
+        (anything numeric which isn't a time)
+        '''
+        stages = self.stages()
+        if not len(stages):
+            return pd.DataFrame(columns=['calls', 'seconds'])
+        counts = [col for col in stages.columns if col not in ['start', 'seconds', 'peak_memory']
+                  and pd.api.types.is_numeric_dtype(stages[col]) and not pd.api.types.is_bool_dtype(stages[col])]
+        aggregations = {'calls': ('seconds', 'size'), 'seconds': ('seconds', 'sum')}
+        if 'peak_memory' in stages.columns:
+            aggregations['peak_memory'] = ('peak_memory', 'max')
+        # stages which don't have a count stay NaN rather than adding up to 0
+        aggregations.update({col: (col, lambda values: values.sum(min_count=1)) for col in counts})
+        return stages.groupby('stage', sort=False).agg(**aggregations).sort_values('seconds', ascending=False)
+
+    def to_dict(self):
+        return {'meta': {'started': pd.Timestamp(self.started, unit='s').isoformat(),
+                         'finished': pd.Timestamp.now().isoformat(),
+                         'python': platform.python_version(),
+                         'numpy': np.__version__,
+                         'pandas': pd.__version__,
+                         'platform': platform.platform(),
+                         'argv': sys.argv},
+                'summary': json.loads(self.summary().reset_index().to_json(orient='records')),
+                'records': self.records}
+
+    def to_json(self, path):
+        '''
+        writes the run report (meta, per stage summary and every record) to path
+        '''
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1, default=str)
+        return path
+
+@contextlib.contextmanager
+def recording(report_path=None, memory=False, sinks=(), quiet=False):
+    '''
+    records everything inside the with block into a RunReport (which is what you get back)
+    - report_path writes the JSON run report there at the end (even if something raised)
+    - memory=True runs tracemalloc so stages get a peak_memory (this slows things down a bit, roughly 1.5-3x)
+    - sinks are added for the duration too (eg. logging_sink())
+    - quiet=True stops the warnings / progress messages being printed (they're still recorded)
+    '''
+    global _quiet
+    report = RunReport()
+    added = [add_sink(sink) for sink in [report] + list(sinks)]
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    was_quiet, _quiet = _quiet, quiet or _quiet
+    try:
+        yield report
+    finally:
+        _quiet = was_quiet
+        if started_tracing:
+            tracemalloc.stop()
+        for sink in added:
+            remove_sink(sink)
+        if report_path is not None:
+            report.to_json(report_path)
@@ -0,0 +1,218 @@
+# quality control of DALEC samples: every rule gives a boolean array saying which samples fail it, all worked out on a
+# dalecCube.DalecCube at once (one value per sample, no row dropping along the way), then combined into one mask so
+# the filtered data comes from a single selection
+# rules are plain dicts (so a QC setup can be kept in a json file, see load_rules()), eg.
+#   rules = [{'rule': 'saturated'},
+#            {'rule': 'solar_elev', 'min': 20},
+#            {'rule': 'relaz', 'min': 90, 'max': 150},
+#            {'rule': 'glint', 'max': 0.01}]
+#   cube, report = dalecQC.apply_QC(cube, rules)
+# each rule is a function in RULES (rule name -> function(cube, **params)), so new ones can be added there
+import json
+import numpy as np
+import pandas as pd
+import dalecCube
+import dalecMetrics
+import rhoModels
+
+def _band_mean(cube, param, band):
+    # mean of channel param over the pixels with wavelengths in band=(min, max) for every sample
+    wavelengths = cube.spect_wavelengths[param].values
+    pixels = (wavelengths >= band[0]) & (wavelengths <= band[1])
+    if not pixels.any():
+        raise ValueError('no ' + param + ' pixels between ' + str(band[0]) + ' and ' + str(band[1]) + ' nm')
+    with np.errstate(invalid='ignore'):
+        return cube.channel(param)[:, pixels].astype(np.float64).mean(axis=1)
+
+def _band_Rrs(cube, band, RHO):
+    # Rrs averaged over band, from the band averaged Lu, Lsky and Ed (each channel uses its own wavelengths)
+    # RHO can be a rhoModels model too, which gets averaged over the band with Lsky
+    rho = rhoModels.sample_rho(RHO, cube.solar_elev, cube.relaz, wavelengths=cube.spect_wavelengths['Lsky'].values)
+    if np.ndim(rho) == 2:
+        wavelengths = cube.spect_wavelengths['Lsky'].values
+        pixels = (wavelengths >= band[0]) & (wavelengths <= band[1])
+        rho = rho[:, pixels].mean(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (_band_mean(cube, 'Lu', band) - (rho * _band_mean(cube, 'Lsky', band))) / _band_mean(cube, 'Ed', band)
+
+def saturated(cube):
+    '''
+    any channel has the saturation flag set
+    '''
+    return cube.saturated
+
+def solar_elev(cube, min=20.0):
+    '''
+    sun lower than min degrees (or no solar elevation)
+    '''
+    elev = cube.solar_elev.astype(np.float64)
+    return ~(elev >= min)
+
+def relaz(cube, min=90.0, max=150.0, absolute=True):
+    '''
+    relative azimuth (sensor - sun) outside min -> max degrees, absolute=True uses |relaz| (the DALEC logs it as
+    +- depending on which side of the sun it's pointing)
+    '''
+    values = cube.relaz.astype(np.float64)
+    if absolute:
+        values = np.abs(values)
+    return ~((values >= min) & (values <= max))
+
+def tilt(cube, max=5.0, max_pitch=None, max_roll=None):
+    '''
+    total tilt (sqrt(pitch^2 + roll^2)) more than max degrees, or pitch / roll individually more than max_pitch /
+    max_roll (if given)
+    '''
+    pitch = cube.meta['Pitch'].astype(np.float64)
+    roll = cube.meta['Roll'].astype(np.float64)
+    fail = ~(np.hypot(pitch, roll) <= max)
+    if max_pitch is not None:
+        fail |= ~(np.abs(pitch) <= max_pitch)
+    if max_roll is not None:
+        fail |= ~(np.abs(roll) <= max_roll)
+    return fail
+
+def gps_fix(cube, valid=['A']):
+    '''
+    GPS fix isn't one of valid ('A' is a valid fix in NMEA, 'V' is void), or there's no position
+    '''
+    fix = np.char.strip(np.asarray(cube.meta['GPS_Fix']).astype(str))
+    return ~np.isin(fix, valid) | ~np.isfinite(cube.lat.astype(np.float64)) | ~np.isfinite(cube.lon.astype(np.float64))
+
+def integration_time(cube, min=None, max=None):
+    '''
+    any channel's integration time (ms) below min or above max
+    '''
+    inttime = cube.integration_time
+    fail = np.zeros(len(cube), dtype=bool)
+    if min is not None:
+        fail |= (inttime < min).any(axis=1)
+    if max is not None:
+        fail |= (inttime > max).any(axis=1)
+    return fail
+
+def Ed_stability(cube, max_change=0.1, band=(400, 700), max_gap=60.0):
+    '''
+    Ed (averaged over band) changes by more than max_change (fraction) from the previous or to the next sample, eg.
+    clouds passing over the sun or shading - samples more than max_gap seconds apart aren't compared
+    (samples are compared in time order)
+    '''
+    order = np.argsort(cube.time, kind='stable')
+    Ed = _band_mean(cube, 'Ed', band)[order]
+    seconds = (cube.time[order] - cube.time[order][:1]) / np.timedelta64(1, 's') if len(cube) else np.zeros(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        change = np.abs(np.diff(Ed)) / np.fmin(Ed[1:], Ed[:-1])
+    # a jump counts against both samples either side of it
+    jump = (change > max_change) & (np.diff(seconds) <= max_gap)
+    fail = np.zeros(len(cube), dtype=bool)
+    fail[1:] |= jump
+    fail[:-1] |= jump
+    fail |= ~np.isfinite(Ed) | (Ed <= 0)
+    out = np.zeros(len(cube), dtype=bool)
+    out[order] = fail
+    return out
+
+def glint(cube, max=0.01, band=(750, 800), RHO=0.028):
+    '''
+    Rrs in the NIR (averaged over band) above max sr^-1 - water should be ~dark there, so a high NIR Rrs means sun
+    glint (or foam / something floating) that the RHO sky glint correction doesn't remove (RHO can be a number or a
+    rhoModels model, but only numbers can go in a json rules file)
+    '''
+    return ~(_band_Rrs(cube, band, RHO) <= max)
+
+def spectral_outlier(cube, z=3.5, bands=[(400, 500), (500, 600), (600, 700), (700, 800)], RHO=0.028):
+    '''
+    Rrs in any of bands is more than z robust standard deviations (1.4826 * median absolute deviation) from the
+    median of all the samples
+    '''
+    fail = np.zeros(len(cube), dtype=bool)
+    for band in bands:
+        Rrs = _band_Rrs(cube, band, RHO)
+        finite = np.isfinite(Rrs)
+        if not finite.any():
+            continue
+        median = np.median(Rrs[finite])
+        spread = 1.4826 * np.median(np.abs(Rrs[finite] - median))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fail |= ~(np.abs(Rrs - median) <= z * spread) if spread > 0 else (Rrs != median)
+    return fail
+
+RULES = {'saturated': saturated,
+         'solar_elev': solar_elev,
+         'relaz': relaz,
+         'tilt': tilt,
+         'gps_fix': gps_fix,
+         'integration_time': integration_time,
+         'Ed_stability': Ed_stability,
+         'glint': glint,
+         'spectral_outlier': spectral_outlier}
+
+# only rules which don't depend much on the site - relaz, glint and spectral_outlier need choosing for the deployment
+# (eg. turbid lochs can have NIR Rrs of ~0.04 without any glint)
+DEFAULT_RULES = [{'rule': 'saturated'},
+                 {'rule': 'gps_fix'},
+                 {'rule': 'solar_elev', 'min': 20},
+                 {'rule': 'tilt', 'max': 10},
+                 {'rule': 'Ed_stability', 'max_change': 0.1}]
+
+def load_rules(path):
+    '''
+    reads a list of rules (same format as DEFAULT_RULES) from a json file
+    '''
+    with open(path) as f:
+        return json.load(f)
+
+def evaluate_QC(cube, rules=DEFAULT_RULES):
+    '''
+    works out every rule for every sample in cube
+    returns a df with a boolean column per rule (True = fails), one row per sample (in cube order)
+    a rule's column is its 'name' if it has one (so the same rule can be used twice), otherwise the rule name
+    '''
+    fails = {}
+    for rule in rules:
+        params = {key: value for key, value in rule.items() if key not in ['rule', 'name']}
+        if rule['rule'] not in RULES:
+            raise ValueError("unknown QC rule '" + str(rule['rule']) + "' - choose from " + str(list(RULES)))
+        fails[rule.get('name', rule['rule'])] = np.asarray(RULES[rule['rule']](cube, **params), dtype=bool)
+    return pd.DataFrame(data=fails, index=pd.Index(cube.sample, name='Sample #'))
+
+def QC_report(fails):
+    '''
+    per rule rejection counts from evaluate_QC(): how many samples fail the rule, how many fail only that rule, and
+    how many are left after applying the rules in order
+    '''
+    values = fails.values
+    n_failed = values.sum(axis=1)
+    remaining = len(fails) - np.cumsum(values, axis=1).astype(bool).sum(axis=0) if len(fails.columns) else []
+    report = pd.DataFrame(data={'rejected': values.sum(axis=0),
+                                'only_this_rule': (values & (n_failed == 1)[:, None]).sum(axis=0),
+                                'remaining': remaining},
+                          index=pd.Index(fails.columns, name='rule'))
+    report.attrs['n_samples'] = len(fails)
+    report.attrs['n_passed'] = int((n_failed == 0).sum())
+    return report
+
+def apply_QC(DALEC_log, rules=DEFAULT_RULES, spect_wavelengths=None):
+    '''
+    filters a DALEC log with rules (see evaluate_QC())
+    - DALEC_log is a dalecCube.DalecCube or a long format DataFrame (spect_wavelengths is needed for the latter, and
+    samples which don't have every channel and pixel are dropped too)
+    returns (filtered log, report) - the filtered log is the same type as DALEC_log, the report is from QC_report()
+    with the boolean fails for every sample in .attrs['fails']
+    '''
+    if isinstance(DALEC_log, dalecCube.DalecCube):
+        cube = DALEC_log
+    else:
+        cube = dalecCube.DalecCube.from_long_format(DALEC_log, spect_wavelengths)
+    with dalecMetrics.stage('QC', samples_in=len(cube)) as record:
+        fails = evaluate_QC(cube, rules)
+        passed = ~fails.values.any(axis=1)
+        report = QC_report(fails)
+        record.update({'samples_out': int(passed.sum()), 'samples_dropped': int((~passed).sum())})
+        record.update({'rejected_' + rule: int(count) for rule, count in report['rejected'].items()})
+    report.attrs['fails'] = fails
+    if isinstance(DALEC_log, dalecCube.DalecCube):
+        return cube.select(passed), report
+    # one boolean mask over the rows rather than dropping samples from the index one at a time
+    keep = np.isin(DALEC_log.index.get_level_values(0).values, cube.sample[passed])
+    return DALEC_log[keep], report
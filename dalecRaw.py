@@ -0,0 +1,210 @@
+# loading raw DALEC logfiles (LOG_*.TXT, straight off the SD card) without having to run them through DALECproc first
+# raw files have the counts for all 256 pixels of each spectrometer, these get calibrated here with:
+#   L = gain * (counts - dark - dark_rate * inttime) / inttime
+# where gain, dark and dark_rate are per channel, per pixel arrays (see DalecCalibration)
+import numpy as np
+import pandas as pd
+import dalecLoad
+
+CHANNELS = ['Ed', 'Lu', 'Lsky']
+# raw column names which are different in the calibrated (.dtf) files
+RAW_COLUMN_NAMES = {'Inttime': 'Integration Time'}
+# DALECproc flags some spectra as saturated which peak a bit below 65535 (eg. 63142 in LOG_0055), so the default
+# threshold is a bit lower than the maximum count - this gives the same flags as the .dtf files in data/
+SATURATION_LEVEL = 60000
+
+class DalecCalibration:
+    '''
+    calibration coefficients for turning raw counts into radiometric units
+    - spect_wavelengths: wavelength mappings of the calibrated pixels (same format as
+    dalecLoad.load_DALEC_spect_wavelengths(), the Pixel_no column says which raw pixels are kept)
+    - gain, dark, dark_rate: (3, n_pixels) arrays, channels in the order of CHANNELS
+    (dark and dark_rate default to zero)
+    '''
+    def __init__(self, spect_wavelengths, gain, dark=None, dark_rate=None):
+        self.spect_wavelengths = spect_wavelengths
+        self.gain = np.asarray(gain, dtype=np.float64)
+        shape = self.gain.shape
+        self.dark = np.zeros(shape) if dark is None else np.asarray(dark, dtype=np.float64)
+        self.dark_rate = np.zeros(shape) if dark_rate is None else np.asarray(dark_rate, dtype=np.float64)
+        if shape != (len(CHANNELS), len(spect_wavelengths)) or self.dark.shape != shape or self.dark_rate.shape != shape:
+            raise ValueError('calibration arrays should all have shape ' + str((len(CHANNELS), len(spect_wavelengths))))
+
+    @property
+    def pixel(self):
+        return self.spect_wavelengths['Pixel_no'].values
+
+    def apply(self, counts, channel, inttime):
+        '''
+        calibrates a (n_spectra, 256) array of raw counts, where channel and inttime are the channel name and integration
+        time of each spectrum - returns a (n_spectra, n_pixels) array
+        '''
+        codes = pd.Categorical(channel, categories=CHANNELS).codes
+        if (codes < 0).any():
+            raise ValueError('unknown channel(s): ' + str(set(np.asarray(channel)[codes < 0])))
+        inttime = np.asarray(inttime, dtype=np.float64)[:, None]
+        counts = np.asarray(counts, dtype=np.float64)[:, self.pixel]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.gain[codes] * (counts - self.dark[codes] - self.dark_rate[codes] * inttime) / inttime
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f,
+                     spect_wavelengths=self.spect_wavelengths[['Pixel_no'] + CHANNELS].values.astype(np.float64),
+                     gain=self.gain, dark=self.dark, dark_rate=self.dark_rate)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as npz:
+            spect_wavelengths = pd.DataFrame(data=npz['spect_wavelengths'], columns=['Pixel_no'] + CHANNELS)
+            spect_wavelengths['Pixel_no'] = spect_wavelengths['Pixel_no'].astype(np.int64)
+            return cls(spect_wavelengths, npz['gain'], npz['dark'], npz['dark_rate'])
+
+    @classmethod
+    def from_dtf_pair(cls, txt_files, dtf_files, saturation_level=SATURATION_LEVEL):
+        '''
+        estimates the calibration by fitting gain, dark and dark_rate (for each channel and pixel) by least squares
+        from raw files and the .dtf files DALECproc made from them
+        - this is only an approximation of the DALECproc calibration (which isn't just linear), the fit is typically
+        within ~1% for Ed and Lu but can be a lot worse for Lsky at short integration times - use the real calibration
+        coefficients where you have them!
+        '''
+        txt_files, dtf_files = np.atleast_1d(txt_files), np.atleast_1d(dtf_files)
+        counts, channel, inttime, calibrated = [], [], [], []
+        for txt_file, dtf_file in zip(txt_files, dtf_files):
+            raw = parse_DALEC_txt(txt_file)['data']
+            dtf = dalecLoad.parse_DALEC_dtf(dtf_file)
+            cal = dtf['data']
+            if len(raw) != len(cal) or not (raw['Sample #'].values == cal['Sample #'].values).all():
+                raise ValueError(str(txt_file) + " and " + str(dtf_file) + " don't have the same samples")
+            spec_cols = [col for col in cal.columns if col.startswith(' Spec[')]
+            raw_counts = raw[_spec_columns(raw)].values
+            keep = (raw_counts < saturation_level).all(axis=1) & cal[spec_cols].notna().all(axis=1).values
+            counts.append(raw_counts[keep])
+            channel.append(raw[' Channel'].values[keep])
+            inttime.append(raw[' Integration Time'].values[keep])
+            calibrated.append(cal[spec_cols].values[keep])
+            spect_wavelengths = dtf['spect_wavelengths']
+        counts, channel = np.concatenate(counts), np.concatenate(channel)
+        inttime, calibrated = np.concatenate(inttime).astype(np.float64), np.concatenate(calibrated)
+        pixel = spect_wavelengths['Pixel_no'].values
+
+        # L * inttime = gain * counts - gain * dark - gain * dark_rate * inttime, ie. linear in (counts, 1, inttime)
+        gain, dark, dark_rate = (np.zeros((len(CHANNELS), len(pixel))) for _ in range(3))
+        for i, name in enumerate(CHANNELS):
+            x = counts[channel == name][:, pixel].astype(np.float64)
+            t = inttime[channel == name]
+            y = calibrated[channel == name] * t[:, None]
+            # design matrix for every pixel at once: (n_pixels, n_spectra, 3)
+            A = np.stack([x.T, np.ones(x.T.shape), np.broadcast_to(t, x.T.shape)], axis=2)
+            coef = np.linalg.solve(np.einsum('pni,pnj->pij', A, A), np.einsum('pni,np->pi', A, y))
+            gain[i] = coef[:, 0]
+            dark[i] = -coef[:, 1] / coef[:, 0]
+            dark_rate[i] = -coef[:, 2] / coef[:, 0]
+        return cls(spect_wavelengths, gain, dark, dark_rate)
+
+def _expand_columns(header_line):
+    '''
+    column names from the 'Sample #' line of a raw file, where the spectra are written as Spec[0],...,Spec[255]
+    names are changed to match the calibrated (.dtf) files (leading spaces, Inttime -> Integration Time)
+    '''
+    names = [name.strip() for name in header_line.strip().split(',')]
+    columns = []
+    for i, name in enumerate(names):
+        if name == '...':
+            first, last = int(names[i - 1][5:-1]), int(names[i + 1][5:-1])
+            columns += ['Spec[' + str(n) + ']' for n in range(first + 1, last)]
+        else:
+            columns.append(name)
+    return [col if col == 'Sample #' else ' ' + RAW_COLUMN_NAMES.get(col, col) for col in columns]
+
+def _spec_columns(DALEC_log):
+    return [col for col in DALEC_log.columns if col.startswith(' Spec[')]
+
+def _parse_raw_rows(data, columns):
+    DALEC_log, _ = dalecLoad._parse_DALEC_rows(data, columns)
+    spec_cols = _spec_columns(DALEC_log)
+    DALEC_log[spec_cols] = DALEC_log[spec_cols].astype(np.int64)
+    # the firmware writes milliseconds as 4 digits sometimes (eg. 09:30:40.0003 is 09:30:40.003), DALECproc
+    # always writes 3 so do the same here
+    time = DALEC_log[' UTC Time'].str.split('.', n=1, expand=True)
+    if len(DALEC_log):
+        DALEC_log[' UTC Time'] = time[0] + '.' + time[1].astype(np.int64).map('{:03d}'.format)
+    datetime = (DALEC_log[' UTC Date'].values + pd.to_timedelta(DALEC_log[' UTC Time'].values).values)
+    return DALEC_log, datetime
+
+def parse_DALEC_txt(filepath, sep=['DALEC (SN:0005)']):
+    """
+    single pass parser for raw DALEC logfiles (LOG_*.TXT), works the same way as dalecLoad.parse_DALEC_dtf()
+    returns a dict with:
+    'header' (dict of the 'key: value' lines, eg. FIRMWARE), 'columns', 'data' (typed wide DataFrame of raw counts,
+    one row per sample & channel), 'datetime', 'segment' and 'config' (one dict of the CONFIGURATION block settings,
+    eg. INTTIME_ED, SIMULT, AUTO_INTTIME, for each segment)
+    """
+    sep = tuple(s.encode() for s in sep)
+    header = {}
+    columns = None
+    rows = []
+    segment_starts = []
+    config = []
+    with open(filepath, 'rb') as f:
+        for line in f:
+            if line[:1].isdigit():
+                if columns is not None and line.count(b',') == n_commas and line.endswith(b'\n'):
+                    rows.append(line)
+            elif line.startswith(sep):
+                segment_starts.append(len(rows))
+                config.append({})
+            elif line.startswith(b'Sample #'):
+                # the column header gets repeated after every configuration block
+                if columns is None:
+                    columns = _expand_columns(line.decode('latin-1'))
+                    n_commas = len(columns) - 1
+            elif b' = ' in line:
+                key, value = line.decode('latin-1').split(' = ', 1)
+                if not config:
+                    config.append({})
+                config[-1][key.strip()] = value.strip()
+            elif b':' in line:
+                key, value = line.decode('latin-1').split(':', 1)
+                header[key.strip()] = value.strip()
+
+    if columns is None:
+        raise ValueError("couldn't find a 'Sample #' header - is this a raw DALEC (LOG_*.TXT) file?")
+    DALEC_log, datetime = _parse_raw_rows(b''.join(rows), columns)
+    segment = np.zeros(len(rows), dtype=np.int64)
+    for start in segment_starts:
+        segment[start:] += 1
+    return {'header': header, 'columns': columns, 'data': DALEC_log, 'datetime': datetime, 'segment': segment,
+            'config': config}
+
+def calibrate_DALEC_log(DALEC_log, calibration, saturation_level=SATURATION_LEVEL):
+    '''
+    turns a wide DataFrame of raw counts (from parse_DALEC_txt()) into the same format as a calibrated .dtf file
+    (ie. the 'data' from dalecLoad.parse_DALEC_dtf()), all channels are calibrated in one go
+    spectra with any pixel >= saturation_level get a Saturation Flag of 1
+    '''
+    counts = DALEC_log[_spec_columns(DALEC_log)].values
+    spectra = calibration.apply(counts, DALEC_log[' Channel'].values, DALEC_log[' Integration Time'].values)
+    data = {col: DALEC_log[col].values for col in dalecLoad.DALEC_DTF_DTYPES if col in DALEC_log.columns}
+    data[' Saturation Flag'] = (counts >= saturation_level).any(axis=1).astype(np.int64)
+    columns = [col for col in dalecLoad.DALEC_DTF_DTYPES if col in data]
+    out = pd.DataFrame(data=data, columns=columns, index=DALEC_log.index)
+    spec_cols = [' Spec[' + str(pixel) + ']' for pixel in calibration.pixel]
+    return pd.concat([out, pd.DataFrame(data=spectra, columns=spec_cols, index=DALEC_log.index)], axis=1)
+
+def load_DALEC_txt(filepath, calibration, dropNA=True, longFormat=True, integerIndex=True, removeSaturated=True,
+                   saturation_level=SATURATION_LEVEL):
+    """
+    loads and calibrates a raw DALEC logfile (LOG_*.TXT)
+    returns the same as dalecLoad.load_DALEC_log() would for the .dtf version of the file, plus the CONFIGURATION
+    block settings in .attrs['config'] (and the spectral wavelength mappings are calibration.spect_wavelengths)
+    calibration is a DalecCalibration (eg. DalecCalibration.load('cal.npz'))
+    """
+    parsed = parse_DALEC_txt(filepath)
+    DALEC_log = calibrate_DALEC_log(parsed['data'], calibration, saturation_level=saturation_level)
+    DALEC_log = dalecLoad.clean_DALEC_log(DALEC_log, dropNA=dropNA, longFormat=longFormat, integerIndex=integerIndex,
+                                          removeSaturated=removeSaturated)
+    DALEC_log.attrs['header'] = parsed['header']
+    DALEC_log.attrs['config'] = parsed['config']
+    return DALEC_log
@@ -0,0 +1,320 @@
+# streaming (constant memory) summary stats for gridded DALEC spectra and Rrs
+# samples can be added a chunk (or one sample) at a time, and accumulators from different files/days/workers can be
+# merged, so eg. weeks of deployment can be summarised without ever holding all of it in memory
+import json
+import numpy as np
+import pandas as pd
+import dalecCube
+import rhoModels
+
+PARAMS = ['Ed', 'Lu', 'Lsky', 'Rrs']
+
+class SpectraAccumulator:
+    '''
+    running stats for each wavelength of a stream of spectra (each spectrum being n_wavelengths long):
+    - count, mean and variance using Welford's method (with Chan et al.'s formula to add whole chunks / merge)
+    - exact min and max
+    - approximate quantiles from a t-digest style sketch: every wavelength keeps at most compression/2 + 1 centroids,
+    which are small near the tails (0 and 1) and bigger around the median, so extreme percentiles stay accurate
+    NaNs are ignored (so count can be different at each wavelength)
+    '''
+    def __init__(self, n_wavelengths, compression=200, buffer_size=500):
+        self.n_wavelengths = n_wavelengths
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.count = np.zeros(n_wavelengths, dtype=np.int64)
+        self.mean = np.zeros(n_wavelengths)
+        self.m2 = np.zeros(n_wavelengths) # sum of squared differences from the mean
+        self.min = np.full(n_wavelengths, np.nan)
+        self.max = np.full(n_wavelengths, np.nan)
+        n_centroids = int(compression // 2) + 1
+        self.centroid_mean = np.zeros((n_wavelengths, n_centroids))
+        self.centroid_weight = np.zeros((n_wavelengths, n_centroids))
+        self._buffer = []
+        self._n_buffered = 0
+
+    def add(self, spectra):
+        '''
+        adds a (n_samples, n_wavelengths) array of spectra (or a single spectrum)
+        '''
+        spectra = np.atleast_2d(np.asarray(spectra, dtype=np.float64))
+        if spectra.shape[1] != self.n_wavelengths:
+            raise ValueError('spectra have ' + str(spectra.shape[1]) + ' wavelengths, expected '
+                             + str(self.n_wavelengths))
+        if not len(spectra):
+            return
+        valid = ~np.isnan(spectra)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(spectra, axis=0) / count, 0)
+        m2 = np.nansum((spectra - mean)**2, axis=0)
+        self._combine_moments(count, mean, m2)
+        with np.errstate(invalid='ignore'):
+            self.min = np.fmin(self.min, np.nanmin(np.where(valid, spectra, np.inf), axis=0))
+            self.max = np.fmax(self.max, np.nanmax(np.where(valid, spectra, -np.inf), axis=0))
+        self.min[self.count == 0] = np.nan
+        self.max[self.count == 0] = np.nan
+
+        self._buffer.append(spectra.T)
+        self._n_buffered += len(spectra)
+        if self._n_buffered >= self.buffer_size:
+            self._compress()
+
+    def _combine_moments(self, count, mean, m2):
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta**2 * self.count * count / total, 0)
+        self.count = total
+
+    def _compress(self, values=None, weights=None):
+        '''
+        merges the buffered values (and/or extra centroids) into the sketch
+        '''
+        values = [self.centroid_mean] + self._buffer + ([] if values is None else [values])
+        weights = ([self.centroid_weight] + [np.ones(v.shape) for v in self._buffer]
+                   + ([] if weights is None else [weights]))
+        values = np.concatenate(values, axis=1)
+        weights = np.concatenate(weights, axis=1)
+        self._buffer = []
+        self._n_buffered = 0
+
+        # empty slots and NaNs get no weight and are sorted to the end of each row
+        weights = np.where(np.isnan(values), 0, weights)
+        values = np.where(weights > 0, values, np.inf)
+        order = np.argsort(values, axis=1, kind='stable')
+        values = np.take_along_axis(values, order, axis=1)
+        weights = np.take_along_axis(weights, order, axis=1)
+        values[weights == 0] = 0
+
+        total = weights.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            q = (np.cumsum(weights, axis=1) - weights / 2) / total
+        q = np.nan_to_num(q)
+        # t-digest k1 scale function - each centroid covers (at most about) one unit of k
+        n_centroids = self.centroid_mean.shape[1]
+        k = self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1)) + self.compression / 4
+        bucket = np.clip(np.floor(k).astype(np.int64), 0, n_centroids - 1)
+        flat = (np.arange(self.n_wavelengths)[:, None] * n_centroids + bucket).ravel()
+        size = self.n_wavelengths * n_centroids
+        weight = np.bincount(flat, weights=weights.ravel(), minlength=size)
+        weighted_sum = np.bincount(flat, weights=(weights * values).ravel(), minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(weight > 0, weighted_sum / weight, 0)
+        self.centroid_weight = weight.reshape(self.n_wavelengths, n_centroids)
+        self.centroid_mean = mean.reshape(self.n_wavelengths, n_centroids)
+
+    def merge(self, other):
+        '''
+        adds everything from another accumulator (with the same number of wavelengths) into this one
+        '''
+        if other.n_wavelengths != self.n_wavelengths:
+            raise ValueError("can't merge accumulators with different numbers of wavelengths")
+        other._compress()
+        self._combine_moments(other.count, other.mean, other.m2)
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        self._compress(other.centroid_mean, other.centroid_weight)
+        return self
+
+    @property
+    def std(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+    def quantile(self, q):
+        '''
+        approximate quantiles (q between 0 and 1, can be a list), returns a (len(q), n_wavelengths) array
+        '''
+        self._compress()
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        out = np.full((len(q), self.n_wavelengths), np.nan)
+        for i in np.flatnonzero(self.count > 0):
+            used = self.centroid_weight[i] > 0
+            weight = self.centroid_weight[i][used]
+            # centroids are treated as points in the middle of their weight, with the exact min and max at the ends
+            position = np.concatenate([[0], np.cumsum(weight) - weight / 2, [weight.sum()]])
+            value = np.concatenate([[self.min[i]], self.centroid_mean[i][used], [self.max[i]]])
+            out[:, i] = np.interp(q * weight.sum(), position, value)
+        return out
+
+    def describe(self, percentiles=[.25, .5, .75]):
+        '''
+        same column names and layout as dalecLoad.describe_spectra(), but with approximate percentiles
+        '''
+        percentiles = sorted(set(percentiles) | {0.5})
+        colnames = ['count', 'mean', 'std', 'min'] + ['{:g}%'.format(100 * p) for p in percentiles] + ['max']
+        with np.errstate(invalid='ignore'):
+            mean = np.where(self.count > 0, self.mean, np.nan)
+        summary = np.column_stack([self.count, mean, self.std, self.min] + list(self.quantile(percentiles))
+                                  + [self.max])
+        return colnames, summary
+
+    def to_arrays(self, prefix=''):
+        self._compress()
+        return {prefix + key: getattr(self, key) for key in ['count', 'mean', 'm2', 'min', 'max',
+                                                             'centroid_mean', 'centroid_weight']}
+
+    @classmethod
+    def from_arrays(cls, arrays, compression, buffer_size=500, prefix=''):
+        acc = cls(len(arrays[prefix + 'count']), compression=compression, buffer_size=buffer_size)
+        for key in ['count', 'mean', 'm2', 'min', 'max', 'centroid_mean', 'centroid_weight']:
+            setattr(acc, key, arrays[prefix + key])
+        return acc
+
+class GriddedStats:
+    '''
+    streaming stats for Ed, Lu, Lsky and Rrs on a uniform wavelength grid (one SpectraAccumulator each)
+    feed it with add_cube(), add_log() or add_gridded() (which takes the products from dalecFollow.DalecFollower,
+    so eg. DalecFollower(..., callbacks=[lambda cube, products: stats.add_gridded(products, cube)]) works)
+    RHO can be a number or a rhoModels model (rho for each sample), for a model the mean of rho * Lsky is kept too so
+    that mean_frame() can use it
+    '''
+    def __init__(self, nsteps=601, min_waveL=400, max_waveL=1000, RHO=0.028, compression=200, buffer_size=500):
+        self.nsteps = nsteps
+        self.min_waveL = min_waveL
+        self.max_waveL = max_waveL
+        self.RHO = RHO
+        self.compression = compression
+        self.wavelength = np.linspace(min_waveL, max_waveL, num=nsteps)
+        self.accumulators = {param: SpectraAccumulator(nsteps, compression=compression, buffer_size=buffer_size)
+                             for param in PARAMS}
+        # running sum + count of rho * Lsky (only used with a rho model)
+        self.rho_Lsky_sum = np.zeros(nsteps)
+        self.rho_Lsky_count = np.zeros(nsteps, dtype=np.int64)
+
+    def _settings(self):
+        return {'nsteps': self.nsteps, 'min_waveL': self.min_waveL, 'max_waveL': self.max_waveL,
+                'RHO': rhoModels.describe_rho(self.RHO), 'compression': self.compression}
+
+    @property
+    def count(self):
+        '''
+        number of samples added so far (counting those with NaNs)
+        '''
+        return int(self.accumulators['Ed'].count.max()) if self.nsteps else 0
+
+    def add_gridded(self, gridded, cube=None):
+        '''
+        adds gridded spectra: a dict with (n_samples, nsteps) arrays for 'Ed', 'Lu' and 'Lsky' (and optionally 'Rrs',
+        which is calculated using RHO if it's not there)
+        with a rho model for RHO, cube (the dalecCube.DalecCube the spectra were gridded from) is needed for the
+        geometry of each sample
+        '''
+        if np.isscalar(self.RHO):
+            rho_Lsky = None
+        else:
+            if cube is None:
+                raise ValueError('GriddedStats with a rho model needs the cube the gridded spectra came from')
+            rho_Lsky = rhoModels.cube_rho(self.RHO, cube, self.wavelength) * gridded['Lsky']
+            self.rho_Lsky_sum += np.nansum(rho_Lsky, axis=0)
+            self.rho_Lsky_count += np.sum(~np.isnan(rho_Lsky), axis=0)
+        if 'Rrs' not in gridded:
+            if rho_Lsky is None:
+                rho_Lsky = self.RHO * gridded['Lsky']
+            with np.errstate(invalid='ignore', divide='ignore'):
+                gridded = dict(gridded, Rrs=(gridded['Lu'] - rho_Lsky) / gridded['Ed'])
+        for param in PARAMS:
+            self.accumulators[param].add(gridded[param])
+        return self
+
+    def add_cube(self, cube):
+        '''
+        adds every sample in a dalecCube.DalecCube
+        '''
+        return self.add_gridded(cube.uniform_grid(nsteps=self.nsteps, min_waveL=self.min_waveL,
+                                                  max_waveL=self.max_waveL), cube)
+
+    def add_log(self, DALEC_log, spect_wavelengths):
+        '''
+        adds every sample in a long format DALEC log (as returned by dalecLoad.load_DALEC_log())
+        '''
+        return self.add_cube(dalecCube.DalecCube.from_long_format(DALEC_log, spect_wavelengths))
+
+    def merge(self, other):
+        '''
+        adds everything from another GriddedStats (which must have the same grid, RHO and compression)
+        '''
+        if other._settings() != self._settings():
+            raise ValueError("can't merge GriddedStats with different settings: " + str(self._settings())
+                             + ' vs ' + str(other._settings()))
+        for param in PARAMS:
+            self.accumulators[param].merge(other.accumulators[param])
+        self.rho_Lsky_sum += other.rho_Lsky_sum
+        self.rho_Lsky_count += other.rho_Lsky_count
+        return self
+
+    def summary(self, param='Rrs', percentiles=[.25, .5, .75]):
+        '''
+        summary stats of param at each wavelength, in the same format as dalecLoad.uniform_grid_spectra_stats()
+        (percentiles are approximate)
+        '''
+        colnames, summary = self.accumulators[param].describe(percentiles=percentiles)
+        return pd.DataFrame(data=np.column_stack((self.wavelength, summary)), columns=['wavelength'] + colnames)
+
+    def mean_frame(self):
+        '''
+        mean spectra in the same format as dalecLoad.uniform_grid_spectra_mean()
+        (Rrs_mean is worked out from the mean Lu, Lsky and Ed, like it is there - with a rho model, from the mean of
+        rho * Lsky instead of Lsky)
+        '''
+        mean = {param: self.accumulators[param].describe()[1][:, 1] for param in ['Lu', 'Lsky', 'Ed']}
+        if isinstance(self.RHO, str) or not np.isscalar(self.RHO):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rho_Lsky = np.where(self.rho_Lsky_count > 0, self.rho_Lsky_sum / self.rho_Lsky_count, np.nan)
+        else:
+            rho_Lsky = self.RHO * mean['Lsky']
+        return pd.DataFrame(data={'Wavelength': self.wavelength,
+                                  'Lu_mean': mean['Lu'],
+                                  'Lsky_mean': mean['Lsky'],
+                                  'Ed_mean': mean['Ed'],
+                                  'Rrs_mean': (mean['Lu'] - rho_Lsky) / mean['Ed']})
+
+    def save(self, path):
+        '''
+        saves the accumulated stats (as a .npz) so they can be loaded and merged later
+        '''
+        arrays = {}
+        for param in PARAMS:
+            arrays.update(self.accumulators[param].to_arrays(prefix=param + '_'))
+        arrays['rho_Lsky_sum'] = self.rho_Lsky_sum
+        arrays['rho_Lsky_count'] = self.rho_Lsky_count
+        arrays['settings'] = np.array(json.dumps(self._settings()))
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+        settings = json.loads(str(arrays['settings']))
+        # a rho model comes back from its table's path (if it's still there), otherwise RHO is just its description,
+        # which is enough for summaries / merging but not for adding more samples
+        settings['RHO'] = rhoModels.rho_from_description(settings['RHO'])
+        stats = cls(**settings)
+        if 'rho_Lsky_sum' in arrays:
+            stats.rho_Lsky_sum = arrays['rho_Lsky_sum']
+            stats.rho_Lsky_count = arrays['rho_Lsky_count']
+        for param in PARAMS:
+            stats.accumulators[param] = SpectraAccumulator.from_arrays(arrays, stats.compression,
+                                                                       prefix=param + '_')
+        return stats
+
+def load_DALEC_log_stats(filepath, stats=None, nsteps=601, min_waveL=400, max_waveL=1000, RHO=0.028,
+                         chunk_samples=None, **kwargs):
+    '''
+    loads a DALEC log (see dalecCube.load_DALEC_cube(), kwargs are passed on) and adds it to stats
+    (a new GriddedStats is made if stats isn't given), so eg. a list of daily files can be summarised one at a time
+    chunk_samples reads the file that many samples at a time instead (see dalecChunked.process_DALEC_chunks()), so
+    memory use doesn't grow with the length of the file (only dropNA and removeSaturated are used from kwargs then)
+    '''
+    if stats is None:
+        stats = GriddedStats(nsteps=nsteps, min_waveL=min_waveL, max_waveL=max_waveL, RHO=RHO)
+    if chunk_samples is not None:
+        import dalecChunked # imported here as dalecChunked imports this module
+        options = {key: kwargs[key] for key in ['dropNA', 'removeSaturated'] if key in kwargs}
+        return dalecChunked.process_DALEC_chunks(filepath, stats=stats, chunk_samples=chunk_samples,
+                                                 nsteps=stats.nsteps, min_waveL=stats.min_waveL,
+                                                 max_waveL=stats.max_waveL, RHO=stats.RHO, **options)['stats']
+    return stats.add_cube(dalecCube.load_DALEC_cube(filepath, **kwargs))
@@ -0,0 +1,253 @@
+# persistent store of DALEC vs satellite matchups (band Rrs from the DALEC logs, rho_s from the scenes), kept in SQLite
+# so that the superDuperDF doesn't have to be rebuilt from every raw file each time
+# each source file is fingerprinted (size, mtime + content hash) along with the options it was processed with, so an
+# update only processes files which are new, have changed or were done with different options
+import os
+import json
+import sqlite3
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import dalecLoad
+import dalecCache
+import sceneCatalog
+import SD_NC_loading
+import spectralConv
+import dalecMetrics
+
+STORE_VERSION = 1
+
+class MatchupStore:
+    '''
+    SQLite store of matchups, by site (any name, eg. 'airthrey'), eg.
+        store = MatchupStore('matchups.sqlite')
+        store.update_DALEC('airthrey', 'data/DALEC/')
+        store.update_scenes('airthrey', 'data/SD/', coord=(56.147209, -3.923337))
+        superDuperDF = store.superDuperDF('airthrey')
+    - DALEC_df(), SD_df() and superDuperDF() give the same as SD_NC_loading.load_SD_summarise_multiple_DALEC_days(),
+    load_multiple_SDs() and join_DALEC_SD_dfs()
+    - rho_s is stored as it is in the scenes (divided by pi when read, if div_by_pi), and every scene is kept (same
+    day scenes are only skipped when read, if skipSameDay)
+    - the SD_NC_loading plotting / NDPCI functions can be given a store instead of a superDuperDF (if it only has
+    one site)
+    '''
+    def __init__(self, path):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self._create()
+
+    def _create(self):
+        with self.connection as con:
+            con.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)')
+            row = con.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+            if row is not None and int(row[0]) != STORE_VERSION:
+                for table in ['sources', 'dalec', 'scenes']:
+                    con.execute('DROP TABLE IF EXISTS ' + table)
+            con.execute('''CREATE TABLE IF NOT EXISTS sources (
+                               site TEXT, kind TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, hash TEXT,
+                               options TEXT, error TEXT, PRIMARY KEY (site, kind, path))''')
+            con.execute('''CREATE TABLE IF NOT EXISTS dalec (
+                               site TEXT, path TEXT, date TEXT, wavelength REAL, param TEXT, value REAL)''')
+            con.execute('''CREATE TABLE IF NOT EXISTS scenes (
+                               site TEXT, path TEXT, isodate TEXT, date TEXT, wavelength REAL, pixel TEXT, value REAL)''')
+            con.execute('CREATE INDEX IF NOT EXISTS dalec_site ON dalec (site, path)')
+            con.execute('CREATE INDEX IF NOT EXISTS scenes_site ON scenes (site, path)')
+            con.execute("INSERT OR REPLACE INTO info VALUES ('version', ?)", (str(STORE_VERSION),))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def sites(self):
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT site FROM sources ORDER BY site')]
+
+    def _site(self, site):
+        if site is not None:
+            return site
+        sites = self.sites()
+        if len(sites) != 1:
+            raise ValueError('the store has ' + str(len(sites)) + ' sites, so say which one you want: ' + str(sites))
+        return sites[0]
+
+    def _changed(self, site, kind, files, options):
+        '''
+        works out which files need (re)processing, returns a list of (path, size, mtime_ns, hash) for them and a list
+        of the known files which have gone
+        files which only look different (eg. touched or copied, but with the same contents) just get their size and
+        mtime updated
+        '''
+        options = json.dumps(options, sort_keys=True, default=str)
+        known = {row[0]: row[1:] for row in self.connection.execute(
+            'SELECT path, size, mtime_ns, hash, options FROM sources WHERE site = ? AND kind = ?', (site, kind))}
+        todo = []
+        for path in files:
+            st = os.stat(path)
+            if path in known:
+                size, mtime_ns, content_hash, known_options = known[path]
+                if known_options == options:
+                    if (size, mtime_ns) == (st.st_size, st.st_mtime_ns):
+                        continue
+                    if dalecCache.file_hash(path) == content_hash:
+                        with self.connection as con:
+                            con.execute('UPDATE sources SET size = ?, mtime_ns = ? WHERE site = ? AND kind = ? '
+                                        'AND path = ?', (st.st_size, st.st_mtime_ns, site, kind, path))
+                        continue
+            todo.append((path, st.st_size, st.st_mtime_ns, dalecCache.file_hash(path)))
+        gone = [path for path in known if path not in files]
+        return todo, gone, options
+
+    def _replace(self, site, kind, table, done, gone, options, rows, errors):
+        # swaps the rows for every processed / gone file in one transaction, so the store is never half updated
+        with self.connection as con:
+            for path in [path for path, _, _, _ in done] + gone:
+                con.execute('DELETE FROM ' + table + ' WHERE site = ? AND path = ?', (site, path))
+            for path in gone:
+                con.execute('DELETE FROM sources WHERE site = ? AND kind = ? AND path = ?', (site, kind, path))
+            con.executemany('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            [(site, kind, path, size, mtime_ns, content_hash, options, errors.get(path))
+                             for path, size, mtime_ns, content_hash in done])
+            if rows:
+                con.executemany('INSERT INTO ' + table + ' VALUES (' + ', '.join('?' * len(rows[0])) + ')', rows)
+
+    @staticmethod
+    def _run(function, jobs, n_workers):
+        # runs the (safe) job function on every job, in a process pool if n_workers
+        if n_workers is None:
+            return [function(job) for job in jobs]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool:
+            return list(pool.map(function, jobs))
+
+    def update_DALEC(self, site, DALEC_directory, RSR_doves_file='non-DALEC-data/RSR-Superdove.csv',
+                     dalec_summary_function=dalecLoad.uniform_grid_spectra_mean, DALEC_col_name='DALEC_mean_Rrs',
+                     cache=False, cache_dir=None, n_workers=None):
+        '''
+        adds the band Rrs for every .dtf file in DALEC_directory (see
+        SD_NC_loading.load_SD_summarise_multiple_DALEC_days() for the options) which isn't already in the store
+        for this site, or has changed since it was added - files which have gone from the directory are removed
+        returns a dict with the number of files processed, removed and failed
+        '''
+        directory = os.path.abspath(DALEC_directory)
+        files = [os.path.join(directory, file) for file in sorted(os.listdir(directory)) if file.endswith('.dtf')]
+        options = {'function': dalec_summary_function.__module__ + '.' + dalec_summary_function.__name__,
+                   'RSR_doves_file': os.path.abspath(RSR_doves_file), 'param': DALEC_col_name}
+        todo, gone, options = self._changed(site, 'dalec', files, options)
+        gone = [path for path in gone if os.path.dirname(path) == directory]
+        rows, errors = [], {}
+        if todo:
+            RSR_doves = pd.read_csv(RSR_doves_file)
+            spect_wavelengths = dalecLoad.load_DALEC_spect_wavelengths(todo[0][0])
+            # the Date is stored as the time of the first sample, so both dateOnly options can be read back
+            jobs = [(path, spect_wavelengths, RSR_doves, dalec_summary_function, DALEC_col_name, False,
+                     spectralConv.DOVES_WAVELENGTHS, cache, cache_dir) for path, _, _, _ in todo]
+            for (path, _, _, _), (DALEC_df, error) in zip(todo, self._run(SD_NC_loading._summarise_DALEC_file_safe,
+                                                                          jobs, n_workers)):
+                if error is not None:
+                    dalecMetrics.warn('failed to load ' + path + ' - ' + error, file=path)
+                    errors[path] = error
+                    continue
+                DALEC_df = DALEC_df.reset_index()
+                rows += [(site, path, pd.Timestamp(date).isoformat(), float(wavelength), DALEC_col_name, float(value))
+                         for date, wavelength, value in zip(DALEC_df['Date'], DALEC_df['Wavelength'],
+                                                            DALEC_df[DALEC_col_name])]
+        self._replace(site, 'dalec', 'dalec', todo, gone, options, rows, errors)
+        return {'processed': len(todo) - len(errors), 'removed': len(gone), 'failed': len(errors)}
+
+    def update_scenes(self, site, SD_directory, coord, pixel_grid_shape=(3, 3), catalog=None, n_workers=None):
+        '''
+        adds the rho_s grid at coord (see SD_NC_loading.load_multiple_SDs()) for every scene in SD_directory covering
+        coord which isn't already in the store for this site, or has changed - scenes which have gone are removed
+        catalog is a sceneCatalog.SceneCatalog (or its filename), so only new scenes need opening to find which cover
+        coord (default is sceneCatalog.default_catalog_path(SD_directory))
+        returns a dict with the number of scenes processed, removed and failed
+        '''
+        own_catalog = catalog is None or isinstance(catalog, str)
+        if own_catalog:
+            catalog = sceneCatalog.SceneCatalog(sceneCatalog.default_catalog_path(SD_directory)
+                                                if catalog is None else catalog)
+        try:
+            catalog.update(SD_directory)
+            files = list(catalog.query(lat=coord[0], lon=coord[1], directory=SD_directory)['path'])
+        finally:
+            # a catalog passed in is left open for the caller
+            if own_catalog:
+                catalog.close()
+        options = {'coord': list(coord), 'shape': list(pixel_grid_shape)}
+        todo, gone, options = self._changed(site, 'scene', files, options)
+        directory = os.path.abspath(SD_directory)
+        gone = [path for path in gone if os.path.dirname(path) == directory]
+        rows, errors = [], {}
+        jobs = [(path, coord, pixel_grid_shape) for path, _, _, _ in todo]
+        for (path, _, _, _), (result, error) in zip(todo, self._run(SD_NC_loading._extract_SD_scene_safe, jobs,
+                                                                    n_workers)):
+            if error is not None:
+                dalecMetrics.warn('failed to load ' + path + ' - ' + error, file=path)
+                errors[path] = error
+                continue
+            isodate, SD_spect = result
+            date = pd.to_datetime(isodate).date().isoformat()
+            for pixel in SD_spect.columns[1:]:
+                rows += [(site, path, isodate, date, float(wavelength), pixel, float(value))
+                         for wavelength, value in zip(SD_spect['Wavelength'], SD_spect[pixel])]
+        self._replace(site, 'scene', 'scenes', todo, gone, options, rows, errors)
+        return {'processed': len(todo) - len(errors), 'removed': len(gone), 'failed': len(errors)}
+
+    def DALEC_df(self, site=None, DALEC_col_name='DALEC_mean_Rrs', dateOnly=True):
+        '''
+        DALEC band Rrs for a site, same format as SD_NC_loading.load_SD_summarise_multiple_DALEC_days()
+        '''
+        site = self._site(site)
+        DALEC_df = pd.read_sql_query('SELECT date AS Date, wavelength AS Wavelength, value AS ' + DALEC_col_name
+                                     + ' FROM dalec WHERE site = ? AND param = ?', self.connection,
+                                     params=(site, DALEC_col_name))
+        DALEC_df['Date'] = pd.to_datetime(DALEC_df['Date'])
+        if dateOnly:
+            DALEC_df['Date'] = DALEC_df['Date'].dt.date
+        return DALEC_df.set_index(['Date', 'Wavelength']).sort_values(['Date', 'Wavelength'])
+
+    def SD_df(self, site=None, div_by_pi=True, skipSameDay=True):
+        '''
+        rho_s grids for a site, same format as SD_NC_loading.load_multiple_SDs()
+        '''
+        site = self._site(site)
+        scenes = pd.read_sql_query('SELECT isodate, date, wavelength, pixel, value FROM scenes WHERE site = ?',
+                                   self.connection, params=(site,))
+        if skipSameDay:
+            first = scenes.groupby('date')['isodate'].transform('min')
+            scenes = scenes[scenes['isodate'] == first]
+        SD_df = scenes.pivot_table(index=['isodate', 'wavelength'], columns='pixel', values='value', sort=False)
+        # keep the pixel columns in the same order as get_SD_NC_Spectra_grid()
+        SD_df = SD_df[pd.unique(scenes['pixel'])]
+        SD_df.columns.name = None
+        SD_df = SD_df.reset_index()
+        SD_df['Date'] = pd.to_datetime(SD_df['isodate']).dt.date
+        SD_df = SD_df.drop(columns='isodate').rename(columns={'wavelength': 'Wavelength'})
+        SD_df = SD_df.set_index(['Date', 'Wavelength'])
+        if div_by_pi:
+            SD_df = SD_df.div(np.pi)
+        return SD_df.sort_values(['Date', 'Wavelength'])
+
+    def superDuperDF(self, site=None, dropNA=True, DALEC_col_name='DALEC_mean_Rrs', div_by_pi=True,
+                     skipSameDay=True):
+        '''
+        DALEC_df() and SD_df() joined with SD_NC_loading.join_DALEC_SD_dfs()
+        '''
+        return SD_NC_loading.join_DALEC_SD_dfs(self.DALEC_df(site, DALEC_col_name=DALEC_col_name),
+                                               self.SD_df(site, div_by_pi=div_by_pi, skipSameDay=skipSameDay),
+                                               dropNA=dropNA)
+
+    def errors(self, site=None):
+        '''
+        source files which failed to process, with the error (they're tried again once they change)
+        '''
+        sql = 'SELECT site, kind, path, error FROM sources WHERE error IS NOT NULL'
+        params = ()
+        if site is not None:
+            sql, params = sql + ' AND site = ?', (site,)
+        return pd.DataFrame(self.connection.execute(sql, params).fetchall(), columns=['site', 'kind', 'path', 'error'])
@@ -0,0 +1,221 @@
+# sky glint (rho) models for Rrs = (Lu - rho * Lsky) / Ed
+# the Rrs functions (dalecLoad.uniform_grid_spectra_mean / _stats / _Rrs, spectralConv.SD_Rrs / SD_Rrs_batch,
+# dalecStats.GriddedStats, dalecChunked.process_DALEC_chunks, dalecFollow.DalecFollower and the dalecQC glint rules)
+# take RHO as either a number (used for every sample, as before) or one of these models, which give rho for each
+# sample from its own solar elevation and relative azimuth (and optionally for each wavelength)
+# settings / metadata saved to json store a model as describe_rho() (its table's path, or its repr)
+# - ConstantRho: the same rho everywhere (mainly so constant / LUT models can be swapped around)
+# - LUTRho: interpolated from a lookup table over solar zenith, relative azimuth, viewing zenith and wind speed
+#   (eg. Mobley 1999, see read_mobley_table()), kept as one array behind a scipy RegularGridInterpolator
+# the models are only evaluated once per run of samples with the same geometry (not for every row / pixel), so a per
+# sample rho costs about the same as the constant one
+import os
+import re
+import functools
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+class ConstantRho:
+    '''
+    the same rho for every sample (and wavelength)
+    '''
+    spectral = False
+
+    def __init__(self, rho=0.028):
+        self.value = float(rho)
+
+    def __repr__(self):
+        return 'ConstantRho(' + str(self.value) + ')'
+
+    def rho(self, solar_zenith, relaz, view_zenith=None, wind_speed=None, wavelengths=None):
+        n = np.broadcast(np.asarray(solar_zenith), np.asarray(relaz)).shape
+        if wavelengths is not None:
+            n = n + (len(wavelengths),)
+        return np.full(n, self.value)
+
+class LUTRho:
+    '''
+    rho interpolated (linearly) from a lookup table on a regular grid, like Mobley's (1999) tables
+    - rho is an array with shape (len(solar_zenith), len(relaz), len(view_zenith), len(wind_speed)), plus a
+    len(wavelength) axis on the end if wavelength is given (in which case rho can be worked out for each wavelength)
+    - the axes (degrees, m/s and nm) need to be increasing, relaz is the viewing azimuth relative to the sun (0 -> 180,
+    the DALEC's Relaz is folded into this range)
+    - view_zenith and wind_speed aren't logged by the DALEC, so the values used when they aren't given are set here
+    (40 degrees is the nominal viewing angle of the DALEC's Lu sensor)
+    - points outside the table are clipped to its edges rather than extrapolated
+    '''
+    def __init__(self, rho, solar_zenith, relaz, view_zenith, wind_speed, wavelength=None, default_view_zenith=40.0,
+                 default_wind_speed=5.0):
+        self.axes = [np.asarray(axis, dtype=np.float64) for axis in [solar_zenith, relaz, view_zenith, wind_speed]]
+        if wavelength is not None:
+            self.axes.append(np.asarray(wavelength, dtype=np.float64))
+        self.table = np.asarray(rho, dtype=np.float64)
+        if self.table.shape != tuple(len(axis) for axis in self.axes):
+            raise ValueError('rho table has shape ' + str(self.table.shape) + ' but the axes have lengths '
+                             + str(tuple(len(axis) for axis in self.axes)))
+        self.spectral = wavelength is not None
+        self.default_view_zenith = default_view_zenith
+        self.default_wind_speed = default_wind_speed
+        self.interpolator = RegularGridInterpolator(self.axes, self.table, method='linear')
+
+    def __repr__(self):
+        return ('LUTRho(' + ' x '.join(str(len(axis)) for axis in self.axes) + ' table, view_zenith='
+                + str(self.default_view_zenith) + ', wind_speed=' + str(self.default_wind_speed) + ')')
+
+    def rho(self, solar_zenith, relaz, view_zenith=None, wind_speed=None, wavelengths=None):
+        '''
+        rho for each sample (all the inputs are broadcast together), and each of wavelengths if they're given
+        returns an array with the broadcast shape (plus a len(wavelengths) axis on the end)
+        '''
+        view_zenith = self.default_view_zenith if view_zenith is None else view_zenith
+        wind_speed = self.default_wind_speed if wind_speed is None else wind_speed
+        # relative azimuth is symmetric either side of the sun
+        relaz = np.abs(np.asarray(relaz, dtype=np.float64)) % 360
+        relaz = np.where(relaz > 180, 360 - relaz, relaz)
+        values = np.broadcast_arrays(*[np.asarray(value, dtype=np.float64)
+                                       for value in [solar_zenith, relaz, view_zenith, wind_speed]])
+        shape = values[0].shape
+        points = np.column_stack([np.clip(value.ravel(), axis[0], axis[-1])
+                                  for value, axis in zip(values, self.axes)])
+        if not self.spectral:
+            if wavelengths is None:
+                return self.interpolator(points).reshape(shape)
+            return np.repeat(self.interpolator(points)[:, None], len(wavelengths), axis=1).reshape(
+                shape + (len(wavelengths),))
+        if wavelengths is None:
+            raise ValueError('this rho table depends on wavelength, so wavelengths are needed')
+        wavelengths = np.clip(np.asarray(wavelengths, dtype=np.float64), self.axes[4][0], self.axes[4][-1])
+        # every (sample, wavelength) pair in one call
+        points = np.column_stack([np.repeat(points, len(wavelengths), axis=0),
+                                  np.tile(wavelengths, len(points))])
+        return self.interpolator(points).reshape(shape + (len(wavelengths),))
+
+    def save(self, path):
+        '''
+        saves the table as a .npz (load it again with load_rho_LUT())
+        '''
+        arrays = {'rho': self.table, 'solar_zenith': self.axes[0], 'relaz': self.axes[1],
+                  'view_zenith': self.axes[2], 'wind_speed': self.axes[3],
+                  'defaults': np.array([self.default_view_zenith, self.default_wind_speed])}
+        if self.spectral:
+            arrays['wavelength'] = self.axes[4]
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+def read_mobley_table(path, default_view_zenith=40.0, default_wind_speed=5.0):
+    '''
+    reads a Mobley (1999) style rho table (text): blocks which each start with a line giving the wind speed and sun
+    zenith (eg. 'WIND SPEED = 2.0; SUN ZENITH = 30.0'), followed by lines of view zenith, relative azimuth and rho
+    the blocks need to cover a full grid of wind speed x sun zenith x view zenith x relative azimuth
+    '''
+    number = r'[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?'
+    rows = []
+    wind, sun = None, None
+    with open(path) as f:
+        for line in f:
+            upper = line.upper()
+            if 'WIND' in upper and 'SUN' in upper:
+                wind = float(re.search('WIND[^=]*=\\s*(' + number + ')', upper).group(1))
+                sun = float(re.search('SUN[^=]*=\\s*(' + number + ')', upper).group(1))
+                continue
+            values = re.findall(number, line)
+            if wind is not None and len(values) == 3 and not re.search('[A-DF-Za-df-z]', line):
+                rows.append((sun, float(values[1]), float(values[0]), wind, float(values[2])))
+    if not rows:
+        raise ValueError("couldn't find any rho values in " + path)
+    rows = np.array(rows)
+    axes = [np.unique(rows[:, i]) for i in range(4)]
+    table = np.full(tuple(len(axis) for axis in axes), np.nan)
+    index = tuple(np.searchsorted(axis, rows[:, i]) for i, axis in enumerate(axes))
+    table[index] = rows[:, 4]
+    if np.isnan(table).any():
+        raise ValueError(path + " doesn't cover a full grid of sun zenith, relative azimuth, view zenith and "
+                         + 'wind speed')
+    return LUTRho(table, *axes, default_view_zenith=default_view_zenith, default_wind_speed=default_wind_speed)
+
+@functools.lru_cache(maxsize=8)
+def _load_rho_LUT(path, mtime_ns, default_view_zenith, default_wind_speed):
+    if path.endswith('.npz'):
+        with np.load(path, allow_pickle=False) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+        if default_view_zenith is None:
+            default_view_zenith = float(arrays['defaults'][0]) if 'defaults' in arrays else 40.0
+        if default_wind_speed is None:
+            default_wind_speed = float(arrays['defaults'][1]) if 'defaults' in arrays else 5.0
+        return LUTRho(arrays['rho'], arrays['solar_zenith'], arrays['relaz'], arrays['view_zenith'],
+                      arrays['wind_speed'], wavelength=arrays.get('wavelength'),
+                      default_view_zenith=default_view_zenith, default_wind_speed=default_wind_speed)
+    return read_mobley_table(path, default_view_zenith=40.0 if default_view_zenith is None else default_view_zenith,
+                             default_wind_speed=5.0 if default_wind_speed is None else default_wind_speed)
+
+def load_rho_LUT(path, default_view_zenith=None, default_wind_speed=None):
+    '''
+    loads a rho table (.npz from LUTRho.save(), or a Mobley style text table - see read_mobley_table()) as a LUTRho
+    it's only read once (until the file changes), so this is fine to call for every file / day
+    '''
+    path = os.path.abspath(path)
+    model = _load_rho_LUT(path, os.stat(path).st_mtime_ns, default_view_zenith, default_wind_speed)
+    model.source = path
+    return model
+
+def describe_rho(RHO):
+    '''
+    json friendly version of RHO for saving in settings / metadata: numbers stay as they are, a model loaded with
+    load_rho_LUT() gives the path of its table, anything else its repr()
+    '''
+    if isinstance(RHO, str) or np.isscalar(RHO):
+        return RHO.item() if isinstance(RHO, np.generic) else RHO
+    return getattr(RHO, 'source', None) or repr(RHO)
+
+def rho_from_description(value):
+    '''
+    undoes describe_rho() as far as possible: a number stays as it is, the path of a table which still exists is loaded
+    (with load_rho_LUT()), anything else is kept as the description (and can't be used to work out rho)
+    '''
+    if isinstance(value, str) and os.path.isfile(value):
+        return load_rho_LUT(value)
+    return value
+
+def sample_rho(RHO, solar_elev, relaz, wavelengths=None):
+    '''
+    rho for each sample from its solar elevation and relative azimuth (degrees)
+    - a number for RHO is just given back (so the constant case is exactly what it was)
+    - a model gives a (n_samples,) array, or (n_samples, len(wavelengths)) if wavelengths are given (spectral models
+    need them)
+    '''
+    if isinstance(RHO, str):
+        raise ValueError("rho model '" + RHO + "' isn't loaded - load it (eg. with load_rho_LUT()) and pass that "
+                         + 'instead')
+    if np.isscalar(RHO):
+        return RHO
+    solar_elev = np.asarray(solar_elev, dtype=np.float64)
+    if not RHO.spectral:
+        wavelengths = None
+    return RHO.rho(90 - solar_elev, relaz, wavelengths=wavelengths)
+
+def run_rho(RHO, solar_elev, relaz, wavelengths=None, pixel=None):
+    '''
+    same as sample_rho() but for arrays with one entry per row (eg. the columns of a long format DALEC log), where the
+    geometry only changes between samples: the model is only evaluated once per run of rows with the same geometry
+    - pixel gives the position (in wavelengths) of each row's wavelength, for spectral models
+    returns a number (for a number RHO) or one rho per row
+    '''
+    if np.isscalar(RHO):
+        return RHO
+    solar_elev = np.asarray(solar_elev, dtype=np.float64)
+    relaz = np.asarray(relaz, dtype=np.float64)
+    new_run = np.ones(len(solar_elev), dtype=bool)
+    new_run[1:] = (solar_elev[1:] != solar_elev[:-1]) | (relaz[1:] != relaz[:-1])
+    starts = np.flatnonzero(new_run)
+    run = np.cumsum(new_run) - 1
+    if RHO.spectral:
+        return sample_rho(RHO, solar_elev[starts], relaz[starts], wavelengths=wavelengths)[run, pixel]
+    return sample_rho(RHO, solar_elev[starts], relaz[starts])[run]
+
+def cube_rho(RHO, cube, wavelengths):
+    '''
+    rho for every sample in a dalecCube.DalecCube (see sample_rho()), shaped to go with its (n_samples,
+    len(wavelengths)) gridded spectra - a number for RHO is just given back
+    '''
+    rho = sample_rho(RHO, cube.solar_elev, cube.relaz, wavelengths=wavelengths)
+    return rho[:, None] if np.ndim(rho) == 1 else rho
@@ -0,0 +1,189 @@
+# catalog of acolite NetCDF scenes (date, bounding box, grid shape, bands), kept in an SQLite file so that finding the
+# scenes covering a coord / in a date range doesn't mean opening every file in the archive each time
+# the catalog is updated incrementally: only files which are new or have changed (size / mtime) get opened
+import os
+import json
+import hashlib
+import sqlite3
+import numpy as np
+import pandas as pd
+import netCDF4
+import dalecCache
+import dalecMetrics
+
+# bump this if the table changes, old catalogs then get rebuilt
+CATALOG_VERSION = 1
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+_COLUMNS = ['path', 'directory', 'size', 'mtime_ns', 'isodate', 'time', 'date', 'sensor',
+            'lat_min', 'lat_max', 'lon_min', 'lon_max', 'pixel_size', 'ny', 'nx', 'bands', 'wavelengths', 'error']
+
+def default_catalog_path(SD_directory, cache_dir=dalecCache.DEFAULT_CACHE_DIR):
+    '''
+    where the catalog for SD_directory goes by default (in the cache dir, so read only archives are fine)
+    '''
+    name = hashlib.sha1(os.path.abspath(SD_directory).encode()).hexdigest() + '.sqlite'
+    return os.path.join(cache_dir, 'scene_catalogs', name)
+
+def _to_time(value):
+    # scene times are stored as naive UTC strings so that they sort / compare properly in SQL
+    time = pd.Timestamp(value)
+    if time.tzinfo is not None:
+        time = time.tz_convert('UTC').tz_localize(None)
+    return time
+
+def read_scene_info(NC_file):
+    '''
+    reads the catalog info for one acolite NetCDF file: isodate, bounding box (of the pixel centres), typical pixel
+    size (degrees), grid shape and the rhos bands + wavelengths
+    '''
+    with netCDF4.Dataset(NC_file) as f:
+        lat = np.ma.filled(np.ma.asarray(f.variables['lat'][:], dtype=np.float64), np.nan)
+        lon = np.ma.filled(np.ma.asarray(f.variables['lon'][:], dtype=np.float64), np.nan)
+        names = [var for var in f.variables.keys() if 'rhos' in var]
+        isodate = f.isodate
+        sensor = f.sensor if 'sensor' in f.ncattrs() else None
+    dlat = np.nanmedian(np.abs(np.diff(lat, axis=0))) if lat.shape[0] > 1 else 0
+    dlon = np.nanmedian(np.abs(np.diff(lon, axis=1))) if lat.shape[1] > 1 else 0
+    time = _to_time(isodate)
+    return {'isodate': isodate,
+            'time': time.strftime(TIME_FORMAT),
+            'date': time.strftime('%Y-%m-%d'),
+            'sensor': sensor,
+            'lat_min': float(np.nanmin(lat)), 'lat_max': float(np.nanmax(lat)),
+            'lon_min': float(np.nanmin(lon)), 'lon_max': float(np.nanmax(lon)),
+            'pixel_size': float(np.hypot(np.nan_to_num(dlat), np.nan_to_num(dlon))),
+            'ny': lat.shape[0], 'nx': lat.shape[1],
+            'bands': json.dumps(names),
+            'wavelengths': json.dumps([float(var[5:]) for var in names])}
+
+class SceneCatalog:
+    '''
+    SQLite catalog of acolite NetCDF (*L2R.nc) scenes, eg.
+        catalog = SceneCatalog(default_catalog_path(SD_directory))
+        catalog.update(SD_directory)
+        scenes = catalog.query(lat=56.0, lon=-3.9, start='2022-08-01', end='2022-08-31', firstPerDay=True)
+    path=':memory:' gives a catalog which isn't saved anywhere
+    '''
+    def __init__(self, path=':memory:'):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self._create()
+
+    def _create(self):
+        with self.connection as con:
+            con.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)')
+            row = con.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+            if row is not None and int(row[0]) != CATALOG_VERSION:
+                con.execute('DROP TABLE IF EXISTS scenes')
+            con.execute('''CREATE TABLE IF NOT EXISTS scenes (
+                               path TEXT PRIMARY KEY, directory TEXT, size INTEGER, mtime_ns INTEGER,
+                               isodate TEXT, time TEXT, date TEXT, sensor TEXT,
+                               lat_min REAL, lat_max REAL, lon_min REAL, lon_max REAL, pixel_size REAL,
+                               ny INTEGER, nx INTEGER, bands TEXT, wavelengths TEXT, error TEXT)''')
+            con.execute('CREATE INDEX IF NOT EXISTS scenes_time ON scenes (time)')
+            con.execute("INSERT OR REPLACE INTO info VALUES ('version', ?)", (str(CATALOG_VERSION),))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM scenes WHERE error IS NULL').fetchone()[0]
+
+    def update(self, SD_directory, suffix='L2R.nc'):
+        '''
+        brings the catalog up to date with the files ending in suffix in SD_directory: new or changed files are read,
+        entries for files which have gone are removed
+        returns a dict with the number of files added, updated, removed and unchanged
+        files which can't be read are recorded (with the error) and not tried again until they change
+        '''
+        directory = os.path.abspath(SD_directory)
+        files = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(suffix) and entry.is_file():
+                    st = entry.stat()
+                    files[os.path.join(directory, entry.name)] = (st.st_size, st.st_mtime_ns)
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 self.connection.execute('SELECT path, size, mtime_ns FROM scenes WHERE directory = ?', (directory,))}
+
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        rows = []
+        for path in sorted(files):
+            if known.get(path) == files[path]:
+                counts['unchanged'] += 1
+                continue
+            counts['updated' if path in known else 'added'] += 1
+            row = {col: None for col in _COLUMNS}
+            try:
+                row.update(read_scene_info(path))
+            except Exception as e:
+                dalecMetrics.warn('couldn\'t read ' + path + ' (' + type(e).__name__ + ': ' + str(e) + ')', file=path)
+                row['error'] = type(e).__name__ + ': ' + str(e)
+            row.update({'path': path, 'directory': directory, 'size': files[path][0], 'mtime_ns': files[path][1]})
+            rows.append(tuple(row[col] for col in _COLUMNS))
+        removed = [(path,) for path in known if path not in files]
+        counts['removed'] = len(removed)
+
+        with self.connection as con:
+            con.executemany('INSERT OR REPLACE INTO scenes VALUES (' + ', '.join('?' * len(_COLUMNS)) + ')', rows)
+            con.executemany('DELETE FROM scenes WHERE path = ?', removed)
+        return counts
+
+    def query(self, lat=None, lon=None, start=None, end=None, firstPerDay=False, directory=None):
+        '''
+        scenes (sorted by time) as a df with a row per scene, optionally only those:
+        - whose bounding box covers lat, lon (plus a pixel around the edge)
+        - between start and end (anything pd.Timestamp() understands, in UTC), an end without a time includes the
+        whole of that day
+        - in directory
+        firstPerDay keeps just the earliest of the matching scenes from each day
+        bands and wavelengths are lists
+        '''
+        conditions, params = ['error IS NULL'], []
+        if lat is not None and lon is not None:
+            conditions.append('lat_min - pixel_size <= ? AND ? <= lat_max + pixel_size AND '
+                              'lon_min - pixel_size <= ? AND ? <= lon_max + pixel_size')
+            params += [lat, lat, lon, lon]
+        if start is not None:
+            conditions.append('time >= ?')
+            params.append(_to_time(start).strftime(TIME_FORMAT))
+        if end is not None:
+            end_time = _to_time(end)
+            if end_time == end_time.normalize():
+                conditions.append('time < ?')
+                end_time += pd.Timedelta(days=1)
+            else:
+                conditions.append('time <= ?')
+            params.append(end_time.strftime(TIME_FORMAT))
+        if directory is not None:
+            conditions.append('directory = ?')
+            params.append(os.path.abspath(directory))
+        sql = ('SELECT ' + ', '.join(_COLUMNS) + ' FROM scenes WHERE ' + ' AND '.join(conditions)
+               + ' ORDER BY time, path')
+        scenes = pd.DataFrame(self.connection.execute(sql, params).fetchall(), columns=_COLUMNS)
+        scenes = scenes.drop(columns='error')
+        if firstPerDay:
+            scenes = scenes.drop_duplicates('date').reset_index(drop=True)
+        scenes['bands'] = [json.loads(bands) for bands in scenes['bands']]
+        scenes['wavelengths'] = [json.loads(wavelengths) for wavelengths in scenes['wavelengths']]
+        return scenes
+
+    def errors(self, directory=None):
+        '''
+        files which couldn't be read (optionally only those in directory), with the error
+        '''
+        sql, params = 'SELECT path, error FROM scenes WHERE error IS NOT NULL', []
+        if directory is not None:
+            sql += ' AND directory = ?'
+            params.append(os.path.abspath(directory))
+        return pd.DataFrame(self.connection.execute(sql + ' ORDER BY path', params).fetchall(),
+                            columns=['path', 'error'])
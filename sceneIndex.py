@@ -0,0 +1,101 @@
+# spatial index for finding the nearest pixel to lots of lat/lon points in a satellite scene
+# (the old way, SD_NC_loading.getclosest_ij(), works out the distance to every pixel for every point)
+import os
+import numpy as np
+from scipy import spatial
+
+class SceneIndex:
+    '''
+    nearest pixel lookup for a scene with 2-D lat and lon arrays (shape (ny, nx))
+    - if lat only changes along y and lon only changes along x, both (close to) linearly (a regular grid), the pixel is
+    found by inverting the grid spacing and then checking the pixels around it (as the stored coords are often float32,
+    so not exactly regular)
+    - otherwise a KD-tree is built on the (lat, lon) of every pixel
+    both give the pixel nearest in squared degrees, worked out in float64 - this is what getclosest_ij() is after too,
+    but it does the sums in the dtype of the lat / lon arrays, so with float32 coords it can pick a neighbouring pixel
+    when two are almost the same distance away (ie. the results can differ from it in those near-ties)
+    '''
+    def __init__(self, lat, lon, tolerance=0.25):
+        lat = np.ma.filled(np.ma.asarray(lat, dtype=np.float64), np.nan)
+        lon = np.ma.filled(np.ma.asarray(lon, dtype=np.float64), np.nan)
+        self.shape = lat.shape
+        ny, nx = self.shape
+        # typical pixel size (in degrees), used to decide if a point is outside the scene
+        dlat = np.nanmedian(np.abs(np.diff(lat, axis=0))) if ny > 1 else 0
+        dlon = np.nanmedian(np.abs(np.diff(lon, axis=1))) if nx > 1 else 0
+        self.pixel_size = np.hypot(np.nan_to_num(dlat), np.nan_to_num(dlon))
+        self.regular = False
+        if ny > 1 and nx > 1 and not np.isnan(lat).any() and not np.isnan(lon).any():
+            lat_y, lon_x = lat[:, 0], lon[0, :]
+            lat_step, lon_step = (lat_y[-1] - lat_y[0]) / (ny - 1), (lon_x[-1] - lon_x[0]) / (nx - 1)
+            # tolerance is a fraction of a pixel
+            self.regular = (lat_step != 0 and lon_step != 0
+                            and np.abs(lat - (lat_y[0] + lat_step * np.arange(ny))[:, None]).max()
+                            <= tolerance * abs(lat_step)
+                            and np.abs(lon - (lon_x[0] + lon_step * np.arange(nx))[None, :]).max()
+                            <= tolerance * abs(lon_step))
+        if self.regular:
+            self.lat0, self.lat_step = lat_y[0], lat_step
+            self.lon0, self.lon_step = lon_x[0], lon_step
+            self.lat, self.lon = lat, lon
+        else:
+            valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)).ravel())
+            self.valid = valid
+            self.tree = spatial.cKDTree(np.column_stack([lat.ravel()[valid], lon.ravel()[valid]]))
+
+    def query(self, lat_pts, lon_pts, max_distance=None):
+        '''
+        finds the nearest pixel to each point, returns arrays of iy, ix and inside
+        inside is False for points more than max_distance (in degrees, defaults to one pixel diagonal) from the nearest
+        pixel centre, ie. points outside the scene - iy and ix are still the nearest pixel for these
+        '''
+        lat_pts = np.atleast_1d(np.asarray(lat_pts, dtype=np.float64))
+        lon_pts = np.atleast_1d(np.asarray(lon_pts, dtype=np.float64))
+        if max_distance is None:
+            max_distance = self.pixel_size
+        if self.regular:
+            ny, nx = self.shape
+            y = (lat_pts - self.lat0) / self.lat_step
+            x = (lon_pts - self.lon0) / self.lon_step
+            iy = np.clip(np.round(y), 0, ny - 1).astype(np.int64)
+            ix = np.clip(np.round(x), 0, nx - 1).astype(np.int64)
+            # the true nearest pixel is this one or one of its neighbours, checked in flattened order so that exact
+            # ties go the same way as getclosest_ij()
+            offsets = np.array([-1, 0, 1])
+            cand_y = np.clip(iy[:, None, None] + offsets[None, :, None], 0, ny - 1)
+            cand_x = np.clip(ix[:, None, None] + offsets[None, None, :], 0, nx - 1)
+            cand_y, cand_x = np.broadcast_arrays(cand_y, cand_x)
+            cand_y, cand_x = cand_y.reshape(len(iy), 9), cand_x.reshape(len(iy), 9)
+            dist_sq = ((self.lat[cand_y, cand_x] - lat_pts[:, None])**2
+                       + (self.lon[cand_y, cand_x] - lon_pts[:, None])**2)
+            best = np.argmin(dist_sq, axis=1)
+            rows = np.arange(len(iy))
+            iy, ix = cand_y[rows, best], cand_x[rows, best]
+            dist = np.sqrt(dist_sq[rows, best])
+        else:
+            dist, ind = self.tree.query(np.column_stack([lat_pts, lon_pts]))
+            iy, ix = np.unravel_index(self.valid[ind], self.shape)
+        return iy, ix, dist <= max_distance
+
+# scene indexes for each file, so they only get built once
+_scene_indexes = {}
+MAX_CACHED_INDEXES = 64
+
+def get_scene_index(NC_file):
+    '''
+    returns the SceneIndex for an open NetCDF file (with 'lat' and 'lon' variables), built once per file and cached
+    (by path and mtime)
+    '''
+    try:
+        path = NC_file.filepath()
+        key = (path, os.stat(path).st_mtime_ns)
+    except (ValueError, OSError):
+        key = None
+    if key is not None and key in _scene_indexes:
+        return _scene_indexes[key]
+    index = SceneIndex(NC_file.variables['lat'][:], NC_file.variables['lon'][:])
+    if key is not None:
+        if len(_scene_indexes) >= MAX_CACHED_INDEXES:
+            _scene_indexes.clear()
+        _scene_indexes[key] = index
+    return index
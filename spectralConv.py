@@ -1,6 +1,13 @@
 import pandas as pd
 import numpy as np
+import hashlib
 import dalecLoad
+import dalecCube
+import dalecMetrics
+import rhoModels
+
+# centre wavelengths of the superDoves bands (in the same order as the columns of the RSR file)
+DOVES_WAVELENGTHS = [444., 492., 533., 566., 612., 666., 707., 866.]
 
 def spectral_conv(R, S, x):
     '''
@@ -11,42 +18,83 @@ def spectral_conv(R, S, x):
     out = np.trapz(R * S, x=x) / np.trapz(S, x=x)
     return out
 
+def band_weights(RSR_doves, x):
+    '''
+    (n_bands, len(x)) matrix which does the spectral convolution for every band at once,
+    ie. band_weights(RSR_doves, x) @ R gives the same as SD_band_calc(RSR_doves, R, x)
+    (the trapezoid rule is just a weighted sum, so both np.trapz calls can be folded into one set of weights)
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    S = RSR_doves[RSR_doves.columns[1:]].values.T.astype(np.float64) # don't use first col as this is the wavelengths
+    dx = np.diff(x)
+    trapz_weights = np.zeros(len(x))
+    trapz_weights[:-1] += dx / 2
+    trapz_weights[1:] += dx / 2
+    return (S * trapz_weights) / np.trapz(S, x=x, axis=1)[:, None]
+
 def SD_band_calc(RSR_doves, R, x):
     '''
     does spectral convolution for every superDoves band (although this is likely compatible with other sensors SRS too)
     RSR_doves is the spectral response data for superDoves (cols = Wavelength (nm), Coastal-Blue response, Blue etc..)
     R is the reflectance data to convolve for each band
+    (can also be a (n_samples, len(x)) array, in which case you get a (n_samples, n_bands) array back)
     x is the wavelength grid for R and each spectral response function in RSR_doves
     '''
-    R_SD = []
-    for col in RSR_doves.columns[1:]: # don't use first col as this is the wavelengths column
-        col_SR = RSR_doves[col].values
-        R_SD.append(spectral_conv(R, col_SR, x))
-    return np.array(R_SD)
+    with dalecMetrics.stage('convolve', spectra=int(np.prod(np.shape(R)[:-1]))):
+        return np.asarray(R) @ band_weights(RSR_doves, x).T
+
+_band_operators = {}
+
+def band_operator(RSR_doves, spect_wavelengths, param='Lu', x=None, nsteps=601, min_waveL=400, max_waveL=1000):
+    '''
+    (n_bands, n_pixels) matrix which goes straight from native DALEC pixels (for channel param) to band averaged values
+    - combines the interpolation onto the uniform grid (see dalecLoad.grid_operator()) with the spectral convolution
+    (see band_weights()), so band values for lots of spectra come out of one matrix multiplication
+    - x is the wavelength grid used for the convolution (defaults to the RSR wavelengths, same as SD_Rrs())
+    - cached, so only gets built once for each combination of inputs
+    '''
+    if x is None:
+        x = RSR_doves['Wavelength (nm)'].values
+    x = np.asarray(x, dtype=np.float64)
+    key = hashlib.sha1()
+    for item in [str(list(RSR_doves.columns)), RSR_doves.values.astype(np.float64), x,
+                 spect_wavelengths[param].values.astype(np.float64), str((param, nsteps, min_waveL, max_waveL))]:
+        key.update(item.encode() if isinstance(item, str) else np.ascontiguousarray(item).tobytes())
+    key = key.hexdigest()
+    if key not in _band_operators:
+        if len(_band_operators) > 32:
+            _band_operators.clear()
+        _, grid_op = dalecLoad.grid_operator(spect_wavelengths, param=param, nsteps=nsteps,
+                                             min_waveL=min_waveL, max_waveL=max_waveL)
+        _band_operators[key] = np.asarray((grid_op.T @ band_weights(RSR_doves, x).T).T)
+    return _band_operators[key]
 
 def SD_Rrs(RSR_doves, DALEC_sample, spect_wavelengths, x=None, doves_wavelengths=None, RHO=0.028, nsteps=601):
     '''
     does SD band calc for Lu, Lsky and Ed for a given DALEC sample, then converts this to Rrs using RHO
+    (a number, or a rhoModels model which uses the sample's solar elevation and relative azimuth)
     returns a df with Lu, Lsky, Ed and Rrs
     '''
-    Lu = dalecLoad.uniform_grid_spectra(DALEC_sample, spect_wavelengths, param='Lu', nsteps=nsteps)[:, 1]
-    Lsky = dalecLoad.uniform_grid_spectra(DALEC_sample, spect_wavelengths, param='Lsky', nsteps=nsteps)[:, 1]
-    Ed = dalecLoad.uniform_grid_spectra(DALEC_sample, spect_wavelengths, param='Ed', nsteps=nsteps)[:, 1]
-    
-    if x is None:
-        x = RSR_doves['Wavelength (nm)'].values
-    
-    Lw = Lu - (RHO * Lsky)
-    
-    Lw_SD = SD_band_calc(RSR_doves, Lw, x)
-    Lu_SD = SD_band_calc(RSR_doves, Lu, x)
-    Lsky_SD = SD_band_calc(RSR_doves, Lsky, x)
-    Ed_SD = SD_band_calc(RSR_doves, Ed, x)
+    band = lambda param, values: band_operator(RSR_doves, spect_wavelengths, param=param, x=x, nsteps=nsteps) @ values
+    spectrum = lambda param: DALEC_sample.loc[param]['Spectral Magnitude'].values
+    rho = rhoModels.sample_rho(RHO, DALEC_sample[' Solar Elev'].values[:1], DALEC_sample[' Relaz'].values[:1],
+                               wavelengths=spect_wavelengths['Lsky'].values)
+    with dalecMetrics.stage('convolve', samples=1):
+        Lu_SD = band('Lu', spectrum('Lu'))
+        Lsky_SD = band('Lsky', spectrum('Lsky'))
+        Ed_SD = band('Ed', spectrum('Ed'))
+        if np.ndim(rho) == 2:
+            # rho changes with wavelength, so it has to go in before the convolution
+            rho_Lsky_SD = band('Lsky', rho[0] * spectrum('Lsky'))
+        else:
+            rho_Lsky_SD = rho[0] * Lsky_SD if np.ndim(rho) else RHO * Lsky_SD
+    # convolution is linear, so this is the same as convolving Lw = Lu - (RHO * Lsky)
+    Lw_SD = Lu_SD - rho_Lsky_SD
     Rrs_SD = Lw_SD / Ed_SD
     
     if doves_wavelengths is None:
         # could provide a 
-        doves_wavelengths = [444., 492., 533., 566., 612., 666., 707., 866.]
+        doves_wavelengths = DOVES_WAVELENGTHS
     
     df_out = pd.DataFrame(data={'Wavelength': doves_wavelengths,
                            'Lu': Lu_SD, 
@@ -57,3 +105,38 @@ def SD_Rrs(RSR_doves, DALEC_sample, spect_wavelengths, x=None, doves_wavelengths
     
     return df_out
 
+def SD_Rrs_batch(RSR_doves, DALEC_log, spect_wavelengths=None, x=None, doves_wavelengths=None, RHO=0.028, nsteps=601):
+    '''
+    same as SD_Rrs() but for every sample in a log at once
+    DALEC_log can be a dalecCube.DalecCube or a long format DataFrame (spect_wavelengths is needed for the latter)
+    RHO can be a number or a rhoModels model (rho for each sample from its solar elevation and relative azimuth)
+    returns a df indexed by (Sample #, Wavelength) with Lu, Lw, Lsky, Ed and Rrs columns
+    '''
+    if isinstance(DALEC_log, dalecCube.DalecCube):
+        cube = DALEC_log
+    else:
+        cube = dalecCube.DalecCube.from_long_format(DALEC_log, spect_wavelengths)
+    if doves_wavelengths is None:
+        doves_wavelengths = DOVES_WAVELENGTHS
+
+    with dalecMetrics.stage('convolve', samples=len(cube)):
+        operator = {param: band_operator(RSR_doves, cube.spect_wavelengths, param=param, x=x, nsteps=nsteps).T
+                    for param in ['Lu', 'Lsky', 'Ed']}
+        band = {param: cube.channel(param) @ operator[param] for param in ['Lu', 'Lsky', 'Ed']}
+        rho = rhoModels.sample_rho(RHO, cube.solar_elev, cube.relaz, wavelengths=cube.spect_wavelengths['Lsky'].values)
+        if np.ndim(rho) == 2:
+            # rho changes with wavelength, so it has to go in before the convolution
+            rho_Lsky = (rho * cube.channel('Lsky')) @ operator['Lsky']
+        else:
+            rho_Lsky = (rho[:, None] if np.ndim(rho) else rho) * band['Lsky']
+    Lw = band['Lu'] - rho_Lsky
+    n, n_bands = Lw.shape
+    index = pd.MultiIndex.from_arrays([np.repeat(cube.sample, n_bands), np.tile(doves_wavelengths, n)],
+                                      names=['Sample #', 'Wavelength'])
+    df_out = pd.DataFrame(data={'Lu': band['Lu'].ravel(),
+                                'Lw': Lw.ravel(),
+                                'Lsky': band['Lsky'].ravel(),
+                                'Ed': band['Ed'].ravel(),
+                                'Rrs': (Lw / band['Ed']).ravel()},
+                          index=index)
+    return df_out
@@ -0,0 +1,7 @@
+# the modules are flat files in the repo root (and the synthetic data generator is in benchmarks/)
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
@@ -0,0 +1,37 @@
+# the index has to accept exactly the same rows as dalecLoad.parse_DALEC_dtf(), including ones with a blank date
+import numpy as np
+import pandas as pd
+import synthetic
+import dalecLoad
+import dalecIndex
+
+def _blank_date(path, sample):
+    # blanks the UTC Date and UTC Time of every row of one sample
+    with open(path) as f:
+        lines = f.readlines()
+    for i, line in enumerate(lines):
+        fields = line.split(',', 3)
+        if fields[0] == str(sample) and len(fields) == 4:
+            lines[i] = ','.join([fields[0], '', '', fields[3]])
+    with open(path, 'w', newline='\n') as f:
+        f.writelines(lines)
+
+def test_blank_date_row(tmp_path):
+    path = synthetic.write_dtf(str(tmp_path / 'LOG_0001.dtf'), 20, saturated_fraction=0, nan_fraction=0)
+    _blank_date(path, 5)
+    index = dalecIndex.build_index(path)
+    assert len(index) == 20
+    assert np.isnat(index.time[index.sample == 5]).all()
+    assert not np.isnat(index.time[index.sample != 5]).any()
+
+    # a time range never includes it
+    start, end = index.time[index.sample == 0][0], index.time[index.sample == 19][0]
+    assert 5 not in index.sample[index.select_time(start, end)]
+    selected = dalecIndex.load_DALEC_log_time_range(path, start, end)
+    assert 5 not in selected.index.get_level_values(0)
+
+    # and loading everything drops it in the same way as load_DALEC_log()
+    everything = dalecIndex.load_DALEC_log_time_range(path)
+    expected = dalecLoad.load_DALEC_log(path)
+    assert 5 not in expected.index.get_level_values(0)
+    pd.testing.assert_frame_equal(everything, expected)
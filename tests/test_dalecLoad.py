@@ -0,0 +1,31 @@
+# a value which isn't a number in a numeric column only loses that row, not the whole file
+import numpy as np
+import pandas as pd
+import synthetic
+import dalecLoad
+
+def _set_field(path, sample, column, value):
+    # sets one field in every row of one sample
+    with open(path) as f:
+        lines = f.readlines()
+    for i, line in enumerate(lines):
+        fields = line.split(',')
+        if fields[0] == str(sample) and len(fields) > column:
+            fields[column] = value
+            lines[i] = ','.join(fields)
+    with open(path, 'w', newline='\n') as f:
+        f.writelines(lines)
+
+def test_bad_metadata_values(tmp_path):
+    path = synthetic.write_dtf(str(tmp_path / 'LOG_0001.dtf'), 20, saturated_fraction=0, nan_fraction=0)
+    clean = dalecLoad.load_DALEC_log(path)
+    _set_field(path, 7, 4, ' N/A') # Lat
+    _set_field(path, 9, 16, ' x') # Integration Time
+    _set_field(path, 11, 1, ' bad') # UTC Date
+    DALEC_log = dalecLoad.load_DALEC_log(path)
+    pd.testing.assert_frame_equal(DALEC_log, clean.drop([7, 9, 11], level=0))
+    assert DALEC_log[' Integration Time'].dtype == np.int64
+
+    wide = dalecLoad.load_DALEC_log(path, longFormat=False)
+    assert not np.isin([7, 9, 11], wide['Sample #']).any()
+    assert wide['Sample #'].dtype == np.int64
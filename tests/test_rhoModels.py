@@ -0,0 +1,107 @@
+# a LUTRho through every entry point that takes RHO: a flat table has to give the same answers as the plain number,
+# and a varying one has to give each sample its own rho
+import os
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import synthetic
+import dalecLoad
+import dalecCube
+import dalecStats
+import dalecChunked
+import dalecFollow
+import spectralConv
+import rhoModels
+
+RSR_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'non-DALEC-data',
+                        'RSR-Superdove.csv')
+AXES = [np.arange(0, 90, 10.), np.arange(0, 181, 15.), np.array([30., 40., 50.]), np.array([0., 5., 10.])]
+
+def _table(path, flat):
+    shape = tuple(len(axis) for axis in AXES)
+    if flat:
+        rho = np.full(shape, 0.028)
+    else:
+        # rho goes up with sun zenith, so every sample gets a different one
+        rho = 0.02 + 0.0004 * AXES[0][:, None, None, None] + np.zeros(shape)
+    rhoModels.LUTRho(rho, *AXES).save(path)
+    return rhoModels.load_rho_LUT(path)
+
+@pytest.fixture(scope='module')
+def data(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('rho')
+    dtf = synthetic.write_dtf(str(tmp / 'LOG_0001.dtf'), 60, saturated_fraction=0, nan_fraction=0)
+    return {'dtf': dtf,
+            'flat': _table(str(tmp / 'flat.npz'), True),
+            'lut': _table(str(tmp / 'lut.npz'), False),
+            'tmp': tmp}
+
+def _chunked(data, RHO, name):
+    out_dir = str(data['tmp'] / name)
+    result = dalecChunked.process_DALEC_chunks(data['dtf'], out_dir=out_dir, RSR_doves=RSR_FILE, chunk_samples=25,
+                                               RHO=RHO)
+    return result, dalecChunked.open_chunked_output(out_dir)
+
+def test_chunked(data):
+    result, out = _chunked(data, 0.028, 'scalar')
+    flat_result, flat_out = _chunked(data, data['flat'], 'flat')
+    lut_result, lut_out = _chunked(data, data['lut'], 'lut')
+    np.testing.assert_allclose(flat_out['Rrs'], out['Rrs'])
+    np.testing.assert_allclose(flat_out['bands'], out['bands'])
+    np.testing.assert_allclose(flat_result['stats'].mean_frame()['Rrs_mean'], result['stats'].mean_frame()['Rrs_mean'])
+    assert not np.allclose(lut_out['Rrs'], out['Rrs'])
+    # the model is saved as the path of its table, not the object
+    with open(os.path.join(str(data['tmp'] / 'lut'), dalecChunked.OUTPUT_META)) as f:
+        assert json.load(f)['settings']['RHO'] == data['lut'].source
+
+def test_gridded_stats(data):
+    cube = dalecCube.load_DALEC_cube(data['dtf'])
+    scalar = dalecStats.GriddedStats(RHO=0.028).add_cube(cube)
+    flat = dalecStats.GriddedStats(RHO=data['flat']).add_cube(cube)
+    np.testing.assert_allclose(flat.mean_frame()['Rrs_mean'], scalar.mean_frame()['Rrs_mean'])
+    np.testing.assert_allclose(flat.summary()['mean'], scalar.summary()['mean'])
+
+    # mean_frame() uses the mean of rho * Lsky for each sample's rho
+    lut = dalecStats.GriddedStats(RHO=data['lut']).add_cube(cube)
+    gridded = cube.uniform_grid()
+    rho = data['lut'].rho(90 - cube.solar_elev, cube.relaz)[:, None]
+    expected = (gridded['Lu'].mean(axis=0) - (rho * gridded['Lsky']).mean(axis=0)) / gridded['Ed'].mean(axis=0)
+    np.testing.assert_allclose(lut.mean_frame()['Rrs_mean'], expected)
+
+    path = str(data['tmp'] / 'stats.npz')
+    lut.save(path)
+    loaded = dalecStats.GriddedStats.load(path)
+    assert loaded.RHO is data['lut']
+    np.testing.assert_allclose(loaded.mean_frame()['Rrs_mean'], expected)
+    loaded.merge(dalecStats.GriddedStats(RHO=data['lut']).add_cube(cube))
+    np.testing.assert_allclose(loaded.mean_frame()['Rrs_mean'], expected)
+
+    with pytest.raises(ValueError):
+        dalecStats.GriddedStats(RHO=data['lut']).add_gridded(gridded)
+
+def test_follower(data):
+    RSR_doves = pd.read_csv(RSR_FILE)
+    products = {}
+    for key in ['scalar', 'flat', 'lut']:
+        RHO = 0.028 if key == 'scalar' else data[key]
+        follower = dalecFollow.DalecFollower(data['dtf'], RSR_doves=RSR_doves, RHO=RHO)
+        products[key] = follower.products(follower.poll())
+    np.testing.assert_allclose(products['flat']['Rrs'], products['scalar']['Rrs'])
+    np.testing.assert_allclose(products['flat']['bands']['Rrs'], products['scalar']['bands']['Rrs'])
+    assert not np.allclose(products['lut']['Rrs'], products['scalar']['Rrs'])
+
+def test_long_format_and_bands(data):
+    log = dalecLoad.load_DALEC_log(data['dtf'])
+    sw = dalecLoad.load_DALEC_spect_wavelengths(data['dtf'])
+    sample = log.loc[log.index.get_level_values(0)[0]]
+    RSR_doves = pd.read_csv(RSR_FILE)
+    calls = [lambda RHO: dalecLoad.uniform_grid_spectra_mean(log, sw, RHO=RHO)['Rrs_mean'],
+             lambda RHO: dalecLoad.uniform_grid_spectra_stats(log, sw, RHO=RHO)['mean'],
+             lambda RHO: dalecLoad.uniform_grid_spectra_stats(log, sw, RHO=RHO, fastGridding=False)['mean'],
+             lambda RHO: dalecLoad.uniform_grid_spectra_Rrs(sample, sw, RHO=RHO)['Rrs'],
+             lambda RHO: spectralConv.SD_Rrs(RSR_doves, sample, sw, RHO=RHO)['Rrs'],
+             lambda RHO: spectralConv.SD_Rrs_batch(RSR_doves, log, sw, RHO=RHO)['Rrs']]
+    for call in calls:
+        np.testing.assert_allclose(call(data['flat']), call(0.028))
+        assert not np.allclose(call(data['lut']), call(0.028))
@@ -0,0 +1,133 @@
+# matching DALEC samples up with satellite overpasses by time (within +- a window) rather than by calendar day like
+# SD_NC_loading.join_DALEC_SD_dfs() does
+# the sample times are sorted once and each overpass just finds the start and end of its window (searchsorted), so
+# there's never a samples x scenes comparison - the cost only grows with the number of pairs actually in the windows
+import os
+import numpy as np
+import pandas as pd
+import dalecCube
+import spectralConv
+
+def _to_datetime64(times):
+    # naive UTC datetime64[ns] array from anything pd.to_datetime() understands
+    times = pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(np.asarray(times))))
+    if times.tz is not None:
+        times = times.tz_convert('UTC').tz_localize(None)
+    return times.values.astype('datetime64[ns]')
+
+def window_pairs(sample_times, scene_times, window='1h', nearest=False):
+    '''
+    finds the samples within +- window of each scene (window is anything pd.Timedelta() understands)
+    returns arrays of scene_idx, sample_idx (positions in scene_times / sample_times) and offset (sample time - scene
+    time, timedelta64), sorted by scene and then sample time
+    - nearest=True only gives the closest sample to each scene (if there is one within the window)
+    - sample_times don't need to be sorted
+    '''
+    sample_times, scene_times = _to_datetime64(sample_times), _to_datetime64(scene_times)
+    window = pd.Timedelta(window).to_timedelta64()
+    order = np.argsort(sample_times, kind='stable')
+    sorted_times = sample_times[order]
+    lo = np.searchsorted(sorted_times, scene_times - window, side='left')
+    hi = np.searchsorted(sorted_times, scene_times + window, side='right')
+    if nearest:
+        # closest is either side of where the scene time would go
+        i = np.searchsorted(sorted_times, scene_times)
+        before, after = np.clip(i - 1, 0, None), np.clip(i, None, len(sorted_times) - 1)
+        if len(sorted_times):
+            use_after = (np.abs(sorted_times[after] - scene_times) < np.abs(sorted_times[before] - scene_times))
+        else:
+            use_after = np.zeros(len(scene_times), dtype=bool)
+        pos = np.where(use_after, after, before)
+        scene_idx = np.flatnonzero(hi > lo)
+        sample_idx = order[pos[scene_idx]]
+    else:
+        counts = hi - lo
+        scene_idx = np.repeat(np.arange(len(scene_times)), counts)
+        # position of each pair within its scene's window, added to the start of the window
+        pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+        sample_idx = order[pos]
+    return scene_idx, sample_idx, sample_times[sample_idx] - scene_times[scene_idx]
+
+def _scene_labels(scenes):
+    # scene names + times from a SceneCatalog.query() df (or anything with 'path' / 'time' columns), or just times
+    if isinstance(scenes, pd.DataFrame):
+        times = scenes['time'] if 'time' in scenes.columns else scenes['isodate']
+        if 'path' in scenes.columns:
+            return [os.path.basename(path) for path in scenes['path']], _to_datetime64(times)
+        return [str(label) for label in scenes.index], _to_datetime64(times)
+    times = _to_datetime64(scenes)
+    return [str(time) for time in pd.DatetimeIndex(times)], times
+
+def time_window_matchup(DALEC_log, scenes, RSR_doves, window='1h', nearest=False, spect_wavelengths=None,
+                        doves_wavelengths=None, RHO=0.028, nsteps=601):
+    '''
+    matches every DALEC sample up with the scenes overpassing within +- window of it
+    - DALEC_log is a dalecCube.DalecCube (eg. several days joined with dalecCube.concat_cubes()) or a long format
+    DataFrame (spect_wavelengths is needed for the latter)
+    - scenes is a df from sceneCatalog.SceneCatalog.query() (or anything with 'time' or 'isodate', and optionally
+    'path', columns), or a list of overpass times (UTC)
+    - band Rrs for each sample comes from spectralConv.SD_Rrs_batch()
+    returns (pairs, summary):
+    pairs has a row per scene & sample: scene, scene_time, Sample #, Time and offset (sample time - overpass time)
+    summary is indexed by (scene, Wavelength) with scene_time, Date, DALEC_mean_Rrs, DALEC_std_Rrs, n_samples,
+    mean_offset and max_abs_offset (scenes with no samples in the window are left out) - Date lets it be joined
+    with a SD_df from SD_NC_loading.load_multiple_SDs()
+    nearest=True only uses the closest sample to each overpass
+    '''
+    if isinstance(DALEC_log, dalecCube.DalecCube):
+        cube = DALEC_log
+    else:
+        cube = dalecCube.DalecCube.from_long_format(DALEC_log, spect_wavelengths)
+    if doves_wavelengths is None:
+        doves_wavelengths = spectralConv.DOVES_WAVELENGTHS
+    labels, scene_times = _scene_labels(scenes)
+    scene_idx, sample_idx, offset = window_pairs(cube.time, scene_times, window=window, nearest=nearest)
+
+    pairs = pd.DataFrame(data={'scene': np.asarray(labels, dtype=object)[scene_idx],
+                               'scene_time': scene_times[scene_idx],
+                               'Sample #': cube.sample[sample_idx],
+                               'Time': _to_datetime64(cube.time)[sample_idx],
+                               'offset': offset})
+
+    # band Rrs only needs working out for the samples which are in a window
+    used = np.unique(sample_idx)
+    n_bands = len(doves_wavelengths)
+    Rrs = np.full((len(cube), n_bands), np.nan)
+    if len(used):
+        mask = np.zeros(len(cube), dtype=bool)
+        mask[used] = True
+        bands = spectralConv.SD_Rrs_batch(RSR_doves, cube.select(mask), doves_wavelengths=doves_wavelengths,
+                                          RHO=RHO, nsteps=nsteps)
+        Rrs[used] = bands['Rrs'].values.reshape(len(used), n_bands)
+    values = Rrs[sample_idx]
+
+    # per scene stats with bincount (non-finite Rrs, eg. from Ed = 0, are left out)
+    n_scenes = len(scene_times)
+    finite = np.isfinite(values)
+    n = np.stack([np.bincount(scene_idx, weights=finite[:, b], minlength=n_scenes) for b in range(n_bands)], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.stack([np.bincount(scene_idx, weights=np.where(finite[:, b], values[:, b], 0), minlength=n_scenes)
+                         for b in range(n_bands)], axis=1) / n
+        residual = np.where(finite, values - mean[scene_idx], 0)
+        std = np.sqrt(np.stack([np.bincount(scene_idx, weights=residual[:, b]**2, minlength=n_scenes)
+                                for b in range(n_bands)], axis=1) / n)
+    n_samples = np.bincount(scene_idx, minlength=n_scenes)
+    offset_s = offset / np.timedelta64(1, 's')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_offset = np.bincount(scene_idx, weights=offset_s, minlength=n_scenes) / n_samples
+    max_abs_offset = np.zeros(n_scenes)
+    np.maximum.at(max_abs_offset, scene_idx, np.abs(offset_s))
+
+    matched = np.flatnonzero(n_samples > 0)
+    index = pd.MultiIndex.from_arrays([np.repeat(np.asarray(labels, dtype=object)[matched], n_bands),
+                                       np.tile(doves_wavelengths, len(matched))], names=['scene', 'Wavelength'])
+    summary = pd.DataFrame(data={'scene_time': np.repeat(scene_times[matched], n_bands),
+                                 'Date': pd.DatetimeIndex(np.repeat(scene_times[matched], n_bands)).date,
+                                 'DALEC_mean_Rrs': mean[matched].ravel(),
+                                 'DALEC_std_Rrs': std[matched].ravel(),
+                                 'n_samples': np.repeat(n_samples[matched], n_bands),
+                                 'mean_offset': pd.to_timedelta(np.repeat(mean_offset[matched], n_bands), unit='s'),
+                                 'max_abs_offset': pd.to_timedelta(np.repeat(max_abs_offset[matched], n_bands),
+                                                                   unit='s')},
+                           index=index)
+    return pairs, summary
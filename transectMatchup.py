@@ -0,0 +1,136 @@
+# matching up every DALEC sample along a transect with satellite scenes (acolite NetCDF or superdoves GeoTIFF)
+# rather than extracting one hand picked coord per scene
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import netCDF4
+import rasterio
+import dalecCube
+import sceneIndex
+import SD_NC_loading
+import SD_raster_loading
+
+def transect_positions(DALEC_log):
+    '''
+    position of each sample in a DALEC log (a dalecCube.DalecCube, or a long/wide format DataFrame from
+    dalecLoad.load_DALEC_log()), returns a df with Sample #, Time, Lat, Lon and valid
+    valid is False where there's no GPS fix (GPS_Fix isn't 'A') or the position is missing / 0, 0
+    (if DALEC_log is already one of these position dfs it's just passed back)
+    '''
+    if isinstance(DALEC_log, pd.DataFrame) and 'valid' in DALEC_log.columns:
+        return DALEC_log
+    if isinstance(DALEC_log, dalecCube.DalecCube):
+        positions = pd.DataFrame(data={'Sample #': DALEC_log.sample,
+                                       'Time': DALEC_log.time,
+                                       'GPS_Fix': DALEC_log.meta['GPS_Fix'],
+                                       'Lat': DALEC_log.lat,
+                                       'Lon': DALEC_log.lon})
+    else:
+        df = DALEC_log.reset_index() if 'Sample #' in DALEC_log.index.names else DALEC_log
+        first = ~df['Sample #'].duplicated().values
+        date = pd.to_datetime(df[' UTC Date'].values[first])
+        positions = pd.DataFrame(data={'Sample #': df['Sample #'].values[first],
+                                       'Time': date + pd.to_timedelta(df[' UTC Time'].values[first]),
+                                       'GPS_Fix': df[' GPS_Fix'].values[first],
+                                       'Lat': df[' Lat'].values[first],
+                                       'Lon': df[' Lon'].values[first]})
+    lat, lon = positions['Lat'].values.astype(np.float64), positions['Lon'].values.astype(np.float64)
+    positions['valid'] = ((positions['GPS_Fix'].astype(str).str.strip() == 'A').values
+                          & np.isfinite(lat) & np.isfinite(lon) & ~((lat == 0) & (lon == 0)))
+    return positions.drop(columns='GPS_Fix')
+
+def _matchup_table(positions, scene, wavelengths, iy, ix, inside, windows, prefix='rho_s_'):
+    '''
+    puts together the per sample table from the windows around each unique pixel
+    windows has shape (n_unique_pixels, n_bands, ...) and iy, ix, inside are per sample
+    '''
+    pixels, pixel_group = np.unique(np.column_stack([iy, ix]), axis=0, return_inverse=True)
+    pixel_group = pixel_group.ravel()
+    flat = windows.reshape(windows.shape[0], windows.shape[1], int(np.prod(windows.shape[2:])))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning) # all NaN windows (eg. outside the scene) are expected
+        mean = np.nanmean(flat, axis=2)
+        std = np.nanstd(flat, axis=2)
+    n_pixels = np.isfinite(flat).all(axis=1).sum(axis=1)
+    table = positions.reset_index(drop=True).copy()
+    table['scene'] = scene
+    table['row'] = iy
+    table['col'] = ix
+    table['inside_scene'] = inside
+    table['pixel_group'] = pixel_group
+    table['n_pixels'] = n_pixels[pixel_group]
+    for b, wavelength in enumerate(wavelengths):
+        name = prefix + '{:g}'.format(wavelength)
+        table[name] = mean[pixel_group, b]
+        table[name + '_std'] = std[pixel_group, b]
+    return table
+
+def _unique_pixels(iy, ix):
+    pixels = np.unique(np.column_stack([iy, ix]), axis=0)
+    return pixels[:, 0], pixels[:, 1]
+
+def matchup_NC(NC_file, DALEC_log, shape=(3, 3), div_by_pi=False, scene=None):
+    '''
+    extracts the pixel window (shape as in SD_NC_loading.get_SD_NC_Spectra_grid()) under every sample with a valid GPS
+    fix from an acolite NetCDF (an open netCDF4.Dataset or a filename)
+    returns one row per sample with the window mean and std of each band, n_pixels (number of pixels with every band),
+    row/col of the centre pixel, inside_scene and pixel_group (samples in the same pixel share a group)
+    - samples which share a pixel only get their window read once, and each band is read once for the whole transect
+    - div_by_pi converts to the same units as DALEC Rrs (like SD_NC_loading.load_multiple_SDs())
+    '''
+    if not isinstance(NC_file, netCDF4.Dataset):
+        with netCDF4.Dataset(NC_file) as f:
+            return matchup_NC(f, DALEC_log, shape=shape, div_by_pi=div_by_pi,
+                              scene=os.path.basename(NC_file) if scene is None else scene)
+    positions = transect_positions(DALEC_log)
+    positions = positions[positions['valid'].values]
+    iy, ix, inside = sceneIndex.get_scene_index(NC_file).query(positions['Lat'].values, positions['Lon'].values)
+    uy, ux = _unique_pixels(iy, ix)
+    _, wavelengths, windows = SD_NC_loading.read_SD_NC_windows(NC_file, uy, ux, shape=shape)
+    if div_by_pi:
+        windows = windows / np.pi
+    if scene is None:
+        try:
+            scene = os.path.basename(NC_file.filepath())
+        except ValueError:
+            scene = ''
+    return _matchup_table(positions, scene, wavelengths, iy, ix, inside, windows)
+
+def matchup_raster(rasterFile, DALEC_log, shape=(3, 3), crs_SD='epsg:32630', crs_coords='WGS 84', scene=None):
+    '''
+    same as matchup_NC() but for a superdoves surface reflectance GeoTIFF (see SD_raster_loading), with the window
+    shape as in SD_raster_loading.getSpectraFromSDSR_grid()
+    '''
+    positions = transect_positions(DALEC_log)
+    positions = positions[positions['valid'].values]
+    with rasterio.open(rasterFile) as dataset:
+        rows, cols = SD_raster_loading.coords_to_pixels(dataset, positions['Lat'].values, positions['Lon'].values,
+                                                        crs_SD=crs_SD, crs_coords=crs_coords)
+        inside = (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
+        ur, uc = _unique_pixels(rows, cols)
+        windows = SD_raster_loading.read_SDSR_windows(dataset, ur, uc, shape=shape)
+    if scene is None:
+        scene = os.path.basename(rasterFile)
+    return _matchup_table(positions, scene, SD_raster_loading.SDSR_WAVELENGTHS, rows, cols, inside, windows)
+
+def matchup_scenes(scene_files, DALEC_log, shape=(3, 3), insideOnly=True, div_by_pi=False,
+                   crs_SD='epsg:32630', crs_coords='WGS 84'):
+    '''
+    matches a transect up with a list of scenes (.nc files use matchup_NC(), anything else matchup_raster())
+    returns one table with a row per sample per scene (only samples inside each scene if insideOnly)
+    - the NetCDF and GeoTIFF band centres are slightly different, so mixing the two gives NaNs in the other's columns
+    '''
+    positions = transect_positions(DALEC_log)
+    tables = []
+    for file in scene_files:
+        if str(file).endswith('.nc'):
+            table = matchup_NC(file, positions, shape=shape, div_by_pi=div_by_pi)
+        else:
+            table = matchup_raster(file, positions, shape=shape, crs_SD=crs_SD, crs_coords=crs_coords)
+        if insideOnly:
+            table = table[table['inside_scene'].values]
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame()
+    return pd.concat(tables, ignore_index=True)